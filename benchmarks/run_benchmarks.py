@@ -0,0 +1,191 @@
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import SCALES, synthetic_grid, synthetic_POI
+
+"""
+Benchmarks of the analysis hot paths on synthetic data (no Overpass, fully offline).
+Run from the root of the repository :
+python -m benchmarks.run_benchmarks --scales paris petite_couronne
+python -m benchmarks.run_benchmarks --compare benchmarks/results/<previous run>.json
+
+Each run is saved as a json file in benchmarks/results (time and peak memory by function and scale),
+so that regressions between versions are visible with --compare.
+"""
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+CATEGORIES = ['restaurant', 'culture and art', 'education', 'food_shops', 'fashion_beauty', 'supply_shops']
+
+# biggest grid (number of squares) on which each function is run by default,
+# above it the function is too slow or needs too much memory (dense n x n weights)
+MAX_SQUARES = {
+    "find_cat" : 40000,
+    "aggregating_from_dummies_on_grid" : 8000,
+    "calculate_distanceband_weights" : 8000,
+    "calculate_2SFCA_accessibility" : 8000,
+    "aggregate_2SFCA" : None,
+    "KMeansInterp.fit" : None,
+}
+
+def measure(f, setup = lambda: (), repeat = 3, memory = True):
+    """
+    Run f(*setup()) repeat times, setup is not timed.
+    Returns (best time in seconds, peak memory in MB traced by tracemalloc or nan, last result)
+    The memory is measured in an extra run, since tracemalloc slows down the code.
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        gc.collect()
+        t = time.perf_counter()
+        result = f(*args)
+        times.append(time.perf_counter() - t)
+    peak = np.nan
+    if memory:
+        args = setup()
+        gc.collect()
+        tracemalloc.start()
+        f(*args)
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return min(times), peak, result
+
+def bench_scale(scale, n_squares, poi_by_square = 15, repeat = 3, memory = True, max_squares = MAX_SQUARES,
+    functions = None):
+    """
+    Benchmark every function on one synthetic grid.
+    Returns a list of results (dict)
+    """
+    from helpers import scrapping
+    from kmeans_interp.kmeans_feature_imp import KMeansInterp
+
+    results = []
+    grid = synthetic_grid(n_squares)
+    pois = synthetic_POI(grid, poi_by_square = poi_by_square)
+    state = {}
+
+    def run(name, f, setup, needs = ()):
+        if functions is not None and name not in functions:
+            return
+        record = {"function" : name, "scale" : scale, "n_squares" : len(grid), "n_poi" : len(pois)}
+        limit = max_squares.get(name)
+        missing = [n for n in needs if n not in state]
+        if limit is not None and len(grid) > limit:
+            record.update(seconds = np.nan, peak_mb = np.nan, status = f"skipped (more than {limit} squares)")
+        elif missing:
+            record.update(seconds = np.nan, peak_mb = np.nan, status = f"skipped (needs {', '.join(missing)})")
+        else:
+            try:
+                seconds, peak, state[name] = measure(f, setup, repeat = repeat, memory = memory)
+                record.update(seconds = seconds, peak_mb = peak, status = "ok")
+            except Exception as e:
+                record.update(seconds = np.nan, peak_mb = np.nan, status = f"error ({e.__class__.__name__}: {e})")
+        print(f"{scale:>16} {name:>34} : {record['seconds']:10.4f} s {record['peak_mb']:10.1f} MB  {record['status']}")
+        results.append(record)
+
+    run("find_cat",
+        lambda df: scrapping.find_cat(df, CATEGORIES, dummy = True),
+        lambda: (pois.copy(),))
+    run("aggregating_from_dummies_on_grid",
+        lambda g, p: scrapping.aggregating_from_dummies_on_grid(g, p, categories = CATEGORIES),
+        lambda: (grid.copy(), state["find_cat"]),
+        needs = ("find_cat",))
+    run("calculate_distanceband_weights",
+        lambda g: scrapping.calculate_distanceband_weights(g),
+        lambda: (grid.copy(),))
+
+    counts = grid.copy()
+    counts[CATEGORIES] = np.random.default_rng(0).poisson(poi_by_square/len(CATEGORIES), (len(grid), len(CATEGORIES)))
+    counts = counts.set_index("IdINSPIRE")
+    run("calculate_2SFCA_accessibility",
+        lambda g, w: scrapping.calculate_2SFCA_accessibility(g, CATEGORIES, w),
+        lambda: (counts.copy(), state["calculate_distanceband_weights"]),
+        needs = ("calculate_distanceband_weights",))
+
+    access = counts.copy()
+    if "calculate_2SFCA_accessibility" in state:
+        access = access.join(state["calculate_2SFCA_accessibility"].add_suffix("_access"))
+    else:
+        access[[c + "_access" for c in CATEGORIES]] = np.random.default_rng(1).uniform(size = (len(grid), len(CATEGORIES)))
+    run("aggregate_2SFCA",
+        lambda g: scrapping.aggregate_2SFCA(g, categories = CATEGORIES),
+        lambda: (access.copy(),))
+
+    features = ["Ind", "Men_pauv", "Log_soc", "Ind_65_79"] + CATEGORIES
+    X = access[features].values.astype(float)
+    X = (X - X.mean(axis = 0))/X.std(axis = 0)
+    run("KMeansInterp.fit",
+        lambda X: KMeansInterp(ordered_feature_names = features, n_clusters = 5, n_init = 3, random_state = 0).fit(X),
+        lambda: (X,))
+    return results
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True, check = True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(results, previous_file, tolerance = 1.25):
+    """
+    Print the time ratio with a previous run for each (function, scale).
+    Returns the DataFrame of the regressions (ratio above tolerance)
+    """
+    with open(previous_file) as f:
+        previous = pd.DataFrame(json.load(f)["results"])
+    current = pd.DataFrame(results)
+    merged = current.merge(previous, on = ["function", "scale"], suffixes = ("", "_previous"))
+    merged["ratio"] = merged["seconds"]/merged["seconds_previous"]
+    print(merged[["function", "scale", "seconds_previous", "seconds", "ratio"]].to_string(index = False))
+    return merged[merged["ratio"] > tolerance]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the analysis functions on synthetic grids (offline)")
+    parser.add_argument("-s", "--scales", nargs = "+", default = ["paris", "petite_couronne"],
+        help = "scales among " + ", ".join(SCALES) + " or numbers of squares, default=paris petite_couronne")
+    parser.add_argument("-f", "--functions", nargs = "+", default = None, help = "only these functions")
+    parser.add_argument("-r", "--repeat", type = int, default = 3, help = "number of timed runs, default=3")
+    parser.add_argument("--poi-by-square", type = float, default = 15, help = "default=15 (Paris)")
+    parser.add_argument("--no-memory", action = "store_true", help = "do not measure the peak memory")
+    parser.add_argument("--no-limit", action = "store_true", help = "run every function at every scale")
+    parser.add_argument("-o", "--outfile", help = "default=benchmarks/results/[date]_[commit].json")
+    parser.add_argument("-c", "--compare", help = "previous result file to compare with")
+    parser.add_argument("--tolerance", type = float, default = 1.25, help = "slowdown ratio counted as a regression, default=1.25")
+    args = parser.parse_args()
+
+    max_squares = {} if args.no_limit else MAX_SQUARES
+    results = []
+    for scale in args.scales:
+        n_squares = SCALES[scale] if scale in SCALES else int(scale)
+        results += bench_scale(scale, n_squares, poi_by_square = args.poi_by_square, repeat = args.repeat,
+            memory = not args.no_memory, max_squares = max_squares, functions = args.functions)
+
+    commit = git_commit()
+    meta = {"commit" : commit, "date" : datetime.datetime.now().isoformat(timespec = "seconds"),
+            "python" : platform.python_version(), "machine" : platform.machine(), "processor" : platform.processor(),
+            "numpy" : np.__version__, "pandas" : pd.__version__, "argv" : sys.argv[1:]}
+    outfile = args.outfile
+    if outfile is None:
+        os.makedirs(RESULTS_DIR, exist_ok = True)
+        outfile = os.path.join(RESULTS_DIR, datetime.date.today().isoformat() + "_" + commit + ".json")
+    with open(outfile, "w") as f:
+        json.dump({"meta" : meta, "results" : results}, f, indent = 1, default = float)
+    print("results written in " + outfile)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if len(regressions) > 0:
+            print(f"{len(regressions)} regression(s) above x{args.tolerance}")
+            sys.exit(1)
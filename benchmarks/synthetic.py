@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+from helpers.grid import inspire_squares, parse_inspire_ids, project_xy, INSPIRE_CRS, WGS84
+from helpers.scrapping import amenities, shops
+
+"""
+Synthetic INSPIRE grids and POI tables, shaped like data/Filosofi2015_carreaux_200m_paris.csv
+and like the output of helpers.get_place_POI, to benchmark the analysis without Overpass.
+Run from the root of the repository (python -m benchmarks.run_benchmarks) so that helpers is importable.
+"""
+
+# number of 200m squares of each scale (Paris is the size of the data folder grid)
+SCALES = {
+    "paris" : 2000,
+    "petite_couronne" : 8000,
+    "idf" : 40000,
+    "national" : 2300000,
+}
+
+# Paris south-west corner in EPSG:3035
+ORIGIN_E = 3755000
+ORIGIN_N = 2884000
+
+AGE_COLUMNS = ["Ind_0_3", "Ind_4_5", "Ind_6_10", "Ind_11_17", "Ind_18_24", "Ind_25_39",
+               "Ind_40_54", "Ind_55_64", "Ind_65_79", "Ind_80p", "Ind_inc"]
+MEN_COLUMNS = ["Men", "Men_pauv", "Men_1ind", "Men_5ind", "Men_prop", "Men_fmp", "Men_surf",
+               "Men_coll", "Men_mais"]
+LOG_COLUMNS = ["Log_av45", "Log_45_70", "Log_70_90", "Log_ap90", "Log_inc", "Log_soc"]
+
+def synthetic_grid(n_squares : int, res = 200, geometry = True, crs = "EPSG:4326", seed = 0):
+    """
+    Square block of n_squares INSPIRE squares with Filosofi-like columns.
+    geometry : if True returns a GeoDataFrame (squares rebuilt from the ids in crs), else a DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n_squares)))
+    k = np.arange(n_squares)
+    e = ORIGIN_E + (k % side)*res
+    n = ORIGIN_N + (k // side)*res
+    ids = "CRS3035RES" + str(res) + "mN" + pd.Series(n).astype(str) + "E" + pd.Series(e).astype(str)
+    ids_1km = "CRS3035RES1000mN" + pd.Series(n//1000*1000).astype(str) + "E" + pd.Series(e//1000*1000).astype(str)
+
+    df = pd.DataFrame({
+        "IdINSPIRE" : ids.values,
+        "Id_carr1km" : ids_1km.values,
+        "I_est_cr" : 0,
+        "Id_carr_n" : ids.values,
+        "Groupe" : rng.integers(800000, 900000, n_squares),
+        "Depcom" : rng.choice([75101 + i for i in range(20)] + [92012, 93066, 94028], n_squares),
+        "I_pauv" : 0,
+        "Id_car2010" : ids.values,
+    })
+    ind = rng.gamma(2, 400, n_squares).round(1)
+    df["Ind"] = ind
+    for c in MEN_COLUMNS:
+        df[c] = (ind*rng.uniform(0.05, 0.5, n_squares)).round()
+    df["Ind_snv"] = (ind*rng.normal(25000, 8000, n_squares)).round(1)
+    for c in LOG_COLUMNS:
+        df[c] = (ind*rng.uniform(0, 0.2, n_squares)).round()
+    shares = rng.dirichlet(np.ones(len(AGE_COLUMNS)), n_squares)
+    for j, c in enumerate(AGE_COLUMNS):
+        df[c] = (ind*shares[:, j]).round(1)
+    df["I_est_1km"] = 0
+    df["DEP"] = df["Depcom"] // 1000
+
+    if not geometry:
+        return df
+    import geopandas as gpd
+
+    return gpd.GeoDataFrame(df, geometry = inspire_squares(df["IdINSPIRE"], crs_to = crs).values, crs = crs)
+
+def synthetic_POI(grid, poi_by_square = 15, seed = 0, geometry = True):
+    """
+    Random POI (points) inside the grid squares, with name, amenity and shop tags
+    as returned by helpers.get_place_POI before find_cat.
+    Paris has about 30 000 POI for 2 000 squares, so 15 POI by square.
+    """
+    rng = np.random.default_rng(seed)
+    n_poi = int(len(grid)*poi_by_square)
+    p = parse_inspire_ids(grid["IdINSPIRE"])
+    square = rng.integers(0, len(grid), n_poi)
+    x = p["e"].values[square] + rng.uniform(0, 1, n_poi)*p["res"].values[square]
+    y = p["n"].values[square] + rng.uniform(0, 1, n_poi)*p["res"].values[square]
+    long, lat = project_xy(x, y, INSPIRE_CRS, WGS84)
+
+    # half amenities, half shops, and 10% of tags out of interest
+    is_shop = rng.uniform(size = n_poi) < 0.5
+    out = rng.uniform(size = n_poi) < 0.1
+    amenity = np.where(~is_shop, rng.choice(amenities, n_poi), None).astype(object)
+    shop = np.where(is_shop, rng.choice(shops, n_poi), None).astype(object)
+    amenity[out & ~is_shop] = "bench"
+    shop[out & is_shop] = "yes"
+    df = pd.DataFrame({
+        "name" : "poi_" + pd.Series(np.arange(n_poi)).astype(str),
+        "amenity" : amenity,
+        "shop" : shop,
+    })
+    if not geometry:
+        df["long"], df["lat"] = long, lat
+        return df
+    import geopandas as gpd
+    points = gpd.points_from_xy(long, lat)
+    gdf = gpd.GeoDataFrame(df, geometry = points, crs = WGS84)
+    gdf["center"] = gpd.GeoSeries(points, crs = WGS84)
+    return gdf
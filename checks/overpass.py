@@ -0,0 +1,124 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from helpers.overpass import OverpassClient
+
+"""
+Check of helpers.overpass.OverpassClient against a local stand-in of the Overpass API (no network) :
+- 429 (with Retry-After) and 503 answers are retried until the query succeeds,
+- at most concurrency queries are run at once by the server,
+- the /status of the server is read before the queries,
+- a run stopped by an error resumes from the saved answers : only the queries without answer are sent again.
+Run from the root of the repository :
+python -m checks.overpass
+"""
+
+class StandInOverpass:
+    """
+    Local Overpass API on a free port : the n-th post of a query is answered with failures[n] (an http status)
+    while n < len(failures), then with {"elements" : [{"query" : query}]}.
+    fatal : queries answered with 500 (not retried by the client), to stop a run
+    """
+    def __init__(self, failures = (429, 503), fatal = (), delay = 0.02):
+        self.failures = list(failures)
+        self.fatal = set(fatal)
+        self.delay = delay
+        self.posts, self.status_reads = {}, 0
+        self.running, self.max_running = 0, 0
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code, body = b"", headers = {}):
+                self.send_response(code)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with stand_in.lock:
+                    stand_in.status_reads += 1
+                self._send(200, b"Connected as: 1\nRate limit: 2\n2 slots available now.\n")
+
+            def do_POST(self):
+                length = int(self.headers["Content-Length"])
+                query = parse_qs(self.rfile.read(length).decode())["data"][0]
+                with stand_in.lock:
+                    n = stand_in.posts.get(query, 0)
+                    stand_in.posts[query] = n + 1
+                    stand_in.running += 1
+                    stand_in.max_running = max(stand_in.max_running, stand_in.running)
+                time.sleep(stand_in.delay)
+                with stand_in.lock:
+                    stand_in.running -= 1
+                if query in stand_in.fatal:
+                    self._send(500)
+                elif n < len(stand_in.failures):
+                    self._send(stand_in.failures[n], headers = {"Retry-After" : "0"})
+                else:
+                    self._send(200, json.dumps({"elements" : [{"query" : query}]}).encode())
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.endpoint = f"http://127.0.0.1:{self.server.server_port}/api"
+
+    def __enter__(self):
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+def check(n_queries = 12, concurrency = 3):
+    queries = [f"[out:json];node(id:{i});out;" for i in range(n_queries)]
+    errors = []
+    with tempfile.TemporaryDirectory() as progress_dir:
+        # first run : every query fails twice (429 then 503), one query fails for good and stops the run
+        with StandInOverpass(fatal = [queries[-1]]) as server:
+            client = OverpassClient(endpoint = server.endpoint, concurrency = concurrency, rate = 100,
+                backoff = 0.01, max_backoff = 0.05, progress_dir = progress_dir)
+            try:
+                client.fetch_queries(queries)
+                errors.append("the 500 answer did not stop the run")
+            except Exception:
+                pass
+            # the queries still running when the run stopped are cancelled, the others are saved
+            saved = [q for q in queries if os.path.exists(client._progress_file(q))]
+            if len(saved) != client.stats["queries"] or queries[-1] in saved:
+                errors.append(f"{len(saved)} answers saved for {client.stats['queries']} answered queries")
+            if any(server.posts[q] != 3 for q in saved):
+                errors.append("saved answers not obtained after their 2 retries")
+            if server.max_running > concurrency:
+                errors.append(f"{server.max_running} queries at once, concurrency = {concurrency}")
+            if server.status_reads == 0:
+                errors.append("the status of the server was not read")
+            print(f"first run : {client.stats}, at most {server.max_running} queries at once")
+
+        # second run : the saved answers are reused, only the other queries are sent
+        with StandInOverpass(failures = [429]) as server:
+            client = OverpassClient(endpoint = server.endpoint, concurrency = concurrency, rate = 100,
+                backoff = 0.01, max_backoff = 0.05, progress_dir = progress_dir)
+            answers = client.fetch_queries(queries)
+            if set(server.posts) != set(queries) - set(saved):
+                errors.append(f"resumed run sent {len(server.posts)} queries instead of {n_queries - len(saved)}")
+            if [a["elements"][0]["query"] for a in answers] != queries:
+                errors.append("answers not in the order of the queries")
+            print(f"resumed run : {client.stats}")
+    for e in errors:
+        print(e)
+    print("ok" if not errors else f"{len(errors)} errors")
+    return len(errors)
+
+if __name__ == "__main__":
+    sys.exit(1 if check() else 0)
@@ -0,0 +1,97 @@
+import sys
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from helpers.regression import batch_regressions
+
+"""
+Check of the LM tests of helpers.batch_regressions against a dense reference (the formulas of spreg.LMtests
+with dense matrices) and against spreg.LMtests itself if spreg is installed, for weights that are not row
+standardized (binary W) and row standardized weights with an island (row of zeros).
+Run from the root of the repository :
+python -m checks.regression
+"""
+
+TESTS = ["LM error", "LM lag", "Robust LM error", "Robust LM lag", "LM SARMA"]
+
+def random_weights(n, k = 4, island = False, row_standardize = False, seed = 0):
+    """
+    Symmetric binary W of the k nearest neighbours of random points, the first point without neighbours if island
+    """
+    rng = np.random.default_rng(seed)
+    xy = rng.random((n, 2))
+    d = np.hypot(*(xy[:, None, :] - xy[None, :, :]).transpose(2, 0, 1))
+    np.fill_diagonal(d, np.inf)
+    W = np.zeros((n, n))
+    W[np.repeat(np.arange(n), k), np.argsort(d, axis = 1)[:, :k].ravel()] = 1
+    W = np.maximum(W, W.T)
+    if island:
+        W[0, :] = W[:, 0] = 0
+    if row_standardize:
+        rows = W.sum(axis = 1, keepdims = True)
+        W = np.divide(W, rows, out = np.zeros_like(W), where = rows > 0)
+    return W
+
+def dense_lm_tests(y, X, W):
+    """
+    LM tests of Anselin (1996) with dense matrices, as spreg.LMtests
+    """
+    n = len(y)
+    X = np.column_stack([np.ones(n), X])
+    B = np.linalg.solve(X.T @ X, X.T @ y)
+    e = y - X @ B
+    s2 = e @ e/n
+    M = np.eye(n) - X @ np.linalg.inv(X.T @ X) @ X.T
+    T = np.trace(W.T @ W + W @ W)
+    WXB = W @ X @ B
+    nJ = (WXB @ M @ WXB + T*s2)/s2
+    lme, lml = e @ W @ e/s2, e @ W @ y/s2
+    return {"LM error" : lme**2/T, "LM lag" : lml**2/nJ,
+            "Robust LM error" : (lme - T/nJ*lml)**2/(T*(1 - T/nJ)),
+            "Robust LM lag" : (lml - lme)**2/(nJ - T),
+            "LM SARMA" : (lml - lme)**2/(nJ - T) + lme**2/T}
+
+def spreg_lm_tests(y, X, W):
+    """
+    spreg.LMtests, None if spreg or libpysal is not installed
+    """
+    try:
+        import libpysal
+        import spreg
+    except ImportError:
+        return None
+    w = libpysal.weights.WSP(sparse.csr_matrix(W)).to_W(silence_warnings = True)
+    ols = spreg.OLS(y[:, None], X)
+    lm = spreg.LMtests(ols, w)
+    return {"LM error" : lm.lme[0], "LM lag" : lm.lml[0], "Robust LM error" : lm.rlme[0],
+            "Robust LM lag" : lm.rlml[0], "LM SARMA" : lm.sarma[0]}
+
+def check(n = 300, rtol = 1e-8):
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({"x1" : rng.normal(size = n), "x2" : rng.normal(size = n)})
+    failed = 0
+    for name, W in [("binary", random_weights(n)),
+                    ("binary with island", random_weights(n, island = True)),
+                    ("row standardized with island", random_weights(n, island = True, row_standardize = True))]:
+        # y with a spatial lag, so that the tests are not all close to 0
+        df["y"] = np.linalg.solve(np.eye(n) - 0.4*W/max(1, W.sum(axis = 1).max()), 1 + df["x1"] - 2*df["x2"] + rng.normal(size = n))
+        table = batch_regressions(df, ["y"], ["x1", "x2"], sparse.csr_matrix(W), models = ["ols"])
+        result = table[table["kind"] == "test"].set_index("term")["statistic"]
+        references = {"dense" : dense_lm_tests(df["y"].to_numpy(), df[["x1", "x2"]].to_numpy(), W),
+                      "spreg" : spreg_lm_tests(df["y"].to_numpy(), df[["x1", "x2"]].to_numpy(), W)}
+        for reference, expected in references.items():
+            if expected is None:
+                print(f"{name} : spreg not installed, skipped")
+                continue
+            for test in TESTS:
+                if not np.isclose(result[test], expected[test], rtol = rtol):
+                    failed += 1
+                    print(f"{name} : {test} = {result[test]:.8g}, {reference} {expected[test]:.8g}")
+            print(f"{name} : compared to {reference}")
+    print("ok" if failed == 0 else f"{failed} differences")
+    return failed
+
+if __name__ == "__main__":
+    sys.exit(1 if check() else 0)
@@ -1,16 +1,52 @@
-print("--- Import helpers ---")
-
 import os
 os.environ['USE_PYGEOS'] = '0'
 
+# heavy dependencies (osmnx, pysal, folium...) are imported lazily by the modules, 
+# when a function needs them : see helpers.lazy
+from . import lazy
+from . import tracing
+from . import grid
+from . import network
 from . import scrapping
+from . import overpass
+from . import accessibility
+from . import inequality
+from . import shared
 from . import visualize
-
-#to assure that reload(helpers) reloads everything in the folder.
-from importlib import reload
-reload(scrapping)
-reload(visualize)
+from . import poi_index
+from . import composition
+from . import autocorrelation
+from . import regression
 
 #to not have to import each file separetly.
+from .grid import *
+from .network import *
 from .scrapping import *
+from .overpass import *
+from .accessibility import *
+from .inequality import *
+from .shared import *
 from .visualize import *
+from .poi_index import *
+from .composition import *
+from .autocorrelation import *
+from .regression import *
+
+# modules reloaded by reload_all, in the order of their imports
+_library_modules = ["grid", "network", "scrapping", "overpass", "accessibility", "inequality", "shared", "visualize",
+                    "poi_index", "composition", "autocorrelation", "regression"]
+
+def reload_all():
+    """
+    Reload every module of helpers after editing them (in a notebook) : helpers = helpers.reload_all()
+    The command line modules already imported (pipeline, cities...) are reloaded after the library ones.
+    """
+    import sys
+    from importlib import reload
+    for name in _library_modules:
+        reload(sys.modules[__name__ + "." + name])
+    for name, module in list(sys.modules.items()):
+        if name.startswith(__name__ + ".") and name.split(".")[-1] not in _library_modules + ["lazy", "tracing"] \
+            and module is not None:
+            reload(module)
+    return reload(sys.modules[__name__])
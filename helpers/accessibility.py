@@ -0,0 +1,317 @@
+import numpy as np
+import pandas as pd
+
+from .lazy import lazy_import
+from .grid import METRIC_CRS, WGS84
+from .tracing import span, traced
+
+spatial = lazy_import("scipy.spatial")
+sparse = lazy_import("scipy.sparse")
+stats = lazy_import("scipy.stats")
+
+"""
+Sensitivity analysis of the 2SFCA : accessibility for several catchment radii and distance decay kernels.
+The neighbours of every square are searched once at the biggest radius, the pairs are sorted by distance,
+so that the pairs within a smaller radius are a prefix of them. The weights of each (radius, kernel)
+are then a sparse matrix built from that prefix, and the 2SFCA is two sparse products.
+"""
+
+# relative weights of the E2SFCA zones (Luo & Qi 2009), the radius being cut in len(STEPS) equal zones
+STEPS = [1.0, 0.68, 0.22]
+
+def _inverse(d, radius):
+    # same weights as calculate_distanceband_weights : 1/d normalized by 10*radius, 1 for the square itself
+    with np.errstate(divide = "ignore"):
+        return np.where(d > 0, 1/(d*10*radius), 1.0)
+
+def _binary(d, radius):
+    return np.ones_like(d)
+
+def _stepped(d, radius, steps = STEPS):
+    zone = np.minimum((d/radius*len(steps)).astype(int), len(steps) - 1)
+    return np.asarray(steps)[zone]
+
+def _gaussian(d, radius):
+    # Gaussian decay reaching 0 at the radius (Dai 2010)
+    return (np.exp(-0.5*(d/radius)**2) - np.exp(-0.5))/(1 - np.exp(-0.5))
+
+def _exponential(d, radius):
+    # exp(-3d/radius) : 5% of the weight left at the radius
+    return np.exp(-3*d/radius)
+
+KERNELS = {
+    "inverse" : _inverse,
+    "binary" : _binary,
+    "stepped" : _stepped,
+    "gaussian" : _gaussian,
+    "exponential" : _exponential,
+}
+
+@traced("neighbours")
+def neighbour_distances(gdf, max_radius, idCol = "IdINSPIRE", geometryCol = "geometry", metric_crs = METRIC_CRS):
+    """
+    Pairs of squares (the square itself included) whose centroids are closer than max_radius (km),
+    sorted by distance.
+    gdf : GeoDataFrame of the squares, with idCol as a column or as index
+    Returns a dict with ids (array of n ids), i, j (positions of the squares of each pair) and d (distance in km)
+    """
+    ids = gdf[idCol].to_numpy() if idCol in gdf.columns else gdf.index.to_numpy()
+    geoms = gdf[geometryCol]
+    if geoms.crs is None:
+        geoms = geoms.set_crs(WGS84)
+    centroids = geoms.to_crs(metric_crs).centroid
+    coords = np.column_stack([centroids.x.values, centroids.y.values])/1000
+    tree = spatial.cKDTree(coords)
+    pairs = tree.query_pairs(max_radius, output_type = "ndarray")
+    n = len(coords)
+    i = np.concatenate([pairs[:, 0], pairs[:, 1], np.arange(n)])
+    j = np.concatenate([pairs[:, 1], pairs[:, 0], np.arange(n)])
+    d = np.linalg.norm(coords[i] - coords[j], axis = 1)
+    order = np.argsort(d, kind = "stable")
+    return {"ids" : ids, "i" : i[order], "j" : j[order], "d" : d[order], "max_radius" : max_radius}
+
+def kernel_weights(neighbours, radius, kernel = "inverse"):
+    """
+    Sparse (n x n) weight matrix of the pairs within radius (km), from neighbour_distances
+    kernel : a name of KERNELS or a function (d, radius) -> weights
+    """
+    if radius > neighbours["max_radius"]:
+        raise ValueError(f"radius {radius} is bigger than the radius of the neighbour search ({neighbours['max_radius']})")
+    f = KERNELS[kernel] if isinstance(kernel, str) else kernel
+    k = np.searchsorted(neighbours["d"], radius, side = "right")
+    n = len(neighbours["ids"])
+    w = f(neighbours["d"][:k], radius)
+    return sparse.csr_matrix((w, (neighbours["i"][:k], neighbours["j"][:k])), shape = (n, n))
+
+def _2SFCA(W, supply, population):
+    """
+    supply : (n x categories) array, population : (n,) array of the weighted population
+    Same result as calculate_2SFCA_accessibility with the weights W
+    """
+    demand = W.T @ population
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        ratio = supply/demand[:, None]
+    # 0/0 is skipped by the sum of calculate_2SFCA_accessibility_var
+    ratio[np.isnan(ratio)] = 0
+    return W.T @ ratio
+
+@traced("sweep")
+def sweep_2SFCA(gdf, interestsVar, radii = [0.5, 1, 1.5, 2], kernels = ["binary", "stepped", "gaussian", "exponential"],
+    weight_age = {
+        'Ind_0_3':1,
+        "Ind_4_5" : 1,
+        "Ind_6_10" : 1,
+        "Ind_11_17" : 1,
+        "Ind_18_24" : 1,
+        "Ind_25_39" : 1,
+        "Ind_40_54" : 1,
+        "Ind_55_64" : 1,
+        "Ind_65_79" : 1,
+        "Ind_80p" : 1,
+        "Ind_inc" : 1
+    },
+    idCol = "IdINSPIRE", geometryCol = "geometry", metric_crs = METRIC_CRS, wide = False):
+    """
+    2SFCA accessibility for every (radius, kernel), with one neighbour search.
+    gdf : GeoDataFrame of the squares with the supply (interestsVar) and the Ind_ columns
+    interestsVar : list of the categories (counts of POI by square)
+    radii : catchment radii in km
+    kernels : names of KERNELS (inverse is the weight of calculate_distanceband_weights) or functions (d, radius) -> weights
+    weight_age : as in calculate_2SFCA_accessibility
+    wide : if True returns one column by (category, radius, kernel) instead of the tidy table
+
+    Returns a DataFrame with columns IdINSPIRE, category, radius, kernel, access
+    """
+    neighbours = neighbour_distances(gdf, max(radii), idCol = idCol, geometryCol = geometryCol, metric_crs = metric_crs)
+    supply = gdf[interestsVar].to_numpy(dtype = float)
+    population = gdf[list(weight_age)].to_numpy(dtype = float) @ np.array(list(weight_age.values()), dtype = float)
+    ids = neighbours["ids"]
+    n, k = supply.shape
+
+    results = []
+    for radius in radii:
+        for kernel in kernels:
+            name = kernel if isinstance(kernel, str) else kernel.__name__
+            with span("sweep_config", radius = radius, kernel = name):
+                access = _2SFCA(kernel_weights(neighbours, radius, kernel), supply, population)
+            results.append(pd.DataFrame({
+                idCol : np.tile(ids, k),
+                "category" : np.repeat(interestsVar, n),
+                "radius" : radius,
+                "kernel" : name,
+                "access" : access.ravel(order = "F"),
+            }))
+    tidy = pd.concat(results, ignore_index = True)
+    if wide:
+        return tidy.pivot(index = idCol, columns = ["category", "radius", "kernel"], values = "access")
+    return tidy
+
+##########################################
+##### Uncertainty ########
+##########################################
+
+AGE_COLUMNS = ['Ind_0_3', "Ind_4_5", "Ind_6_10", "Ind_11_17", "Ind_18_24", "Ind_25_39",
+               "Ind_40_54", "Ind_55_64", "Ind_65_79", "Ind_80p", "Ind_inc"]
+
+def _draw(spec, rng, size):
+    """
+    spec : a number (fixed), a tuple (low, high) (uniform), a list (uniform choice among the values),
+    a scipy.stats distribution (with rvs) or a function (rng, size) -> array
+    """
+    if callable(getattr(spec, "rvs", None)):
+        return np.asarray(spec.rvs(size = size, random_state = rng), dtype = float)
+    if callable(spec):
+        return np.asarray(spec(rng, size), dtype = float)
+    if isinstance(spec, tuple):
+        return rng.uniform(spec[0], spec[1], size)
+    if isinstance(spec, list):
+        return rng.choice(np.asarray(spec, dtype = float), size)
+    return np.full(size, float(spec))
+
+@traced("monte_carlo")
+def monte_carlo_2SFCA(gdf, interestsVar, n_draws = 1000,
+    weight_age = {c : (0.5, 1.5) for c in AGE_COLUMNS},
+    threshold = (0.5, 1.5), threshold_step = 0.1, kernel = "inverse",
+    quantiles = (0.05, 0.5, 0.95), seed = 0, batch_size = 256,
+    idCol = "IdINSPIRE", geometryCol = "geometry", metric_crs = METRIC_CRS, return_draws = False):
+    """
+    Uncertainty of the 2SFCA accessibility when weight_age and the distance threshold are not known exactly.
+    gdf : GeoDataFrame of the squares with the supply (interestsVar) and the Ind_ columns
+    weight_age : dict age column -> distribution of its weight (see _draw : number, (low, high), list, scipy.stats...)
+    threshold : distribution of the threshold (km). The draws are rounded to threshold_step,
+    so that the draws with the same threshold share one sparse weight matrix.
+    kernel : distance decay, see KERNELS (inverse is the weight of calculate_distanceband_weights)
+
+    For each threshold, the demands of all its draws are one sparse product (draws stacked as columns),
+    and the accessibilities of all categories and draws are a second one, by batches of batch_size draws.
+
+    Returns a tidy DataFrame : IdINSPIRE, category, mean, std, q[quantiles], and the rank of the square
+    among the squares (0 least accessible, 1 most, ties share their mean rank) : rank_mean, rank_std, rank_low and rank_high (quantiles[0] and [-1]).
+    With return_draws, also returns the DataFrame of the drawn parameters.
+    """
+    rng = np.random.default_rng(seed)
+    draws = pd.DataFrame({c : _draw(spec, rng, n_draws) for c, spec in weight_age.items()})
+    draws["threshold"] = np.maximum(np.round(_draw(threshold, rng, n_draws)/threshold_step), 1)*threshold_step
+    draws["threshold"] = draws["threshold"].round(10)
+
+    neighbours = neighbour_distances(gdf, draws["threshold"].max(), idCol = idCol, geometryCol = geometryCol, metric_crs = metric_crs)
+    ids = neighbours["ids"]
+    supply = gdf[interestsVar].to_numpy(dtype = float)
+    ages = gdf[list(weight_age)].to_numpy(dtype = float)
+    n, k = supply.shape
+    access = np.empty((k, n, n_draws), dtype = np.float32)
+
+    for radius, group in draws.groupby("threshold"):
+        with span("monte_carlo_threshold", radius = radius, rows = len(group)):
+            W = kernel_weights(neighbours, radius, kernel)
+            WT = W.T.tocsr()
+            columns = group.index.to_numpy()
+            for start in range(0, len(columns), batch_size):
+                batch = columns[start:start + batch_size]
+                population = ages @ draws.loc[batch, list(weight_age)].to_numpy().T
+                demand = WT @ population
+                with np.errstate(divide = "ignore", invalid = "ignore"):
+                    ratio = supply[:, :, None]/demand[:, None, :]
+                ratio[np.isnan(ratio)] = 0
+                result = WT @ ratio.reshape(n, -1)
+                access[:, :, batch] = result.reshape(n, k, len(batch)).transpose(1, 0, 2)
+
+    alpha = [quantiles[0], quantiles[-1]]
+    tables = []
+    for c, cat in enumerate(interestsVar):
+        a = access[c]
+        # rank of each square in each draw, the squares with the same accessibility (0 without POI around) share their mean rank
+        ranks = ((stats.rankdata(a, method = "average", axis = 0) - 1)/max(n - 1, 1)).astype(np.float32)
+        table = pd.DataFrame({idCol : ids, "category" : cat,
+            "mean" : a.mean(axis = 1), "std" : a.std(axis = 1)})
+        for q, values in zip(quantiles, np.quantile(a, quantiles, axis = 1)):
+            table[f"q{q:g}"] = values
+        table["rank_mean"] = ranks.mean(axis = 1)
+        table["rank_std"] = ranks.std(axis = 1)
+        table["rank_low"], table["rank_high"] = np.quantile(ranks, alpha, axis = 1)
+        tables.append(table)
+    result = pd.concat(tables, ignore_index = True)
+    if return_draws:
+        return result, draws
+    return result
+
+##########################################
+##### Nearest facilities ########
+##########################################
+
+def _metric_points(geoms, metric_crs = METRIC_CRS):
+    if geoms.crs is None:
+        geoms = geoms.set_crs(WGS84)
+    centroids = geoms.to_crs(metric_crs).centroid
+    return np.column_stack([centroids.x.values, centroids.y.values])
+
+def _network_refine(streets, square_xy, poi_xy, candidates, metric_crs = METRIC_CRS, batch_size = 128):
+    """
+    Walking distances (meters) from each square to its candidate POI (positions in poi_xy, -1 for none),
+    along the StreetGraph streets, computed by batches of squares
+    """
+    from .network import StreetGraph, load_street_graph
+    from .grid import project_xy
+
+    if not isinstance(streets, StreetGraph):
+        streets = load_street_graph(streets)
+    square_nodes = streets.nearest_nodes(*project_xy(square_xy[:, 0], square_xy[:, 1], metric_crs, WGS84))
+    poi_nodes = streets.nearest_nodes(*project_xy(poi_xy[:, 0], poi_xy[:, 1], metric_crs, WGS84))
+    valid = candidates >= 0
+    target = np.where(valid, poi_nodes[np.where(valid, candidates, 0)], 0)
+    dist = np.full(candidates.shape, np.inf)
+    for start in range(0, len(square_nodes), batch_size):
+        rows = slice(start, start + batch_size)
+        sources, inverse = np.unique(square_nodes[rows], return_inverse = True)
+        d = streets.distances(sources)
+        dist[rows] = np.where(valid[rows], d[inverse[:, None], target[rows]], np.inf)
+    return dist
+
+@traced("nearest_POI")
+def nearest_POI_distances(grid, gdf_pois, categories = ['restaurant','culture and art', 'education', 'food_shops', 'fashion_beauty','supply_shops'],
+    k = 3, idCol = "IdINSPIRE", geometryCol = "geometry", max_distance = np.inf, metric_crs = METRIC_CRS,
+    streets = None, n_candidates = None):
+    """
+    Distance (meters) from the center of every square to its k nearest POI of each category.
+    grid : GeoDataFrame of the squares (Filosofi grid), with idCol as a column or as index
+    gdf_pois : POI from get_place_POI, with the dummy columns of the categories (get_dummy_cat = True)
+    or a 'category' column (get_dummy_cat = False). The 'center' column is used if it exists.
+    max_distance : POI further than that are not searched (distance inf)
+    streets : StreetGraph (or path of its .npz, see helpers.network) to replace the straight line distance
+    of the candidates by the walking distance. Only the n_candidates (k by default) nearest POI in straight line
+    are candidates, so take n_candidates > k if the streets are far from straight.
+
+    Returns a DataFrame indexed by idCol with columns [category]_dist1 ... [category]_dist[k]
+    """
+    ids = grid[idCol].to_numpy() if idCol in grid.columns else grid.index.to_numpy()
+    square_xy = _metric_points(grid[geometryCol], metric_crs)
+    poi_geoms = gdf_pois["center"] if "center" in gdf_pois.columns else gdf_pois.geometry
+    if not hasattr(poi_geoms, "crs"):
+        import geopandas as gpd
+        poi_geoms = gpd.GeoSeries(poi_geoms, crs = WGS84)
+    poi_xy = _metric_points(poi_geoms, metric_crs)
+    n_candidates = max(n_candidates or k, k) if streets is not None else k
+
+    result = {}
+    for cat in categories:
+        with span("nearest_" + cat) as s:
+            if cat in gdf_pois.columns:
+                mask = gdf_pois[cat].to_numpy() > 0
+            else:
+                mask = (gdf_pois["category"] == cat).to_numpy()
+            positions = np.flatnonzero(mask)
+            s.rows = len(positions)
+            dist = np.full((len(ids), n_candidates), np.inf)
+            candidates = np.full((len(ids), n_candidates), -1)
+            if len(positions) > 0:
+                tree = spatial.cKDTree(poi_xy[positions])
+                d, j = tree.query(square_xy, k = list(range(1, n_candidates + 1)), distance_upper_bound = max_distance)
+                found = np.isfinite(d)
+                dist[found] = d[found]
+                candidates[found] = positions[j[found]]
+            if streets is not None:
+                dist = np.sort(_network_refine(streets, square_xy, poi_xy, candidates, metric_crs = metric_crs), axis = 1)
+                dist[dist > max_distance] = np.inf
+            for r in range(k):
+                result[f"{cat}_dist{r + 1}"] = dist[:, r]
+    return pd.DataFrame(result, index = pd.Index(ids, name = idCol))
@@ -0,0 +1,191 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .lazy import lazy_import
+from .grid import parse_inspire_ids
+from .shared import SharedArrays, attach
+from .tracing import span, traced
+
+sparse = lazy_import("scipy.sparse")
+spatial = lazy_import("scipy.spatial")
+
+"""
+Spatial autocorrelation of many grid indicators at once (POI counts, [category]_access, Filosofi variables) :
+global Moran's I and local Moran's I (LISA) with one sparse row-standardized W for every column.
+The conditional permutations of the LISA are drawn once for a chunk of squares and used for every column
+(matrix products), the chunks are run in a process pool with the data in shared memory.
+The labels (High-High hot spots, Low-Low cold spots...) can be mapped with folium_grid_cat_plot, the colors
+being given by label (a label keeps its color even if another one is not on the map) :
+
+    labels = helpers.lisa(gdf, ["restaurant_access", "CS_aggregated"])
+    helpers.folium_grid_cat_plot(gdf.join(labels), "CS_aggregated_lisa", cmap = helpers.LISA_COLORS, discrete = True)
+"""
+
+LISA_LABELS = {1 : "High-High", 2 : "Low-High", 3 : "Low-Low", 4 : "High-Low"}
+NOT_SIGNIFICANT = "Not significant"
+# color of each label, cmap of folium_grid_cat_plot (order of the categories of the lisa columns)
+LISA_COLORS = {"High-High" : "#d7191c", "High-Low" : "#fdae61", "Low-High" : "#abd9e9", "Low-Low" : "#2c7bb6",
+               NOT_SIGNIFICANT : "#eeeeee"}
+
+def lisa_cmap(name = "lisa"):
+    """
+    Registers (once) the matplotlib colormap of the LISA labels (in the order of the categories of the lisa columns),
+    returns its name. folium_grid_cat_plot takes LISA_COLORS directly.
+    """
+    import matplotlib as mpl
+    from matplotlib.colors import ListedColormap
+
+    if name not in mpl.colormaps:
+        mpl.colormaps.register(ListedColormap(list(LISA_COLORS.values()), name = name))
+    return name
+
+def grid_weights(gdf, idCol = "IdINSPIRE", contiguity = "queen", w = None):
+    """
+    Row-standardized sparse W (scipy csr) of the squares, in the order of gdf.
+    contiguity : "queen" (8 neighbours) or "rook" (4), from the INSPIRE ids (no geometry needed)
+    w : a libpysal W or a scipy sparse matrix to use instead
+    """
+    if w is not None:
+        W = w.sparse if hasattr(w, "sparse") else w
+        W = sparse.csr_matrix(W, dtype = float)
+    else:
+        ids = gdf[idCol] if idCol in gdf.columns else gdf.index.to_series()
+        p = parse_inspire_ids(ids.values)
+        res = p["res"].values[0]
+        xy = np.column_stack([p["e"].values, p["n"].values])/res
+        pairs = spatial.cKDTree(xy).query_pairs(1.5 if contiguity == "queen" else 1.01, output_type = "ndarray")
+        n = len(xy)
+        W = sparse.csr_matrix((np.ones(2*len(pairs)), (np.r_[pairs[:, 0], pairs[:, 1]], np.r_[pairs[:, 1], pairs[:, 0]])), shape = (n, n))
+    row = np.asarray(W.sum(axis = 1)).ravel()
+    with np.errstate(divide = "ignore"):
+        W = sparse.diags(np.where(row > 0, 1/row, 0)) @ W
+    return W.tocsr()
+
+def _standardize(X):
+    Z = X - np.nanmean(X, axis = 0)
+    Z = np.where(np.isnan(Z), 0, Z)
+    return Z
+
+def moran(gdf, columns, W = None, permutations = 999, seed = 0, **kwargs):
+    """
+    Global Moran's I of each column, with a pseudo p-value from permutations (the same for every column)
+    W : from grid_weights (computed from gdf if None, kwargs are given to grid_weights)
+    Missing values are replaced by the mean.
+    Returns a DataFrame indexed by column : I, EI (expectation), z_sim, p_sim
+    """
+    W = grid_weights(gdf, **kwargs) if W is None else W
+    Z = _standardize(gdf[list(columns)].to_numpy(dtype = float))
+    n = len(Z)
+    s0 = W.sum()
+    def I(Z):
+        return n/s0*(Z*(W @ Z)).sum(axis = 0)/(Z*Z).sum(axis = 0)
+    observed = I(Z)
+    rng = np.random.default_rng(seed)
+    simulated = np.array([I(Z[rng.permutation(n)]) for _ in range(permutations)])
+    larger = (simulated >= observed).sum(axis = 0)
+    larger = np.minimum(larger, permutations - larger)
+    return pd.DataFrame({"I" : observed, "EI" : -1/(n - 1),
+        "z_sim" : (observed - simulated.mean(axis = 0))/simulated.std(axis = 0),
+        "p_sim" : (larger + 1)/(permutations + 1)}, index = list(columns))
+
+##### LISA #####
+
+_worker = {}
+
+def _init_worker(spec):
+    arrays = attach(spec)
+    _worker.update(arrays)
+
+def _lisa_chunk(task):
+    """
+    Conditional permutations of the squares rows (same number of neighbours k) for every column :
+    the neighbours of square i are replaced by k random other squares, the same draws for every column.
+    Returns the number of permutations with a local I larger than the observed one, for each row and column
+    """
+    rows, k, permutations, seed = task
+    Z, lag = _worker["Z"], _worker["lag"]
+    data, indptr = _worker["w_data"], _worker["w_indptr"]
+    n = len(Z)
+    rng = np.random.default_rng(seed)
+    # k other squares (not i) for each permutation : draws in [0, n-1) shifted after i
+    # (argsort and not argpartition, k can be n - 1 on a small fully connected grid)
+    draws = rng.random((len(rows), permutations, n - 1)).argsort(axis = 2)[:, :, :k] if n - 1 <= 64 \
+        else _draw_without_replacement(rng, len(rows), permutations, n - 1, k)
+    draws = draws + (draws >= rows[:, None, None])
+    weights = data[indptr[rows][:, None] + np.arange(k)]   # (rows, k)
+    simulated_lag = np.einsum("rpkm,rk->rpm", Z[draws], weights)
+    observed = lag[rows]
+    return rows, (simulated_lag >= observed[:, None, :]).sum(axis = 1)
+
+def _draw_without_replacement(rng, r, p, n, k):
+    """
+    (r, p, k) indexes in [0, n) without repetition on the last axis (k small compared to n)
+    """
+    draws = rng.integers(0, n, (r, p, k))
+    for _ in range(100):
+        s = np.sort(draws, axis = 2)
+        duplicated = (np.diff(s, axis = 2) == 0).any(axis = 2)
+        if not duplicated.any():
+            break
+        draws[duplicated] = rng.integers(0, n, (duplicated.sum(), k))
+    return draws
+
+@traced("lisa")
+def lisa(gdf, columns, W = None, permutations = 999, alpha = 0.05, seed = 0, n_jobs = 4, chunk_size = 64,
+    labels_only = False, **kwargs):
+    """
+    Local Moran's I of each column with conditional permutations (as esda.Moran_Local), for all columns at once.
+    W : from grid_weights (computed from gdf if None, kwargs are given to grid_weights)
+    n_jobs : processes (the squares are cut in chunks of chunk_size), 1 to run in this process
+    Returns a DataFrame with the index of gdf and, for each column :
+    [column]_lisa (label, High-High = hot spot, Low-Low = cold spot, or Not significant at alpha),
+    [column]_lisa_I (local I), [column]_lisa_q (quadrant 1 HH, 2 LH, 3 LL, 4 HL) and [column]_lisa_p (pseudo p-value)
+    """
+    columns = list(columns)
+    W = grid_weights(gdf, **kwargs) if W is None else sparse.csr_matrix(W)
+    W.sort_indices()
+    Z = _standardize(gdf[columns].to_numpy(dtype = float))
+    Z = Z/np.sqrt((Z*Z).mean(axis = 0))
+    lag = W @ Z
+    local_I = Z*lag
+    cardinality = np.diff(W.indptr)
+
+    # chunks of squares with the same number of neighbours
+    seeds = iter(np.random.SeedSequence(seed).spawn(len(Z)//chunk_size + len(np.unique(cardinality)) + 1))
+    tasks = []
+    for k in np.unique(cardinality[cardinality > 0]):
+        rows = np.flatnonzero(cardinality == k)
+        for start in range(0, len(rows), chunk_size):
+            tasks.append((rows[start:start + chunk_size], int(k), permutations, next(seeds)))
+
+    larger = np.zeros(Z.shape, dtype = np.int64)
+    # the sign of the comparison is given by the sign of z_i : local I larger <=> lag larger if z_i > 0
+    arrays = {"Z" : Z, "lag" : lag, "w_data" : W.data, "w_indptr" : W.indptr}
+    with span("lisa_permutations", rows = len(Z)):
+        if n_jobs == 1:
+            _worker.update(arrays)
+            results = map(_lisa_chunk, tasks)
+            for rows, count in results:
+                larger[rows] = count
+        else:
+            with SharedArrays(arrays) as shared:
+                with ProcessPoolExecutor(max_workers = n_jobs, initializer = _init_worker, initargs = (shared.spec,)) as executor:
+                    for rows, count in executor.map(_lisa_chunk, tasks):
+                        larger[rows] = count
+    larger = np.where(Z >= 0, larger, permutations - larger)
+    folded = np.minimum(larger, permutations - larger)
+    p = (folded + 1)/(permutations + 1)
+    p[cardinality == 0] = np.nan
+
+    quadrant = np.where(Z > 0, np.where(lag > 0, 1, 4), np.where(lag > 0, 2, 3))
+    result = {}
+    for j, col in enumerate(columns):
+        labels = pd.Series(quadrant[:, j]).map(LISA_LABELS).where(p[:, j] < alpha, NOT_SIGNIFICANT)
+        result[col + "_lisa"] = pd.Categorical(labels, categories = list(LISA_COLORS))
+        if not labels_only:
+            result[col + "_lisa_I"] = local_I[:, j]
+            result[col + "_lisa_q"] = quadrant[:, j]
+            result[col + "_lisa_p"] = p[:, j]
+    return pd.DataFrame(result, index = gdf.index)
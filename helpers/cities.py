@@ -0,0 +1,187 @@
+import json
+import multiprocessing
+import os
+import re
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from . import pipeline
+from .pipeline import DEFAULT_PARAMS, analysis_pipeline
+from .tracing import traced
+
+"""
+Analysis of several metropolitan areas in one run, instead of one notebook by city.
+Each city is a pipeline (helpers.pipeline) with its own place, city and Filosofi grid, and its own cache folder :
+every finished stage of every city is checkpointed there, so that a run stopped by a crash (or by the Overpass server)
+starts again at the first stage that is not cached. The cities run in a process pool, the POI downloads of all
+the workers sharing at most overpass_slots Overpass connections.
+The results are summarized in one table, one row by city (population, POI, mean accessibility, inequality).
+
+    cities = [{"name" : "Paris", "place" : "Paris", "city" : "Paris, Ile-de-France, France", "grid" : "data/paris.gpkg"},
+              {"name" : "Lyon", "place" : "Lyon", "city" : "Lyon, Auvergne-Rhone-Alpes, France", "grid" : "data/lyon.gpkg"}]
+    table = helpers.cities.run_cities(cities, n_jobs = 2, overpass_slots = 1, outfile = "comparison.csv")
+
+From the command line (from the root of the repository), with a csv of columns name, place, city, grid :
+python -m helpers.cities cities.csv --jobs 2 --overpass 1 --outfile comparison.csv
+"""
+
+def city_slug(name):
+    """
+    Name of the cache folder of a city
+    """
+    return re.sub(r"[^\w]+", "_", name.split(",")[0].strip().lower()).strip("_")
+
+def _city_params(spec, params):
+    p = dict(params or {})
+    p.update({k : v for k, v in spec.items() if k != "name"})
+    return p
+
+def _checkpoint_file(cache_root, name):
+    return os.path.join(cache_root, city_slug(name), "checkpoint.json")
+
+def _write_checkpoint(cache_root, name, checkpoint):
+    path = _checkpoint_file(cache_root, name)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f, indent = 1, default = str)
+    os.replace(path + ".tmp", path)
+
+def read_checkpoints(cities, cache_root = ".pipeline_cache/cities"):
+    """
+    Last checkpoint of each city (status, stages computed or cached, error) as a DataFrame
+    """
+    rows = []
+    for spec in cities:
+        path = _checkpoint_file(cache_root, spec["name"])
+        checkpoint = {"status" : "not started"}
+        if os.path.exists(path):
+            with open(path) as f:
+                checkpoint = json.load(f)
+        rows.append({"city" : spec["name"], "status" : checkpoint["status"], "stages" : len(checkpoint.get("report", [])),
+                     "error" : checkpoint.get("error")})
+    return pd.DataFrame(rows)
+
+def _population_mean(values, population):
+    """
+    Mean of values weighted by the population, on the squares where both are finite (and population > 0), as gini
+    """
+    x, w = np.asarray(values, dtype = float), np.asarray(population, dtype = float)
+    keep = np.isfinite(x) & np.isfinite(w) & (w > 0)
+    return float(np.average(x[keep], weights = w[keep])) if keep.any() else np.nan
+
+def city_summary(name, output, params):
+    """
+    One row of the comparison table from the output of the aggregate (or access) stage of a city.
+    The means (accessibility of the average inhabitant) and the gini indexes of the accessibility are computed
+    on the same squares : the squares whose accessibility (no demand around) or population is missing are left out.
+    """
+    from .inequality import gini
+
+    categories = params["categories"]
+    population = output["Ind"] if "Ind" in output.columns else pd.Series(1.0, index = output.index)
+    row = {"city" : name, "squares" : len(output), "population" : float(population.sum())}
+    for cat in categories:
+        if cat in output.columns:
+            row[f"{cat}_POI"] = int(output[cat].sum())
+        if cat + "_access" in output.columns:
+            access = output[cat + "_access"]
+            row[f"{cat}_access_mean"] = _population_mean(access, population)
+            row[f"{cat}_access_gini"] = gini(access.to_numpy(), population.to_numpy())
+    for aggregated in ["CS_aggregated", "CS_aggregated_without_weight"]:
+        if aggregated in output.columns:
+            row[f"{aggregated}_mean"] = _population_mean(output[aggregated], population)
+            row[f"{aggregated}_gini"] = gini(output[aggregated].to_numpy(), population.to_numpy())
+    return row
+
+##### workers #####
+
+def _init_worker(slots):
+    pipeline._overpass_slots = slots
+
+def _run_city(task):
+    """
+    Pipeline of a city until target, checkpointed after every stage by the pipeline cache.
+    Returns (name, summary or None, error or None)
+    """
+    spec, params, cache_root, target, force = task
+    name = spec["name"]
+    p = _city_params(spec, params)
+    pipe = analysis_pipeline(p, cache_dir = os.path.join(cache_root, city_slug(name)))
+    _write_checkpoint(cache_root, name, {"status" : "running", "target" : target, "started" : time.time()})
+    try:
+        output = pipe.run(target, force = force)
+        summary = city_summary(name, output, p)
+    except Exception as e:
+        _write_checkpoint(cache_root, name, {"status" : "failed", "target" : target, "report" : pipe.report,
+                                             "error" : f"{type(e).__name__}: {e}", "traceback" : traceback.format_exc()})
+        return name, None, f"{type(e).__name__}: {e}"
+    _write_checkpoint(cache_root, name, {"status" : "done", "target" : target, "report" : pipe.report, "summary" : summary})
+    return name, summary, None
+
+@traced("batch_cities")
+def run_cities(cities, params = None, cache_root = ".pipeline_cache/cities", n_jobs = 2, overpass_slots = 1,
+    target = "aggregate", force = (), outfile = None):
+    """
+    Run the analysis pipeline of every city, several at once.
+    cities : list of dicts with name and the parameters of the city (place, city, grid), which override params
+    params : parameters shared by the cities (DEFAULT_PARAMS of helpers.pipeline by default)
+    cache_root : one cache folder (with the checkpoint.json of the city) by city in it
+    n_jobs : cities run at once (processes), overpass_slots : maximum number of Overpass downloads at once for all of them
+    target : last stage (the comparison needs access or aggregate)
+    force : stages to recompute for every city even if cached
+    outfile : csv file of the comparison table (also written in cache_root/comparison.csv)
+    Returns the comparison table (one row by city); the failed cities are not in it, see read_checkpoints
+    """
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    tasks = [(spec, params, cache_root, target, tuple(force)) for spec in cities]
+    summaries, failed = {}, {}
+    with multiprocessing.Manager() as manager:
+        slots = manager.Semaphore(overpass_slots)
+        with ProcessPoolExecutor(max_workers = n_jobs, initializer = _init_worker, initargs = (slots,)) as executor:
+            futures = [executor.submit(_run_city, task) for task in tasks]
+            for done, future in enumerate(as_completed(futures), 1):
+                name, summary, error = future.result()
+                if error is None:
+                    summaries[name] = summary
+                else:
+                    failed[name] = error
+                print(f"{done}/{len(tasks)} {name} : {'done' if error is None else 'failed (' + error + ')'}", flush = True)
+
+    # in the order of cities
+    table = pd.DataFrame([summaries[spec["name"]] for spec in cities if spec["name"] in summaries])
+    if len(table):
+        table = table.set_index("city")
+    os.makedirs(cache_root, exist_ok = True)
+    table.to_csv(os.path.join(cache_root, "comparison.csv"))
+    if outfile:
+        table.to_csv(outfile)
+    if failed:
+        print(f"{len(failed)} cities failed, run again to resume them : " + ", ".join(failed))
+    return table
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Run the analysis pipeline on several cities and compare them")
+    parser.add_argument("cities", help = "csv file with the columns name, place, city and grid")
+    parser.add_argument("-j", "--jobs", type = int, default = 2, help = "cities run at once, default=2")
+    parser.add_argument("--overpass", type = int, default = 1, help = "maximum Overpass downloads at once, default=1")
+    parser.add_argument("-u", "--until", default = "aggregate", help = "last stage to compute, default=aggregate")
+    parser.add_argument("-f", "--force", nargs = "*", default = [], help = "stages to recompute even if cached")
+    parser.add_argument("-c", "--cache-root", default = ".pipeline_cache/cities")
+    parser.add_argument("-t", "--threshold", type = float, default = DEFAULT_PARAMS["threshold"], help = "distance band in km, default=1")
+    parser.add_argument("-s", "--status", action = "store_true", help = "only print the checkpoint of each city")
+    parser.add_argument("-o", "--outfile", help = "csv file of the comparison table")
+    args = parser.parse_args()
+
+    cities = pd.read_csv(args.cities).to_dict("records")
+    if args.status:
+        print(read_checkpoints(cities, args.cache_root).to_string(index = False))
+    else:
+        table = run_cities(cities, params = {"threshold" : args.threshold}, cache_root = args.cache_root, n_jobs = args.jobs,
+            overpass_slots = args.overpass, target = args.until, force = args.force, outfile = args.outfile)
+        print(table.to_string())
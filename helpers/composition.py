@@ -0,0 +1,164 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .lazy import lazy_import
+from .grid import METRIC_CRS, WGS84, project_xy
+from .network import StreetGraph, load_street_graph
+from .shared import SharedArrays, attach
+from .tracing import span, traced
+
+sparse = lazy_import("scipy.sparse")
+csgraph = lazy_import("scipy.sparse.csgraph")
+
+"""
+Local composition around every POI : the categories of the POI within radius meters of walking distance,
+instead of the fixed squares or places of composition_chart / compare_places and of one
+distance_between_coordinates call by pair of POI.
+The POI are snapped to the nodes of a StreetGraph (helpers.network), one Dijkstra bounded by radius is run
+from each node with POI (by batches, in a process pool with the graph in shared memory),
+and the pairs of POI closer than radius are kept in a sparse POI x POI matrix of distances.
+
+    neighbours = helpers.poi_neighbours(streets, gdf_pois, radius = 500)
+    composition = helpers.local_composition(gdf_pois, neighbours, shares = True)
+    clq = helpers.colocation_matrix(gdf_pois, neighbours)
+"""
+
+##### workers #####
+
+_worker = {}
+
+def _init_worker(spec):
+    arrays = attach(spec)
+    n = len(arrays["indptr"]) - 1
+    _worker["csr"] = sparse.csr_matrix((arrays["length"], arrays["indices"], arrays["indptr"]), shape = (n, n), copy = False)
+    _worker.update(arrays)
+
+def _neighbour_pairs(task):
+    """
+    POI pairs (i, j, distance) closer than radius, for the POI of the nodes of the batch.
+    A pair of nodes (a, b) at distance d gives the pairs of their POI at offset_i + d + offset_j
+    """
+    batch, radius = task
+    nodes, order, start, count, offset = (_worker[k] for k in ["nodes", "order", "start", "count", "offset"])
+    d = csgraph.dijkstra(_worker["csr"], directed = True, indices = nodes[batch], limit = radius)[:, nodes]
+    a, b = np.nonzero(np.isfinite(d))
+    dist = d[a, b]
+    a = batch[a]
+    # every (POI of a, POI of b)
+    size = count[a]*count[b]
+    k = np.repeat(np.arange(len(a)), size)
+    within = np.arange(size.sum()) - np.repeat(np.cumsum(size) - size, size)
+    i = order[start[a][k] + within//count[b][k]]
+    j = order[start[b][k] + within % count[b][k]]
+    dist = dist[k] + offset[i] + offset[j]
+    keep = (dist <= radius) & (i != j)
+    return i[keep], j[keep], dist[keep]
+
+@traced("poi_neighbours")
+def poi_neighbours(streets, gdf_pois, radius = 500, metric_crs = METRIC_CRS, snap = True, batch_size = 64, n_jobs = 4):
+    """
+    Sparse matrix (csr, POI x POI in the order of gdf_pois) of the walking distances (meters) between the POI
+    closer than radius, without the diagonal (explicit zeros are POI at the same place).
+    streets : StreetGraph (or path of its .npz, see helpers.network)
+    gdf_pois : POI from get_place_POI (the 'center' column is used if it exists)
+    snap : add the straight line from each POI to its nearest node to the walking distance
+    n_jobs : processes (1 to run in this process), batch_size : nodes by Dijkstra call
+    """
+    if not isinstance(streets, StreetGraph):
+        streets = load_street_graph(streets)
+    if "center" in gdf_pois.columns:
+        lon, lat = gdf_pois["center"].x.to_numpy(), gdf_pois["center"].y.to_numpy()
+    else:
+        centroids = gdf_pois.geometry.to_crs(metric_crs).centroid
+        lon, lat = project_xy(centroids.x.to_numpy(), centroids.y.to_numpy(), metric_crs, WGS84)
+    poi_node = streets.nearest_nodes(lon, lat)
+    if snap:
+        x, y = project_xy(lon, lat, WGS84, streets.metric_crs)
+        offset = np.hypot(streets.metric_xy[poi_node, 0] - x, streets.metric_xy[poi_node, 1] - y)
+    else:
+        offset = np.zeros(len(poi_node))
+
+    # the POI grouped by node : POI order[start[n]:start[n] + count[n]] are on nodes[n]
+    nodes, inverse, count = np.unique(poi_node, return_inverse = True, return_counts = True)
+    order = np.argsort(inverse, kind = "stable")
+    start = np.cumsum(count) - count
+    arrays = {"indptr" : streets.csr.indptr, "indices" : streets.csr.indices, "length" : streets.csr.data,
+              "nodes" : nodes, "order" : order, "start" : start, "count" : count, "offset" : offset}
+    tasks = [(np.arange(s, min(s + batch_size, len(nodes))), radius) for s in range(0, len(nodes), batch_size)]
+
+    with span("poi_dijkstra", rows = len(nodes)):
+        if n_jobs == 1:
+            _worker.update(arrays)
+            _worker["csr"] = streets.csr
+            results = list(map(_neighbour_pairs, tasks))
+        else:
+            with SharedArrays(arrays) as shared:
+                with ProcessPoolExecutor(max_workers = n_jobs, initializer = _init_worker, initargs = (shared.spec,)) as executor:
+                    results = list(executor.map(_neighbour_pairs, tasks))
+    i, j, d = (np.concatenate(r) for r in zip(*results)) if results else (np.array([], dtype = int),)*2 + (np.array([]),)
+    return sparse.csr_matrix((d, (i, j)), shape = (len(gdf_pois), len(gdf_pois)))
+
+def _category_dummies(gdf_pois, categories):
+    """
+    POI x categories 0/1 matrix, from the dummy columns of get_place_POI or from the 'category' column
+    """
+    if all(c in gdf_pois.columns for c in categories):
+        return (gdf_pois[list(categories)].to_numpy() > 0).astype(float)
+    return np.column_stack([(gdf_pois["category"] == c).to_numpy() for c in categories]).astype(float)
+
+def _adjacency(neighbours):
+    A = neighbours.tocsr(copy = True)
+    A.data[:] = 1
+    return A
+
+def local_composition(gdf_pois, neighbours, categories = ['restaurant','culture and art', 'education', 'food_shops', 'fashion_beauty','supply_shops'],
+    shares = False):
+    """
+    Number of POI of each category within the radius of poi_neighbours around each POI (the POI itself excluded)
+    shares : divide by the number of neighbours
+    Returns a DataFrame with the index of gdf_pois : neighbours and one column by category
+    """
+    A = _adjacency(neighbours)
+    counts = A @ _category_dummies(gdf_pois, categories)
+    n = np.asarray(A.sum(axis = 1)).ravel()
+    if shares:
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            counts = counts/n[:, None]
+    composition = pd.DataFrame(counts, index = gdf_pois.index, columns = list(categories))
+    composition.insert(0, "neighbours", n.astype(np.int64))
+    return composition
+
+def colocation_matrix(gdf_pois, neighbours, categories = ['restaurant','culture and art', 'education', 'food_shops', 'fashion_beauty','supply_shops'],
+    method = "clq"):
+    """
+    Co-location of the categories (rows : category of the POI, columns : category of its neighbours)
+    method : "pairs" (number of pairs of POI within the radius) or "clq" (co-location quotient of Leslie and Kronenfeld :
+    share of b among the neighbours of the POI of a, divided by the share of b among all the other POI; 1 = no attraction)
+    """
+    dummies = _category_dummies(gdf_pois, categories)
+    A = _adjacency(neighbours)
+    if method == "pairs":
+        matrix = dummies.T @ (A @ dummies)
+    elif method == "clq":
+        n = np.asarray(A.sum(axis = 1)).ravel()
+        F = sparse.diags(np.where(n > 0, 1/np.maximum(n, 1), 0)) @ A
+        N = len(dummies)
+        totals = dummies.sum(axis = 0)
+        others = totals[None, :] - np.eye(len(categories))
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            matrix = (dummies.T @ (F @ dummies))/totals[:, None]/(others/(N - 1))
+    else:
+        raise ValueError("method must be pairs or clq")
+    return pd.DataFrame(matrix, index = list(categories), columns = list(categories))
+
+def composition_profiles(streets, gdf_pois, categories = ['restaurant','culture and art', 'education', 'food_shops', 'fashion_beauty','supply_shops'],
+    radius = 500, shares = True, **kwargs):
+    """
+    local_composition and colocation_matrix ("clq") in one call, kwargs are given to poi_neighbours.
+    Returns (composition, colocation)
+    """
+    neighbours = poi_neighbours(streets, gdf_pois, radius = radius, **kwargs)
+    return (local_composition(gdf_pois, neighbours, categories, shares = shares),
+            colocation_matrix(gdf_pois, neighbours, categories))
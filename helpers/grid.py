@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+
+from .lazy import lazy_import
+
+pyproj = lazy_import("pyproj")
+
+"""
+Projections and INSPIRE grid helpers.
+Filosofi squares are identified by their INSPIRE id, for instance CRS3035RES200mN2893400E3763200 is
+the 200m square whose south-west corner is at (x = 3763200, y = 2893400) in EPSG:3035 (LAEA Europe).
+So the geometry of a square can be rebuilt from its id, without storing or sending it.
+Only numpy, pandas and pyproj (imported when first needed) are used here.
+"""
+
+# metric CRS used for every centroid / distance computation (Lambert-93, the CRS of the Filosofi grid)
+METRIC_CRS = "EPSG:2154"
+WGS84 = "EPSG:4326"
+INSPIRE_CRS = "EPSG:3035"
+
+_INSPIRE_PATTERN = r"CRS(?P<crs>\d+)RES(?P<res>\d+)mN(?P<n>\d+)E(?P<e>\d+)"
+
+##########################################
+##### Projection functions ########
+##########################################
+
+@lru_cache(maxsize=None)
+def _get_transformer(crs_from, crs_to):
+    return pyproj.Transformer.from_crs(crs_from, crs_to, always_xy=True)
+
+def project_xy(x, y, crs_from = METRIC_CRS, crs_to = WGS84):
+    """
+    Vectorized reprojection of coordinates arrays with pyproj (no shapely objects created).
+    x, y : arrays of coordinates (x = long and y = lat for WGS-84)
+    Returns the (x, y) arrays in crs_to
+    """
+    return _get_transformer(crs_from, crs_to).transform(np.asarray(x), np.asarray(y))
+
+##########################################
+##### INSPIRE ids functions ########
+##########################################
+
+def parse_inspire_ids(ids):
+    """
+    ids : list-like of INSPIRE ids (IdINSPIRE column)
+    Returns a DataFrame with the int64 columns res (side of the square in meters),
+    n and e (south-west corner in EPSG:3035), with the same index as ids if it is a Series.
+    """
+    ids = pd.Series(ids)
+    parts = ids.astype(str).str.extract(_INSPIRE_PATTERN)
+    if parts['res'].isna().any():
+        bad = ids[parts['res'].isna()].iloc[0]
+        raise ValueError(f"{bad} is not an INSPIRE id (format CRS3035RES200mN2893400E3763200)")
+    return parts[['res', 'n', 'e']].astype(np.int64)
+
+def inspire_id_from_coords(x, y, res = 200):
+    """
+    Vectorized inverse of parse_inspire_ids.
+    x, y : coordinates in EPSG:3035
+    Returns an array with the INSPIRE id of the square of side res containing each point
+    """
+    e = (np.floor(np.asarray(x, dtype = float)/res)*res).astype(np.int64)
+    n = (np.floor(np.asarray(y, dtype = float)/res)*res).astype(np.int64)
+    ids = "CRS3035RES" + str(res) + "mN" + pd.Series(n).astype(str) + "E" + pd.Series(e).astype(str)
+    return ids.to_numpy()
+
+def inspire_centers(ids, crs_to = WGS84):
+    """
+    Centers of the squares computed from their INSPIRE ids.
+    Returns the (x, y) arrays in crs_to (long, lat for WGS-84)
+    """
+    p = parse_inspire_ids(ids)
+    half = p['res'].values/2
+    x = p['e'].values + half
+    y = p['n'].values + half
+    if crs_to == INSPIRE_CRS:
+        return x, y
+    return project_xy(x, y, INSPIRE_CRS, crs_to)
+
+def inspire_squares(ids, crs_to = WGS84, decimals = None):
+    """
+    Rebuild the square polygons from their INSPIRE ids.
+    The 4 corners of every square are projected in one vectorized pyproj call.
+    decimals : if given, the coordinates are rounded (quantized) to this number of decimals
+    Returns a geopandas.GeoSeries in crs_to
+    """
+    import shapely
+    import geopandas as gpd
+
+    p = parse_inspire_ids(ids)
+    res, n, e = p['res'].values, p['n'].values, p['e'].values
+    # corners in order SW, SE, NE, NW, SW
+    xs = np.stack([e, e + res, e + res, e, e], axis = 1).astype(float)
+    ys = np.stack([n, n, n + res, n + res, n], axis = 1).astype(float)
+    if crs_to != INSPIRE_CRS:
+        xs, ys = project_xy(xs.ravel(), ys.ravel(), INSPIRE_CRS, crs_to)
+        xs, ys = xs.reshape(-1, 5), ys.reshape(-1, 5)
+    coords = np.stack([xs, ys], axis = 2)
+    if decimals is not None:
+        coords = np.round(coords, decimals)
+    index = ids.index if isinstance(ids, pd.Series) else None
+    return gpd.GeoSeries(shapely.polygons(coords), index = index, crs = crs_to)
+
+##### Compact schema #####
+
+# key = n*KEY_FACTOR + e (meters in EPSG:3035), unique for squares of the same resolution
+KEY_FACTOR = 10**8
+
+def inspire_keys(ids):
+    """
+    Integer (int64) encoding of INSPIRE ids : 8 bytes instead of a ~50 bytes python string
+    """
+    p = parse_inspire_ids(ids)
+    return (p['n'].values*KEY_FACTOR + p['e'].values).astype(np.int64)
+
+def inspire_ids_from_keys(keys, res = 200):
+    """
+    Inverse of inspire_keys
+    """
+    keys = np.asarray(keys, dtype = np.int64)
+    ids = "CRS3035RES" + str(res) + "mN" + pd.Series(keys // KEY_FACTOR).astype(str) + "E" + pd.Series(keys % KEY_FACTOR).astype(str)
+    return ids.to_numpy()
+
+def compact_grid(grid, id_col = "IdINSPIRE", keep_ids = False):
+    """
+    Memory-lean copy of a Filosofi grid :
+    float64 counts in float32, IdINSPIRE encoded as int64 in IdINSPIRE_key (the string column is dropped unless keep_ids,
+    see grid_ids to decode it), the other repeated string ids (Id_carr1km...) as categorical.
+    """
+    grid = grid.copy()
+    floats = grid.select_dtypes("float64").columns
+    grid[floats] = grid[floats].astype(np.float32)
+    grid[id_col + "_key"] = inspire_keys(grid[id_col])
+    for c in grid.select_dtypes("object").columns:
+        if c == id_col:
+            continue
+        if grid[c].nunique() < len(grid)/2:
+            grid[c] = grid[c].astype("category")
+    if not keep_ids:
+        grid = grid.drop(columns = id_col)
+    return grid
+
+def grid_ids(grid, id_col = "IdINSPIRE", res = 200):
+    """
+    INSPIRE ids of the squares of grid : its id_col column, or decoded from id_col + "_key" (compact_grid)
+    """
+    if id_col in grid.columns:
+        return grid[id_col].to_numpy()
+    return inspire_ids_from_keys(grid[id_col + "_key"], res = res)
@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+from .lazy import lazy_import
+from .grid import INSPIRE_CRS, WGS84, project_xy, inspire_id_from_coords
+from .scrapping import categories_tags
+from .tracing import span, traced
+
+osmium = lazy_import("osmium")
+
+"""
+Yearly panel of the POI of each category by INSPIRE square, from an OSM history file (.osh.pbf).
+Same logic as the TimelineHandler of first-example-code/OSMHandler.py, for every tag of categories_tags :
+every version of the nodes is read once, each version is active from its timestamp to the next one,
+and the versions are expanded to the years whose reference date falls in that interval.
+
+    from helpers import history
+    panel = history.poi_panel("ile-de-france.osh.pbf", start = 2010, end = 2022)
+
+From the command line (from the root of the repository) :
+python -m helpers.history -i ile-de-france.osh.pbf -o panel.csv --start 2010 --end 2022
+"""
+
+VERSION_COLUMNS = ["id", "version", "visible", "ts", "lat", "lon", "name", "amenity", "shop"]
+
+def _tag_categories(tags_for_cat = categories_tags):
+    """
+    DataFrame (tag, category) : a tag can be in several categories (ice_cream, antiques...)
+    """
+    return pd.DataFrame([(t, cat) for cat, tags in tags_for_cat.items() for t in tags], columns = ["tag", "category"])
+
+def read_history(path, tags_for_cat = categories_tags):
+    """
+    Every version of the nodes whose amenity or shop is in tags_for_cat (once it is, all its next versions
+    are kept, deletions included, to know when it stops being a POI of interest).
+    Returns a DataFrame with VERSION_COLUMNS
+    """
+    interest = set(t for tags in tags_for_cat.values() for t in tags)
+
+    class CategoryTimelineHandler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.versions = []
+            self.last_id = None
+
+        def node(self, n):
+            amenity, shop = n.tags.get('amenity'), n.tags.get('shop')
+            # the versions of a node follow each other in a history file
+            if amenity in interest or shop in interest or n.id == self.last_id:
+                self.last_id = n.id
+                location = n.location
+                valid = n.visible and location.valid()
+                self.versions.append((n.id, n.version, n.visible, n.timestamp,
+                    location.lat if valid else np.nan, location.lon if valid else np.nan,
+                    n.tags.get('name'), amenity, shop))
+
+    handler = CategoryTimelineHandler()
+    with span("history_read") as s:
+        handler.apply_file(path)
+        s.rows = len(handler.versions)
+    versions = pd.DataFrame(handler.versions, columns = VERSION_COLUMNS)
+    versions["ts"] = pd.to_datetime(versions["ts"], utc = True)
+    return versions
+
+def version_intervals(versions, end = None):
+    """
+    Interval [start, end) of each version : from its timestamp to the timestamp of the next version of the node,
+    the last version lasting until end (open by default : a deleted node has a last version that is not visible).
+    """
+    versions = versions.sort_values(["id", "version"]).reset_index(drop = True)
+    end = pd.Timestamp("2200-01-01", tz = "UTC") if end is None else pd.Timestamp(end).tz_localize("UTC")
+    versions["start"] = versions["ts"]
+    versions["end"] = versions.groupby("id")["ts"].shift(-1).fillna(end)
+    return versions
+
+def expand_years(intervals, years, month = 12, day = 31):
+    """
+    Vectorized expansion of the intervals to the years whose reference date (December 31st by default)
+    is in [start, end) : one row by (interval, year)
+    """
+    years = np.asarray(years)
+    dates = pd.to_datetime(pd.DataFrame({"year" : years, "month" : month, "day" : day})).to_numpy(dtype = "datetime64[ns]")
+    start = intervals["start"].dt.tz_convert(None).to_numpy(dtype = "datetime64[ns]")
+    end = intervals["end"].dt.tz_convert(None).to_numpy(dtype = "datetime64[ns]")
+    first = np.searchsorted(dates, start, side = "left")
+    last = np.searchsorted(dates, end, side = "left")
+    n = np.maximum(last - first, 0)
+    rows = np.repeat(np.arange(len(intervals)), n)
+    offset = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    expanded = intervals.iloc[rows].reset_index(drop = True)
+    expanded["year"] = years[first[rows] + offset]
+    return expanded
+
+@traced("poi_panel")
+def poi_panel(history, start = 2010, end = None, grid = None, res = 200, tags_for_cat = categories_tags,
+    month = 12, day = 31, wide = False):
+    """
+    Number of POI of each category active in each INSPIRE square each year.
+    history : path of an .osh.pbf file, or the DataFrame of read_history
+    start, end : first and last years of the panel (end : year of the last timestamp of the file by default,
+    its count is then the state at the end of the file)
+    grid : if given (Filosofi grid with IdINSPIRE), only its squares are kept
+    month, day : reference date of each year at which the POI are counted
+    wide : if True, one column by category, else a tidy table IdINSPIRE, year, category, count
+    """
+    versions = read_history(history, tags_for_cat) if isinstance(history, str) else history
+    intervals = version_intervals(versions)
+    end = intervals["ts"].max().year if end is None else end
+    # only the versions that are POI of interest, located
+    intervals = intervals[intervals["visible"] & intervals["lat"].notna()
+        & (intervals["amenity"].notna() | intervals["shop"].notna())]
+
+    with span("panel_expand") as s:
+        active = expand_years(intervals, np.arange(start, end + 1), month = month, day = day)
+        x, y = project_xy(active["lon"].to_numpy(), active["lat"].to_numpy(), WGS84, INSPIRE_CRS)
+        active["IdINSPIRE"] = inspire_id_from_coords(x, y, res = res)
+        if grid is not None:
+            active = active[active["IdINSPIRE"].isin(grid["IdINSPIRE"] if "IdINSPIRE" in grid.columns else grid.index)]
+        # one row by (version, year, tag), then by category of the tag
+        tags = pd.concat([active[["id", "IdINSPIRE", "year", t]].rename(columns = {t : "tag"}) for t in ["amenity", "shop"]])
+        tags = tags.merge(_tag_categories(tags_for_cat), on = "tag")
+        # a POI whose amenity and shop are in the same category is counted once
+        tags = tags.drop_duplicates(["id", "year", "category"])
+        s.rows = len(tags)
+    panel = tags.groupby(["IdINSPIRE", "year", "category"]).size().rename("count").reset_index()
+    if wide:
+        return panel.set_index(["IdINSPIRE", "year", "category"])["count"].unstack("category", fill_value = 0)
+    return panel
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Yearly number of POI by category and INSPIRE square from an OSM history file")
+    parser.add_argument("-i", "--history", help = "history input file (.osh.pbf)", required = True)
+    parser.add_argument("-o", "--outfile", help = "output will be written in this file, default=[history]_panel.csv")
+    parser.add_argument("-s", "--start", type = int, default = 2010, help = "first year, default=2010")
+    parser.add_argument("-e", "--end", type = int, default = None, help = "last year, default=year of the last change of the file")
+    parser.add_argument("-g", "--grid", help = "Filosofi grid file, only its squares are kept")
+    parser.add_argument("-w", "--wide", action = "store_true", help = "one column by category")
+    args = parser.parse_args()
+
+    grid = None
+    if args.grid:
+        import geopandas as gpd
+        grid = gpd.read_file(args.grid, ignore_geometry = True)
+    panel = poi_panel(args.history, start = args.start, end = args.end, grid = grid, wide = args.wide)
+    outfile = args.outfile or args.history + "_panel.csv"
+    panel.to_csv(outfile, index = args.wide)
+    print(f"{len(panel)} rows written in {outfile}")
@@ -0,0 +1,145 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .tracing import traced
+
+"""
+Inequality of the accessibility between squares : Gini, Theil and Lorenz curve of any
+[category]_access or CS_aggregated column, weighted by the population of the squares (Ind or Men).
+Values are sorted once (O(n log n)), the bootstrap replicates only change the weights,
+so they are computed together as matrices (replicates x squares), by chunks in threads.
+
+    helpers.inequality_table(gdf, ["restaurant_access", "CS_aggregated"], weight = "Ind", by = "DEP", n_boot = 1000)
+"""
+
+def _prepare(x, w = None):
+    """
+    Finite values (x >= 0) and weights, sorted by value
+    """
+    x = np.asarray(x, dtype = float)
+    w = np.ones_like(x) if w is None else np.asarray(w, dtype = float)
+    keep = np.isfinite(x) & np.isfinite(w) & (w > 0)
+    if (x[keep] < 0).any():
+        raise ValueError("Gini and Theil need non negative values")
+    x, w = x[keep], w[keep]
+    order = np.argsort(x, kind = "stable")
+    return x[order], w[order]
+
+def _gini_sorted(x, W):
+    """
+    x : sorted values (n,), W : weights (n,) or (replicates x n)
+    Gini = 1 - sum p_i (L_i + L_i-1), area under the weighted Lorenz curve
+    """
+    P = W/W.sum(axis = -1, keepdims = True)
+    V = P*x
+    total = V.sum(axis = -1, keepdims = True)
+    L = np.cumsum(V, axis = -1)/total
+    return 1 - (P*(2*L - V/total)).sum(axis = -1)
+
+def _theil_sorted(x, W):
+    P = W/W.sum(axis = -1, keepdims = True)
+    r = x/(P*x).sum(axis = -1, keepdims = True)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        t = np.where(r > 0, r*np.log(r), 0)
+    return (P*t).sum(axis = -1)
+
+def gini(x, w = None):
+    """
+    Gini index of the values x weighted by w (population of each square), between 0 (equality) and 1
+    Non finite values are ignored.
+    """
+    x, w = _prepare(x, w)
+    return float(_gini_sorted(x, w)) if len(x) else np.nan
+
+def theil(x, w = None):
+    """
+    Theil T index of the values x weighted by w, 0 for equality, log(population) at most
+    """
+    x, w = _prepare(x, w)
+    return float(_theil_sorted(x, w)) if len(x) else np.nan
+
+def lorenz_curve(x, w = None):
+    """
+    Weighted Lorenz curve : DataFrame with the cumulated share of population (from the least accessible squares)
+    and the cumulated share of the value, starting at (0, 0)
+    """
+    x, w = _prepare(x, w)
+    population = np.concatenate([[0], np.cumsum(w)/w.sum()])
+    value = np.concatenate([[0], np.cumsum(w*x)/(w*x).sum()])
+    return pd.DataFrame({"population_share" : population, "value_share" : value})
+
+def _bootstrap_chunk(x, w, n_boot, seed):
+    # resampling the squares with replacement = multiplying their weight by multinomial counts
+    rng = np.random.default_rng(seed)
+    counts = rng.multinomial(len(x), np.full(len(x), 1/len(x)), size = n_boot)
+    W = counts*w
+    return _gini_sorted(x, W), _theil_sorted(x, W)
+
+def bootstrap(x, w = None, n_boot = 1000, seed = 0, n_jobs = 1, chunk_size = 200):
+    """
+    Bootstrap replicates (squares resampled with replacement) of the Gini and Theil indexes.
+    The replicates are computed by chunks of chunk_size, in n_jobs threads.
+    Returns two arrays of n_boot values (gini, theil)
+    """
+    x, w = _prepare(x, w)
+    if len(x) == 0:
+        return np.full(n_boot, np.nan), np.full(n_boot, np.nan)
+    sizes = [min(chunk_size, n_boot - start) for start in range(0, n_boot, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    with ThreadPoolExecutor(max_workers = n_jobs) as executor:
+        chunks = list(executor.map(lambda a: _bootstrap_chunk(x, w, *a), zip(sizes, seeds)))
+    return np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks])
+
+@traced()
+def inequality_table(df, columns = ["CS_aggregated"], weight = "Ind", by = None, n_boot = 0, ci = 0.95,
+    seed = 0, n_jobs = 1):
+    """
+    Gini and Theil of each column of columns, weighted by the column weight (Ind, Men, or None for no weight).
+    by : column(s) to compute them by group (DEP, Depcom, label of the clusters...)
+    n_boot : number of bootstrap replicates for the confidence intervals at level ci (none if 0)
+    Returns a tidy DataFrame : [by], variable, n, population, gini, theil (and gini_low, gini_high, theil_low, theil_high)
+    """
+    columns = [columns] if isinstance(columns, str) else list(columns)
+    by = [by] if isinstance(by, str) else by
+    groups = df.groupby(by, observed = True, sort = True) if by else [((), df)]
+    alpha = (1 - ci)/2
+    rows = []
+    for key, group in groups:
+        key = key if isinstance(key, tuple) else (key,)
+        w = group[weight].to_numpy() if weight else None
+        for col in columns:
+            x, ws = _prepare(group[col].to_numpy(), w)
+            row = dict(zip(by or [], key))
+            row.update(variable = col, n = len(x), population = ws.sum(),
+                gini = float(_gini_sorted(x, ws)) if len(x) else np.nan,
+                theil = float(_theil_sorted(x, ws)) if len(x) else np.nan)
+            if n_boot:
+                g, t = bootstrap(x, ws, n_boot = n_boot, seed = seed, n_jobs = n_jobs)
+                row.update(gini_low = np.nanquantile(g, alpha), gini_high = np.nanquantile(g, 1 - alpha),
+                    theil_low = np.nanquantile(t, alpha), theil_high = np.nanquantile(t, 1 - alpha))
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+def theil_decomposition(df, column = "CS_aggregated", weight = "Ind", by = "DEP"):
+    """
+    Theil index of column split between the inequality within the groups of by and between the groups
+    Returns a dict : total, within, between, and the DataFrame of the groups (share of the value, theil)
+    """
+    x, w = _prepare(df[column].to_numpy(), df[weight].to_numpy() if weight else None)
+    keep = np.isfinite(df[column].to_numpy(dtype = float))
+    if weight:
+        keep &= np.isfinite(df[weight].to_numpy(dtype = float)) & (df[weight].to_numpy(dtype = float) > 0)
+    data = pd.DataFrame({"x" : df[column].to_numpy(dtype = float)[keep],
+        "w" : np.ones(keep.sum()) if not weight else df[weight].to_numpy(dtype = float)[keep],
+        "group" : df[by].to_numpy()[keep]})
+    data["xw"] = data["x"]*data["w"]
+    groups = data.groupby("group").agg(population = ("w", "sum"), value = ("xw", "sum"))
+    groups["theil"] = [theil(g["x"], g["w"]) for _, g in data.groupby("group")]
+    groups["value_share"] = groups["value"]/groups["value"].sum()
+    groups["population_share"] = groups["population"]/groups["population"].sum()
+    within = (groups["value_share"]*groups["theil"]).sum()
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        between = np.nansum(groups["value_share"]*np.log(groups["value_share"]/groups["population_share"]))
+    return {"total" : float(_theil_sorted(x, w)), "within" : within, "between" : between, "groups" : groups}
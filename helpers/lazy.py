@@ -0,0 +1,83 @@
+import importlib
+import subprocess
+import sys
+import types
+
+"""
+Lazy imports of the heavy dependencies (osmnx, networkx, pysal, folium, plotly, seaborn...).
+The helpers modules use lazy_import at the top instead of import, so that the dependency
+is only imported the first time one of its attributes is used, that is when the function
+that needs it is first called. import helpers then only costs numpy and pandas,
+which matters for scripts that only need the 2SFCA maths and for every worker of a process pool.
+
+The import time can be checked with :
+python -m helpers.lazy --budget 1.0
+"""
+
+# dependencies that must not be imported by import helpers
+HEAVY_MODULES = ["osmnx", "networkx", "libpysal", "spreg", "pysal", "plotly", "folium", "branca",
+                 "contextily", "seaborn", "statannot", "matplotlib", "geopandas", "shapely",
+                 "pyproj", "scipy", "sklearn"]
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module, the real module is imported at the first attribute access.
+    """
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_lazy_name'] = name
+
+    def _load(self):
+        return importlib.import_module(self.__dict__['_lazy_name'])
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        name = self.__dict__['_lazy_name']
+        state = "loaded" if name in sys.modules else "not loaded"
+        return f"<lazy module '{name}' ({state})>"
+
+def lazy_import(name : str):
+    """
+    Returns the module if it is already imported, else a LazyModule.
+    A missing dependency raises ModuleNotFoundError only when it is used.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+def import_report(module : str = "helpers", python = sys.executable):
+    """
+    Import module in a fresh interpreter with python -X importtime.
+    Returns (total import time in seconds, list of the HEAVY_MODULES that were imported)
+    """
+    code = f"import sys, {module}; print(','.join(sorted(m for m in sys.modules)))"
+    out = subprocess.run([python, "-X", "importtime", "-c", code], capture_output = True, text = True, check = True)
+    total = 0
+    for line in out.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            total = int(parts[1]) / 1e6
+    loaded = out.stdout.strip().split(",")
+    heavy = [m for m in HEAVY_MODULES if m in loaded]
+    return total, heavy
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check the import time of the helpers package")
+    parser.add_argument("-m", "--module", default = "helpers", help = "module to import, default=helpers")
+    parser.add_argument("-b", "--budget", type = float, default = 1.0, help = "maximum import time in seconds, default=1.0")
+    args = parser.parse_args()
+
+    total, heavy = import_report(args.module)
+    print(f"import {args.module} : {total:.3f} s (budget {args.budget} s)")
+    if heavy:
+        print("heavy modules imported : " + ", ".join(heavy))
+    if total > args.budget or heavy:
+        sys.exit(1)
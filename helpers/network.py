@@ -0,0 +1,269 @@
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+
+from .lazy import lazy_import
+from .grid import METRIC_CRS, WGS84, project_xy
+from .tracing import span, traced
+
+ox = lazy_import("osmnx")
+nx = lazy_import("networkx")
+osmium = lazy_import("osmium")
+shapely = lazy_import("shapely")
+sparse = lazy_import("scipy.sparse")
+csgraph = lazy_import("scipy.sparse.csgraph")
+spatial = lazy_import("scipy.spatial")
+
+"""
+Street network stored as arrays (CSR adjacency) instead of a networkx MultiDiGraph.
+The walk graph of a whole city is downloaded (or read from a .osm.pbf extract) and consolidated once,
+saved in a .npz file, and the graph of each place is then cut from it by polygon.
+Routing (shortest paths, distances) runs with scipy.sparse.csgraph on the arrays.
+
+    streets = build_street_graph("Paris, Ile-de-France, France", path = "data/paris_walk.npz")
+    streets = load_street_graph("data/paris_walk.npz") # next times
+    g_place = streets.subgraph(polygon)
+    route = g_place.route((2.35, 48.85), (2.36, 48.86))
+"""
+
+# same filter as the osmnx walk network
+_WALK_EXCLUDED_HIGHWAYS = ["abandoned", "bus_guideway", "construction", "cycleway", "motor", "planned",
+                           "platform", "proposed", "raceway"]
+
+class StreetGraph:
+    """
+    Directed street graph in CSR format.
+    node_ids : osmid of the nodes, x, y : WGS-84 coordinates of the nodes
+    indptr, indices, length : the edges leaving node k are indices[indptr[k]:indptr[k+1]],
+    of length (meters) length[indptr[k]:indptr[k+1]] (the shortest one if there are parallel edges)
+    """
+    def __init__(self, node_ids, x, y, indptr, indices, length, metric_crs = METRIC_CRS):
+        self.node_ids = np.asarray(node_ids, dtype = np.int64)
+        self.x = np.asarray(x, dtype = np.float64)
+        self.y = np.asarray(y, dtype = np.float64)
+        self.indptr = np.asarray(indptr, dtype = np.int64)
+        self.indices = np.asarray(indices, dtype = np.int32)
+        self.length = np.asarray(length, dtype = np.float32)
+        self.metric_crs = metric_crs
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __repr__(self):
+        return f"<StreetGraph {len(self)} nodes, {len(self.indices)} edges>"
+
+    @classmethod
+    def from_edges(cls, node_ids, x, y, u, v, length, metric_crs = METRIC_CRS):
+        """
+        u, v : positions (in node_ids) of the ends of each edge, length : its length in meters
+        """
+        n = len(node_ids)
+        edges = pd.DataFrame({"u" : u, "v" : v, "length" : length})
+        edges = edges.groupby(["u", "v"], sort = True, as_index = False)["length"].min()
+        indptr = np.zeros(n + 1, dtype = np.int64)
+        np.cumsum(np.bincount(edges["u"].values, minlength = n), out = indptr[1:])
+        return cls(node_ids, x, y, indptr, edges["v"].values, edges["length"].values, metric_crs = metric_crs)
+
+    @classmethod
+    def from_networkx(cls, G, metric_crs = METRIC_CRS):
+        """
+        From an osmnx graph (nodes with x, y in WGS-84, edges with length)
+        """
+        nodes = list(G.nodes)
+        pos = {node : k for k, node in enumerate(nodes)}
+        x = np.array([G.nodes[node]["x"] for node in nodes])
+        y = np.array([G.nodes[node]["y"] for node in nodes])
+        u, v, length = zip(*((pos[a], pos[b], d.get("length", np.nan)) for a, b, d in G.edges(data = True))) \
+            if G.number_of_edges() else ((), (), ())
+        return cls.from_edges(nodes, x, y, np.array(u, dtype = np.int64), np.array(v, dtype = np.int64),
+            np.array(length, dtype = float), metric_crs = metric_crs)
+
+    def to_networkx(self):
+        """
+        Back to a networkx MultiDiGraph, for the osmnx functions (plots...)
+        """
+        G = nx.MultiDiGraph(crs = WGS84)
+        G.add_nodes_from((int(node), {"x" : x, "y" : y}) for node, x, y in zip(self.node_ids, self.x, self.y))
+        u = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        G.add_edges_from((int(self.node_ids[a]), int(self.node_ids[b]), {"length" : float(l)})
+            for a, b, l in zip(u, self.indices, self.length))
+        return G
+
+    @property
+    def csr(self):
+        """
+        scipy.sparse.csr_matrix of the lengths, as used by scipy.sparse.csgraph
+        """
+        if "_csr" not in self.__dict__:
+            # explicit zeros would be edges for csgraph, 1mm keeps the merged intersections connected
+            self._csr = sparse.csr_matrix((np.maximum(self.length, 1e-3), self.indices, self.indptr), shape = (len(self), len(self)))
+        return self._csr
+
+    @property
+    def metric_xy(self):
+        if "_metric_xy" not in self.__dict__:
+            self._metric_xy = np.column_stack(project_xy(self.x, self.y, WGS84, self.metric_crs))
+        return self._metric_xy
+
+    def save(self, path):
+        np.savez_compressed(path, node_ids = self.node_ids, x = self.x, y = self.y, indptr = self.indptr,
+            indices = self.indices, length = self.length, metric_crs = np.array(self.metric_crs))
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f["node_ids"], f["x"], f["y"], f["indptr"], f["indices"], f["length"], metric_crs = str(f["metric_crs"]))
+
+    def subgraph(self, polygon, crs = WGS84):
+        """
+        Graph of the nodes inside polygon (shapely geometry in crs) and of the edges between them
+        """
+        with span("network_subgraph") as s:
+            if crs == WGS84:
+                x, y = self.x, self.y
+            else:
+                x, y = self.metric_xy.T if crs == self.metric_crs else project_xy(self.x, self.y, WGS84, crs)
+            minx, miny, maxx, maxy = polygon.bounds
+            inside = (x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy)
+            candidates = np.flatnonzero(inside)
+            inside[candidates] = shapely.contains_xy(polygon, x[candidates], y[candidates])
+            sub = self._select(inside)
+            s.rows = len(sub)
+        return sub
+
+    def _select(self, keep):
+        new_pos = np.full(len(self), -1, dtype = np.int64)
+        new_pos[keep] = np.arange(keep.sum())
+        u = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        edges = keep[u] & keep[self.indices]
+        return StreetGraph.from_edges(self.node_ids[keep], self.x[keep], self.y[keep],
+            new_pos[u[edges]], new_pos[self.indices[edges]], self.length[edges], metric_crs = self.metric_crs)
+
+    def nearest_nodes(self, x, y):
+        """
+        Positions of the nodes nearest to the WGS-84 points (x, y) (arrays or numbers)
+        """
+        if "_tree" not in self.__dict__:
+            self._tree = spatial.cKDTree(self.metric_xy)
+        xm, ym = project_xy(np.atleast_1d(x), np.atleast_1d(y), WGS84, self.metric_crs)
+        return self._tree.query(np.column_stack([xm, ym]))[1]
+
+    def distances(self, sources, limit = np.inf):
+        """
+        Shortest path lengths (meters) from the nodes sources (positions) to every node,
+        array (len(sources) x nodes), inf above limit
+        """
+        return csgraph.dijkstra(self.csr, directed = True, indices = sources, limit = limit)
+
+    def shortest_path(self, orig, dest, limit = np.inf):
+        """
+        Nodes positions of the shortest path between the positions orig and dest, None if there is no path
+        """
+        dist, pred = csgraph.dijkstra(self.csr, directed = True, indices = orig, return_predecessors = True, limit = limit)
+        if not np.isfinite(dist[dest]):
+            return None
+        path = [dest]
+        while path[-1] != orig:
+            path.append(pred[path[-1]])
+        return path[::-1]
+
+    def route(self, coord1 : tuple, coord2 : tuple, limit = np.inf):
+        """
+        Same as route_between_coordinates : coord format (long, lat)
+        Returns the list of osmid of the nodes of the route, or None
+        """
+        orig, dest = self.nearest_nodes([coord1[0], coord2[0]], [coord1[1], coord2[1]])
+        path = self.shortest_path(orig, dest, limit = limit)
+        if path is None:
+            return None
+        return self.node_ids[path].tolist()
+
+    def route_length(self, route):
+        """
+        Length (meters) of a route given as a list of osmid
+        """
+        pos = pd.Series(np.arange(len(self)), index = self.node_ids)[route].values
+        return float(sum(self.csr[a, b] for a, b in zip(pos[:-1], pos[1:])))
+
+def _walk_ways(path):
+    """
+    Nodes and edges of the walkable ways of a .osm.pbf file (read with pyosmium)
+    """
+    class WalkHandler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.u, self.v, self.nodes = [], [], {}
+
+        def way(self, w):
+            highway = w.tags.get("highway")
+            if highway is None or w.tags.get("area") == "yes" or w.tags.get("foot") == "no" \
+                or w.tags.get("access") == "private" or w.tags.get("service") == "private" \
+                or any(h in highway for h in _WALK_EXCLUDED_HIGHWAYS):
+                return
+            refs = []
+            for n in w.nodes:
+                if n.location.valid():
+                    self.nodes[n.ref] = (n.location.lon, n.location.lat)
+                    refs.append(n.ref)
+            self.u += refs[:-1]
+            self.v += refs[1:]
+
+    handler = WalkHandler()
+    handler.apply_file(path, locations = True)
+    return handler
+
+def graph_from_pbf(path, metric_crs = METRIC_CRS):
+    """
+    Walk graph (osmnx-like networkx MultiDiGraph, simplified) of a .osm.pbf extract
+    """
+    handler = _walk_ways(path)
+    nodes = pd.DataFrame.from_dict(handler.nodes, orient = "index", columns = ["x", "y"])
+    u, v = np.array(handler.u, dtype = np.int64), np.array(handler.v, dtype = np.int64)
+    xm, ym = project_xy(nodes["x"].values, nodes["y"].values, WGS84, metric_crs)
+    metric = pd.DataFrame({"xm" : xm, "ym" : ym}, index = nodes.index)
+    length = np.hypot(metric.loc[u, "xm"].values - metric.loc[v, "xm"].values, metric.loc[u, "ym"].values - metric.loc[v, "ym"].values)
+    G = nx.MultiDiGraph(crs = WGS84)
+    G.add_nodes_from((int(k), {"x" : r.x, "y" : r.y}) for k, r in nodes.iterrows())
+    # walking is undirected : both directions
+    G.add_edges_from((int(a), int(b), {"length" : l, "oneway" : False}) for a, b, l in zip(u, v, length))
+    G.add_edges_from((int(b), int(a), {"length" : l, "oneway" : False}) for a, b, l in zip(u, v, length))
+    return ox.simplify_graph(G)
+
+@traced("street_graph")
+def build_street_graph(city : str = "Paris, Ile-de-France, France", path = None, pbf = None, consolidate = True,
+    network_type = 'walk', metric_crs = METRIC_CRS, buffer_dist = 1000):
+    """
+    Download the walk network of the whole city (or read it from the .osm.pbf file pbf),
+    consolidate it once (osmnx consolidate_intersections, tolerance = 15 meters) and store it as a StreetGraph.
+    path : if given, the graph is saved there (.npz) to be read back with load_street_graph
+    Returns a StreetGraph
+    """
+    with span("network_download") as s:
+        if pbf is not None:
+            G = graph_from_pbf(pbf, metric_crs = metric_crs)
+        else:
+            G = ox.graph_from_place(city, buffer_dist = buffer_dist, network_type = network_type, retain_all = True, truncate_by_edge = True)
+        s.rows = len(G)
+    if consolidate:
+        with span("consolidation") as s:
+            G = ox.project_graph(G, to_crs = metric_crs)
+            G = ox.consolidate_intersections(G, rebuild_graph = True, tolerance = 15, dead_ends = False)
+            G = ox.project_graph(G, to_crs = WGS84)
+            s.rows = len(G)
+    streets = StreetGraph.from_networkx(G, metric_crs = metric_crs)
+    if path is not None:
+        streets.save(path)
+    return streets
+
+@functools.lru_cache(maxsize = 4)
+def _load_street_graph(path, mtime):
+    return StreetGraph.load(path)
+
+def load_street_graph(path):
+    """
+    StreetGraph saved by build_street_graph, kept in memory for the next calls (until the file changes)
+    """
+    return _load_street_graph(os.path.abspath(path), os.path.getmtime(path))
@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from .lazy import lazy_import
+from .grid import WGS84
+from .tracing import span
+
+ox = lazy_import("osmnx")
+gpd = lazy_import("geopandas")
+requests = lazy_import("requests")
+shapely = lazy_import("shapely")
+
+"""
+Concurrent Overpass client for get_polygon_POI_tags-like queries on many polygons (or tiles).
+The queries are built as the ones of ox.geometries_from_polygon (a big polygon is cut in several sub-queries),
+they are run with asyncio (requests in threads) :
+- at most concurrency queries at once, and at most rate queries by second,
+- the /status of the server is read to wait for a free slot,
+- 429 (too many requests), 502, 503, 504 and connection errors are retried with an exponential backoff,
+- every answer is saved in progress_dir, so that an interrupted run starts again where it stopped.
+The answers are turned into the same GeoDataFrames as get_polygon_POI_tags by osmnx (1.x only).
+
+    gdfs = helpers.overpass.get_polygons_POI_tags([polygon1, polygon2], tags, concurrency = 2)
+
+endpoint can be a local server (http://localhost:8000/api) to test it.
+"""
+
+RETRY_STATUS = [429, 502, 503, 504]
+
+class OverpassClient:
+    """
+    endpoint : url of the api (default : ox.settings.overpass_endpoint), queries are posted to endpoint/interpreter
+    concurrency : maximum number of queries at once
+    rate : maximum number of queries started by second
+    max_retries, backoff, max_backoff : the n-th retry waits min(max_backoff, backoff*2**n) seconds (with jitter),
+    or the Retry-After of the server
+    check_slots : read endpoint/status before each query and wait for a free slot
+    progress_dir : folder of the saved answers (None to not save them)
+    """
+    def __init__(self, endpoint = None, concurrency = 2, rate = 1.0, max_retries = 6, backoff = 2.0,
+        max_backoff = 120.0, timeout = 180, check_slots = True, progress_dir = ".overpass_cache"):
+        self.endpoint = (endpoint or ox.settings.overpass_endpoint).rstrip("/")
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.check_slots = check_slots
+        self.progress_dir = progress_dir
+        self.stats = {"queries" : 0, "cached" : 0, "retries" : 0, "bytes" : 0}
+
+    ##### progress #####
+
+    def _progress_file(self, query):
+        return os.path.join(self.progress_dir, hashlib.sha256(query.encode()).hexdigest()[:24] + ".json")
+
+    def _load(self, query):
+        if self.progress_dir is None or not os.path.exists(self._progress_file(query)):
+            return None
+        with open(self._progress_file(query)) as f:
+            return json.load(f)
+
+    def _save(self, query, answer):
+        if self.progress_dir is None:
+            return
+        os.makedirs(self.progress_dir, exist_ok = True)
+        path = self._progress_file(query)
+        with open(path + ".tmp", "w") as f:
+            json.dump(answer, f)
+        # the file only exists once complete
+        os.replace(path + ".tmp", path)
+
+    ##### http (in threads) #####
+
+    def _slot_wait(self):
+        """
+        Seconds to wait for a free slot according to endpoint/status (0 if unknown)
+        """
+        try:
+            status = requests.get(self.endpoint + "/status", timeout = 10).text
+        except Exception:
+            return 0
+        if re.search(r"\d+ slots? available now", status):
+            return 0
+        waits = [int(s) for s in re.findall(r"in (\d+) seconds", status)]
+        return min(waits) if waits else 0
+
+    def _post(self, query):
+        return requests.post(self.endpoint + "/interpreter", data = {"data" : query}, timeout = self.timeout)
+
+    ##### asyncio #####
+
+    async def _throttle(self):
+        # rate limit : the queries start at least 1/rate seconds apart
+        async with self._rate_lock:
+            wait = self._next_start - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next_start = time.monotonic() + 1/self.rate
+
+    def _retry_delay(self, attempt, response = None):
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return float(response.headers["Retry-After"])
+        return min(self.max_backoff, self.backoff*2**attempt)*random.uniform(0.5, 1)
+
+    async def _query(self, query):
+        answer = self._load(query)
+        if answer is not None:
+            self.stats["cached"] += 1
+            return answer
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                if self.check_slots:
+                    wait = await asyncio.to_thread(self._slot_wait)
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                await self._throttle()
+                response = None
+                try:
+                    response = await asyncio.to_thread(self._post, query)
+                except requests.exceptions.RequestException as e:
+                    error = e
+                else:
+                    if response.status_code not in RETRY_STATUS:
+                        response.raise_for_status()
+                        answer = response.json()
+                        self.stats["queries"] += 1
+                        self.stats["bytes"] += len(response.content)
+                        self._save(query, answer)
+                        return answer
+                    error = requests.HTTPError(f"{response.status_code} from {self.endpoint}", response = response)
+                if attempt == self.max_retries:
+                    raise error
+                self.stats["retries"] += 1
+                await asyncio.sleep(self._retry_delay(attempt, response))
+
+    async def _fetch(self, queries, progress):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._rate_lock = asyncio.Lock()
+        self._next_start = 0
+        tasks = [asyncio.ensure_future(self._query(q)) for q in queries]
+        if progress:
+            done = 0
+            for task in asyncio.as_completed(tasks):
+                await task
+                done += 1
+                print(f"\roverpass : {done}/{len(tasks)} queries", end = "", flush = True)
+            print()
+        return await asyncio.gather(*tasks)
+
+    def fetch_queries(self, queries, progress = False):
+        """
+        Answers (json) of the Overpass QL queries, in the same order
+        """
+        with span("overpass_download", rows = len(queries)) as s:
+            answers = _run(self._fetch(list(queries), progress))
+            s.bytes += self.stats["bytes"]
+        return answers
+
+    ##### osmnx queries #####
+
+    def polygon_queries(self, polygon, tags):
+        """
+        Queries of ox.geometries_from_polygon for polygon (a big polygon is cut in several ones)
+        """
+        return [overpass_query(coords, tags) for coords in polygon_coord_strs(polygon)]
+
+    def get_polygons_POI_tags(self, polygons, tags, progress = False):
+        """
+        Same GeoDataFrames as get_polygon_POI_tags for each polygon, all the queries being run together
+        """
+        create_gdf = _osmnx_create_gdf()
+        polygons = list(polygons)
+        queries = [self.polygon_queries(p, tags) for p in polygons]
+        answers = self.fetch_queries([q for qs in queries for q in qs], progress = progress)
+        gdfs, start = [], 0
+        for polygon, qs in zip(polygons, queries):
+            gdf = create_gdf(answers[start:start + len(qs)], polygon, tags)
+            start += len(qs)
+            if len(gdf) > 0 and gdf.crs is None:
+                gdf = gdf.set_crs(WGS84)
+            gdfs.append(gdf)
+        return gdfs
+
+##### Overpass QL (as osmnx 1.x) #####
+
+def _overpass_settings():
+    settings = ox.settings
+    timeout = getattr(settings, "timeout", getattr(settings, "requests_timeout", 180))
+    memory = getattr(settings, "memory", getattr(settings, "overpass_memory", None))
+    template = getattr(settings, "overpass_settings", "[out:json][timeout:{timeout}]{maxsize}")
+    return template.format(timeout = timeout, maxsize = "" if memory is None else f"[maxsize:{memory}]")
+
+def _subdivide(polygon, max_area, min_num = 3):
+    """
+    polygon (metric CRS) as a list of polygons of at most max_area, as osmnx 1.x (_consolidate_subdivide_geometry) :
+    its convex hull split by a grid of max(ceil(width/sqrt(max_area)) + 1, min_num) evenly spaced lines on each axis
+    """
+    from shapely.ops import split
+
+    if polygon.geom_type == "MultiPolygon" or polygon.area > max_area:
+        polygon = polygon.convex_hull
+    if polygon.area <= max_area:
+        return [polygon]
+    width = math.sqrt(max_area)
+    west, south, east, north = polygon.bounds
+    xs = np.linspace(west, east, num = max(int(np.ceil((east - west)/width) + 1), min_num))
+    ys = np.linspace(south, north, num = max(int(np.ceil((north - south)/width) + 1), min_num))
+    lines = [shapely.geometry.LineString([(x, ys[0]), (x, ys[-1])]) for x in xs] + \
+            [shapely.geometry.LineString([(xs[0], y), (xs[-1], y)]) for y in ys]
+    parts = [polygon]
+    for line in lines:
+        parts = [g for part in parts for g in (split(part, line).geoms if part.intersects(line) else [part])]
+    return parts
+
+def polygon_coord_strs(polygon, max_query_area_size = None):
+    """
+    "lat lon lat lon ..." strings of the exterior of polygon (WGS-84), cut in parts of at most
+    max_query_area_size square meters (ox.settings.max_query_area_size by default)
+    """
+    max_area = max_query_area_size or ox.settings.max_query_area_size
+    projected, crs = ox.projection.project_geometry(polygon)
+    parts = shapely.geometry.MultiPolygon(_subdivide(projected, max_area))
+    parts, _ = ox.projection.project_geometry(parts, crs = crs, to_latlong = True)
+    return [" ".join(f"{lat:.6f} {lon:.6f}" for lon, lat in part.exterior.coords) for part in parts.geoms]
+
+def overpass_query(polygon_coord_str, tags):
+    """
+    Overpass QL query of the nodes, ways and relations with one of the tags in the polygon
+    tags : dict {key : True (any value), False (no value), a value or a list of values}
+    """
+    components = []
+    for key, values in tags.items():
+        if isinstance(values, bool):
+            selectors = [f"['{key}']" if values else f"['{key}'!~'.']"]
+        else:
+            selectors = [f"['{key}'='{v}']" for v in ([values] if isinstance(values, str) else values)]
+        for selector in selectors:
+            tag_str = f"{selector}(poly:'{polygon_coord_str}');(._;>;);"
+            components += [f"({kind}{tag_str});" for kind in ("node", "way", "relation")]
+    return f"{_overpass_settings()};({''.join(components)});out;"
+
+def _osmnx_create_gdf():
+    """
+    osmnx function turning the Overpass answers into a GeoDataFrame (osmnx 1.x : ox.geometries._create_gdf)
+    """
+    create_gdf = getattr(getattr(ox, "geometries", None), "_create_gdf", None)
+    if not ox.__version__.startswith("1.") or create_gdf is None:
+        raise ImportError(f"helpers.overpass needs osmnx 1.x to build the GeoDataFrames (found osmnx {ox.__version__}), "
+                          "see environment.yml")
+    return create_gdf
+
+def _run(coroutine):
+    """
+    asyncio.run, or in a new thread if an event loop is already running (jupyter)
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+def get_polygons_POI_tags(polygons,
+    tags = {"amenity":["restaurant", "cafe","bar","ice_cream","fast_food","pub","food_court","biergarten"]},
+    concurrency = 2, rate = 1.0, progress_dir = ".overpass_cache", endpoint = None, progress = True, **kwargs):
+    """
+    get_polygon_POI_tags on several polygons (or tiles of a grid) at once, see OverpassClient
+    Returns the list of the GeoDataFrames of the polygons (WGS-84)
+    """
+    client = OverpassClient(endpoint = endpoint, concurrency = concurrency, rate = rate, progress_dir = progress_dir, **kwargs)
+    return client.get_polygons_POI_tags(polygons, tags, progress = progress)
+
+def get_tiles_POI_tags(tiles : "gpd.GeoDataFrame", tags, **kwargs):
+    """
+    POI of every tile of a GeoDataFrame of polygons (for instance squares of 1km), in one GeoDataFrame without duplicates
+    """
+    gdfs = get_polygons_POI_tags(tiles.to_crs(WGS84).geometry, tags, **kwargs)
+    gdfs = [g for g in gdfs if len(g) > 0]
+    if not gdfs:
+        return gpd.GeoDataFrame(geometry = [], crs = WGS84)
+    gdf = pd.concat(gdfs)
+    return gdf[~gdf.index.duplicated()]
@@ -0,0 +1,306 @@
+import contextlib
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+from .tracing import span
+
+"""
+Small pipeline runner for the analysis :
+grid (Filosofi) -> pois (fetch) -> categories (find_cat) -> counts (grid aggregation) -> weights (distance band)
+-> demand -> access (2SFCA) -> aggregate (aggregate_2SFCA) -> clusters (KMeansInterp)
+
+Every stage is fingerprinted from its parameters, its code and the fingerprints of its inputs.
+Outputs are pickled in cache_dir, so that a stage is only recomputed if something it depends on changed :
+changing weight_age recomputes demand and the stages after it, the POI are not downloaded again;
+the demand only depends on the grid and the weights, new POI do not recompute it.
+
+From the command line (from the root of the repository) :
+python -m helpers.pipeline --grid data/Filosofi2015_carreaux_200m_paris.gpkg --until access --weight-age Ind_65_79=2
+"""
+
+class Stage:
+    def __init__(self, name, func, inputs = (), params = (), files = ()):
+        """
+        func : called as func(*outputs of inputs, params) and returns the output of the stage
+        inputs : names of the stages whose outputs are needed
+        params : names of the parameters used by the stage (only those change its fingerprint)
+        files : names of the parameters that are paths of input files (their size and date are fingerprinted)
+        """
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = list(params)
+        self.files = list(files)
+
+class Pipeline:
+    """
+    DAG of stages with cached outputs.
+    params : dict of all the parameters of the stages
+    """
+    def __init__(self, params : dict, cache_dir : str = ".pipeline_cache"):
+        self.params = dict(params)
+        self.cache_dir = cache_dir
+        self.stages = {}
+        self.report = []
+
+    def add_stage(self, name, func, inputs = (), params = (), files = ()):
+        for i in inputs:
+            if i not in self.stages:
+                raise ValueError(f"stage {name} needs {i} which is not defined before")
+        self.stages[name] = Stage(name, func, inputs, params, files)
+        return self
+
+    def fingerprint(self, name, _memo = None):
+        """
+        sha256 of the stage name, code, parameters, input files and inputs fingerprints
+        """
+        _memo = {} if _memo is None else _memo
+        if name in _memo:
+            return _memo[name]
+        stage = self.stages[name]
+        try:
+            code = inspect.getsource(stage.func)
+        except (OSError, TypeError):
+            code = stage.func.__qualname__
+        payload = {
+            "name" : name,
+            "code" : code,
+            "params" : {p : self.params.get(p) for p in stage.params},
+            "files" : {f : _file_signature(self.params.get(f)) for f in stage.files},
+            "inputs" : [self.fingerprint(i, _memo) for i in stage.inputs],
+        }
+        digest = hashlib.sha256(json.dumps(payload, sort_keys = True, default = str).encode()).hexdigest()
+        _memo[name] = digest
+        return digest
+
+    def _cache_file(self, name, fingerprint):
+        return os.path.join(self.cache_dir, f"{name}-{fingerprint[:16]}.pkl")
+
+    def is_cached(self, name):
+        return os.path.exists(self._cache_file(name, self.fingerprint(name)))
+
+    def run(self, target = None, force = ()):
+        """
+        Compute target (the last stage by default), recomputing only the stages whose fingerprint
+        has no cached output (and the stages in force).
+        Returns the output of target. The status of each stage is in self.report.
+        """
+        target = target or list(self.stages)[-1]
+        self.report = []
+        fingerprints = {}
+        outputs = {}
+
+        def get(name):
+            if name in outputs:
+                return outputs[name]
+            fp = self.fingerprint(name, fingerprints)
+            path = self._cache_file(name, fp)
+            if name not in force and os.path.exists(path):
+                t = time.perf_counter()
+                with span("pipeline." + name, status = "cached"):
+                    with open(path, "rb") as f:
+                        outputs[name] = pickle.load(f)
+                status = "cached"
+            else:
+                stage = self.stages[name]
+                args = [get(i) for i in stage.inputs]
+                t = time.perf_counter()
+                with span("pipeline." + name, status = "computed"):
+                    outputs[name] = stage.func(*args, self.params)
+                os.makedirs(self.cache_dir, exist_ok = True)
+                with open(path, "wb") as f:
+                    pickle.dump(outputs[name], f, protocol = pickle.HIGHEST_PROTOCOL)
+                status = "computed"
+            self.report.append({"stage" : name, "status" : status, "fingerprint" : fp[:16],
+                                "seconds" : time.perf_counter() - t})
+            return outputs[name]
+
+        return get(target)
+
+    def status(self):
+        """
+        DataFrame with, for each stage, its fingerprint and whether its output is cached
+        """
+        fingerprints = {}
+        return pd.DataFrame([{"stage" : name, "inputs" : ", ".join(s.inputs),
+                              "fingerprint" : self.fingerprint(name, fingerprints)[:16],
+                              "cached" : os.path.exists(self._cache_file(name, fingerprints[name]))}
+                             for name, s in self.stages.items()])
+
+    def clear_cache(self, keep_current = True):
+        """
+        Remove the cached outputs (only the outdated ones if keep_current)
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        current = {os.path.basename(self._cache_file(n, self.fingerprint(n))) for n in self.stages} if keep_current else set()
+        for f in os.listdir(self.cache_dir):
+            if f.endswith(".pkl") and f not in current:
+                os.remove(os.path.join(self.cache_dir, f))
+
+def _file_signature(path):
+    if path is None or not os.path.exists(str(path)):
+        return path
+    st = os.stat(path)
+    return {"path" : os.path.abspath(path), "size" : st.st_size, "mtime" : st.st_mtime}
+
+##########################################
+##### Stages of the analysis ########
+##########################################
+
+DEFAULT_PARAMS = {
+    "grid" : "data/Filosofi2015_carreaux_200m_paris.gpkg",
+    "place" : "Paris",
+    "city" : "Paris, Ile-de-France, France",
+    "categories" : ['restaurant', 'culture and art', 'education', 'food_shops', 'fashion_beauty', 'supply_shops'],
+    "threshold" : 1.0,
+    "weight_age" : {'Ind_0_3' : 1, "Ind_4_5" : 1, "Ind_6_10" : 1, "Ind_11_17" : 1, "Ind_18_24" : 1,
+                    "Ind_25_39" : 1, "Ind_40_54" : 1, "Ind_55_64" : 1, "Ind_65_79" : 1, "Ind_80p" : 1, "Ind_inc" : 1},
+    "weight" : True,
+    "n_clusters" : 5,
+    "cluster_features" : None,
+    # number of principal components before the clustering (None : clustering on the features)
+    "pca_components" : None,
+    "random_state" : 0,
+}
+
+# semaphore shared by the pipelines of several cities run at once, to cap the concurrent Overpass downloads
+# (set in the workers of helpers.cities), None : no cap
+_overpass_slots = None
+
+def _overpass_slot():
+    return _overpass_slots if _overpass_slots is not None else contextlib.nullcontext()
+
+def _stage_grid(params):
+    import geopandas as gpd
+    return gpd.read_file(params["grid"]).to_crs("EPSG:4326")
+
+def _stage_pois(params):
+    from .scrapping import download_place_POI, add_POI_centers, shops, amenities
+    with _overpass_slot():
+        gdf_pois = download_place_POI(params["place"] + ", " + params["city"], {"shop" : shops, "amenity" : amenities})
+    return add_POI_centers(gdf_pois)
+
+def _stage_categories(pois, params):
+    from .scrapping import find_cat, reduce_oms_var
+    pois = pois.reset_index(drop = True)
+    for tag in ["amenity", "shop"]:
+        if tag not in pois.columns:
+            pois[tag] = None
+    pois = find_cat(pois, params["categories"], dummy = True)
+    return reduce_oms_var(pois, categories = params["categories"])
+
+def _stage_counts(grid, categories, params):
+    from .scrapping import aggregating_from_dummies_on_grid
+    counts = aggregating_from_dummies_on_grid(grid.copy(), categories, categories = params["categories"])
+    return counts.set_index("IdINSPIRE")
+
+def _stage_weights(grid, params):
+    from .scrapping import calculate_distanceband_weights
+    return calculate_distanceband_weights(grid.copy(), threshold = params["threshold"])
+
+def _stage_demand(grid, weights, params):
+    from .scrapping import calculate_2SFCA_demand
+    # the demand only needs the population (Ind_* columns) of the grid, not the POI counts
+    population = grid.set_index("IdINSPIRE")[list(params["weight_age"])]
+    return calculate_2SFCA_demand(population.loc[weights.index], weights, weight_age = params["weight_age"])
+
+def _stage_access(counts, weights, demand, params):
+    from .scrapping import calculate_2SFCA_accessibility
+    counts = counts.loc[weights.index]
+    access = calculate_2SFCA_accessibility(counts, params["categories"], weights, demand = demand)
+    return counts.join(access.add_suffix("_access"))
+
+def _stage_aggregate(access, params):
+    from .scrapping import aggregate_2SFCA
+    return aggregate_2SFCA(access.copy(), categories = params["categories"], weight = params["weight"])
+
+def _stage_clusters(aggregate, params):
+    from kmeans_interp.kmeans_feature_imp import KMeansInterp
+    from kmeans_interp.reduction import ChunkedPCA, ReducedKMeansInterp
+    features = params["cluster_features"] or [c + "_access" for c in params["categories"]]
+    X = aggregate[features].fillna(0).values
+    if params["pca_components"]:
+        reducer = ChunkedPCA(n_components = params["pca_components"], random_state = params["random_state"])
+        km = ReducedKMeansInterp(ordered_feature_names = features, reducer = reducer, n_clusters = params["n_clusters"],
+            random_state = params["random_state"], n_init = 10).fit(X)
+    else:
+        std = X.std(axis = 0)
+        # a constant feature stays at 0 instead of nan
+        X = (X - X.mean(axis = 0))/np.where(std > 0, std, 1)
+        km = KMeansInterp(ordered_feature_names = features, n_clusters = params["n_clusters"],
+            random_state = params["random_state"], n_init = 10).fit(X)
+    clusters = aggregate.copy()
+    clusters["label"] = km.labels_
+    return clusters
+
+def analysis_pipeline(params : dict = None, cache_dir : str = ".pipeline_cache"):
+    """
+    The Pipeline of the analysis, params overrides DEFAULT_PARAMS
+    """
+    p = dict(DEFAULT_PARAMS)
+    p.update(params or {})
+    # 1 and 1.0 must give the same fingerprint (the command line gives floats)
+    p["threshold"] = float(p["threshold"])
+    pipe = Pipeline(p, cache_dir = cache_dir)
+    pipe.add_stage("grid", _stage_grid, params = ["grid"], files = ["grid"])
+    pipe.add_stage("pois", _stage_pois, params = ["place", "city"])
+    pipe.add_stage("categories", _stage_categories, ["pois"], params = ["categories"])
+    pipe.add_stage("counts", _stage_counts, ["grid", "categories"], params = ["categories"])
+    pipe.add_stage("weights", _stage_weights, ["grid"], params = ["threshold"])
+    pipe.add_stage("demand", _stage_demand, ["grid", "weights"], params = ["weight_age"])
+    pipe.add_stage("access", _stage_access, ["counts", "weights", "demand"], params = ["categories"])
+    pipe.add_stage("aggregate", _stage_aggregate, ["access"], params = ["categories", "weight"])
+    pipe.add_stage("clusters", _stage_clusters, ["aggregate"], params = ["cluster_features", "n_clusters", "random_state", "pca_components"])
+    return pipe
+
+def _parse_weight_age(values):
+    weight_age = dict(DEFAULT_PARAMS["weight_age"])
+    for v in values:
+        k, w = v.split("=")
+        weight_age[k] = float(w)
+    return weight_age
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Run the analysis pipeline, recomputing only the stages whose inputs changed")
+    parser.add_argument("-g", "--grid", default = DEFAULT_PARAMS["grid"], help = "Filosofi grid file, default=" + DEFAULT_PARAMS["grid"])
+    parser.add_argument("-p", "--place", default = DEFAULT_PARAMS["place"])
+    parser.add_argument("--city", default = DEFAULT_PARAMS["city"])
+    parser.add_argument("--categories", nargs = "+", default = DEFAULT_PARAMS["categories"])
+    parser.add_argument("-t", "--threshold", type = float, default = DEFAULT_PARAMS["threshold"], help = "distance band in km, default=1")
+    parser.add_argument("-w", "--weight-age", nargs = "*", default = [], help = "age weights as Ind_65_79=2 (others are 1)")
+    parser.add_argument("-k", "--n-clusters", type = int, default = DEFAULT_PARAMS["n_clusters"])
+    parser.add_argument("--pca", type = int, default = None, help = "number of principal components before the clustering")
+    parser.add_argument("-u", "--until", default = "clusters", help = "last stage to compute, default=clusters")
+    parser.add_argument("-f", "--force", nargs = "*", default = [], help = "stages to recompute even if cached")
+    parser.add_argument("-c", "--cache-dir", default = ".pipeline_cache")
+    parser.add_argument("-s", "--status", action = "store_true", help = "only print which stages are cached")
+    parser.add_argument("-o", "--outfile", help = "write the output of the last stage (.csv, .gpkg or .pkl)")
+    args = parser.parse_args()
+
+    pipe = analysis_pipeline({"grid" : args.grid, "place" : args.place, "city" : args.city,
+        "categories" : args.categories, "threshold" : args.threshold,
+        "weight_age" : _parse_weight_age(args.weight_age), "n_clusters" : args.n_clusters,
+        "pca_components" : args.pca}, cache_dir = args.cache_dir)
+    if args.status:
+        print(pipe.status().to_string(index = False))
+    else:
+        result = pipe.run(args.until, force = args.force)
+        print(pd.DataFrame(pipe.report).to_string(index = False))
+        if args.outfile:
+            if args.outfile.endswith(".pkl"):
+                pd.to_pickle(result, args.outfile)
+            elif args.outfile.endswith(".csv"):
+                result.to_csv(args.outfile)
+            else:
+                result.to_file(args.outfile)
+            print("output written in " + args.outfile)
@@ -0,0 +1,211 @@
+import difflib
+import re
+import unicodedata
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from .grid import METRIC_CRS, WGS84, project_xy
+from .tracing import traced
+
+"""
+Index of the POI by name, built once for a GeoDataFrame of get_place_POI (with its "center" column),
+instead of scanning poi['name'] == name for each POI of each route.
+The names are normalized (lower case, without accents and punctuation) : "Café de Flore" = "cafe de flore".
+- exact lookup with a binary search on the sorted normalized names,
+- prefix search (same sorted names) and fuzzy search (trigrams, then difflib),
+- a name shared by several POI (chains, "Monoprix"...) is resolved with the POI closest to a point,
+- coordinates of thousands of names at once.
+
+    index = helpers.get_poi_index(gdf_pois)
+    coords = index.coordinates(["Café de Flore", "Les Deux Magots"], near = (2.333, 48.854))
+"""
+
+def normalize_name(name):
+    """
+    Lower case name without accents, punctuation and repeated spaces
+    """
+    if not isinstance(name, str):
+        return ""
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c)).casefold()
+    return " ".join(re.sub(r"[^\w]+", " ", name).split())
+
+def _trigrams(key):
+    key = f"  {key} "
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+class POIIndex:
+    """
+    poi : GeoDataFrame of POI (get_place_POI), the coordinates are its "center" column (or the centroids)
+    name_col : column of the names
+    """
+    def __init__(self, poi, name_col = "name", metric_crs = METRIC_CRS):
+        named = poi[poi[name_col].notna()] if name_col in poi.columns else poi.iloc[:0]
+        centers = named["center"] if "center" in named.columns else named.geometry.to_crs(WGS84).centroid
+        keys = np.array([normalize_name(n) for n in named[name_col]], dtype = object)
+        order = np.argsort(keys, kind = "stable")
+        self.keys = keys[order]
+        self.labels = named.index[order]
+        self.names = named[name_col].to_numpy()[order]
+        self.lon, self.lat = centers.x.to_numpy()[order], centers.y.to_numpy()[order]
+        self.x, self.y = project_xy(self.lon, self.lat, WGS84, metric_crs)
+        self.metric_crs = metric_crs
+        self._trigram_index = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    ##### search #####
+
+    def _range(self, key):
+        return np.searchsorted(self.keys, key, side = "left"), np.searchsorted(self.keys, key, side = "right")
+
+    def exact(self, name):
+        """
+        Positions of the POI whose normalized name is the one of name
+        """
+        start, end = self._range(normalize_name(name))
+        return np.arange(start, end)
+
+    def prefix(self, prefix, limit = 20):
+        """
+        Names starting with prefix (normalized) : DataFrame as in coordinates
+        """
+        key = normalize_name(prefix)
+        start = np.searchsorted(self.keys, key, side = "left")
+        end = np.searchsorted(self.keys, key + "\uffff", side = "left")
+        return self._frame(np.arange(start, min(end, start + limit)))
+
+    def _build_trigrams(self):
+        self.unique_keys, self.unique_start = np.unique(self.keys, return_index = True)
+        index = {}
+        for k, key in enumerate(self.unique_keys):
+            for t in _trigrams(key):
+                index.setdefault(t, []).append(k)
+        self._trigram_index = {t : np.array(ks) for t, ks in index.items()}
+        self._trigram_count = np.array([len(_trigrams(k)) for k in self.unique_keys])
+
+    def fuzzy(self, name, limit = 5, cutoff = 0.75, candidates = 50):
+        """
+        Closest normalized names (trigrams shared, then difflib ratio above cutoff).
+        Returns a list of (normalized name, ratio), best first
+        """
+        if self._trigram_index is None:
+            self._build_trigrams()
+        key = normalize_name(name)
+        grams = _trigrams(key)
+        hits = [self._trigram_index[t] for t in grams if t in self._trigram_index]
+        if not hits:
+            return []
+        shared = np.bincount(np.concatenate(hits), minlength = len(self.unique_keys))
+        jaccard = shared/(len(grams) + self._trigram_count - shared)
+        best = np.argsort(-jaccard)[:candidates]
+        best = best[shared[best] > 0]
+        ratios = [(self.unique_keys[k], difflib.SequenceMatcher(None, key, self.unique_keys[k]).ratio()) for k in best]
+        ratios = [r for r in ratios if r[1] >= cutoff]
+        return sorted(ratios, key = lambda r : -r[1])[:limit]
+
+    def _closest(self, positions, near):
+        """
+        Position of the POI of positions closest to near (lon, lat)
+        """
+        x, y = project_xy(np.array([near[0]]), np.array([near[1]]), WGS84, self.metric_crs)
+        return positions[np.argmin((self.x[positions] - x[0])**2 + (self.y[positions] - y[0])**2)]
+
+    def lookup(self, name, near = None, fuzzy = True):
+        """
+        Index label of the POI named name : the closest to near (lon, lat) if several POI have this name
+        (else the first one), the closest fuzzy match if there is no exact one. None if not found.
+        """
+        position = self.resolve(name, near, fuzzy)[0]
+        return None if position < 0 else self.labels[position]
+
+    def resolve(self, name, near = None, fuzzy = True):
+        """
+        (position, match, candidates) of the POI named name, as one row of coordinates : position is -1 if not found,
+        match is "exact", "fuzzy" or "missing", candidates the number of POI with this name
+        """
+        positions, match = self.exact(name), "exact"
+        if len(positions) == 0 and fuzzy:
+            matches = self.fuzzy(name, limit = 1)
+            if matches:
+                positions, match = np.arange(*self._range(matches[0][0])), "fuzzy"
+        if len(positions) == 0:
+            return -1, "missing", 0
+        if len(positions) > 1 and near is not None:
+            return self._closest(positions, near), match, len(positions)
+        return positions[0], match, len(positions)
+
+    ##### bulk #####
+
+    def _frame(self, positions, match = "exact", candidates = 1):
+        positions = np.asarray(positions, dtype = np.int64)
+        found = positions >= 0
+        labels, names = np.full(len(positions), None, dtype = object), np.full(len(positions), None, dtype = object)
+        lon, lat = np.full(len(positions), np.nan), np.full(len(positions), np.nan)
+        # labels can be tuples (element_type, osmid) : object array of the index
+        labels[found] = self.labels.to_numpy()[positions[found]]
+        names[found] = self.names[positions[found]]
+        lon[found], lat[found] = self.lon[positions[found]], self.lat[positions[found]]
+        return pd.DataFrame({"poi" : labels, "name" : names, "lon" : lon, "lat" : lat,
+            "match" : match, "candidates" : candidates})
+
+    @traced("poi_lookup")
+    def coordinates(self, names, near = None, fuzzy = True):
+        """
+        Coordinates of many names at once.
+        near : None, a point (lon, lat) or a list of points (one by name) to choose between POI of the same name
+        Returns a DataFrame (one row by name, in the order of names) : query, poi (index label), name, lon, lat,
+        match ("exact", "fuzzy" or "missing") and candidates (number of POI with this name)
+        """
+        names = list(names)
+        keys = np.array([normalize_name(n) for n in names], dtype = object)
+        start = np.searchsorted(self.keys, keys, side = "left")
+        end = np.searchsorted(self.keys, keys, side = "right")
+        positions = np.where(end > start, start, -1)
+        match = np.where(end > start, "exact", "missing").astype(object)
+        candidates = end - start
+        if near is not None and np.ndim(near) == 1:
+            near = [near]*len(names)
+        # only the ambiguous and missing names need more work
+        for i in np.flatnonzero((candidates > 1) & (near is not None) | (candidates == 0) & fuzzy):
+            positions[i], match[i], candidates[i] = self.resolve(names[i], None if near is None else near[i], fuzzy)
+        result = self._frame(positions, match, candidates)
+        result.insert(0, "query", names)
+        return result
+
+_indexes = {}
+
+def _names_array(poi, name_col):
+    return poi[name_col].values if name_col in poi.columns else None
+
+def _unchanged(cached, poi, name_col):
+    """
+    O(1) check that poi was not changed since its index was built : same number of rows and same array of names
+    (a new name column, or rows added or dropped). Names edited in place need rebuild = True.
+    """
+    length, names = cached
+    current = _names_array(poi, name_col)
+    if length != len(poi):
+        return False
+    if names is current:
+        return True
+    # a new array object can be a view of the same data
+    return isinstance(names, np.ndarray) and isinstance(current, np.ndarray) and names.shape == current.shape \
+        and names.__array_interface__["data"] == current.__array_interface__["data"]
+
+def get_poi_index(poi, name_col = "name", rebuild = False, **kwargs):
+    """
+    POIIndex of poi, built once and kept while poi exists, has the same rows and the same name column
+    (rebuild = True after editing names or moving POI of poi in place)
+    """
+    key = (id(poi), name_col)
+    cached = _indexes.get(key)
+    if cached is None or cached[0]() is not poi or rebuild or not _unchanged(cached[1], poi, name_col):
+        index = POIIndex(poi, name_col = name_col, **kwargs)
+        _indexes[key] = (weakref.ref(poi, lambda _, key = key : _indexes.pop(key, None)),
+                         (len(poi), _names_array(poi, name_col)), index)
+        return index
+    return cached[2]
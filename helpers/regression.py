@@ -0,0 +1,189 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .lazy import lazy_import
+from .tracing import span, traced
+
+sparse = lazy_import("scipy.sparse")
+stats = lazy_import("scipy.stats")
+spreg = lazy_import("spreg")
+
+"""
+Spatial regressions of many dependent variables at once, instead of one LM_test / reg_spatial call by variable.
+The spatial lags WX, W²X (instruments, w_lags = 2) and Wy of every variable are computed once, then :
+- OLS and the LM diagnostics of LM_test (lme, lml, rlme, rlml, sarma) for all the dependent variables
+  of a specification with one solve,
+- the spatial lag model (S2SLS, as spreg.GM_Lag) with the instruments [X, WX, W²X] projected once,
+- the SARMA of reg_spatial (spreg.GM_Combo_Het), fitted in a process pool, W being sent once to each worker.
+Everything is returned in one tidy DataFrame instead of printed :
+
+    table = helpers.batch_regressions(gdf, ["restaurant_access", "education_access"], ["Ind_snv", "Men_pauv"], w,
+                                      models = ["ols", "lag"])
+    table[table["kind"] == "test"]
+"""
+
+def _sparse_w(w):
+    """
+    scipy csr of a libpysal W (as given, transform it before) or of a scipy matrix
+    """
+    return sparse.csr_matrix(w.sparse if hasattr(w, "sparse") else w, dtype = float)
+
+def _specifications(dep_vars, indep_var):
+    """
+    Specifications as (dependent variables, explanatory variables) : dep_vars is a list of str with the same indep_var,
+    or a list of dicts {"dep_var" : str or list, "indep_var" : list}. The dependent variables with the same
+    explanatory variables are grouped.
+    """
+    groups = {}
+    for spec in dep_vars:
+        if isinstance(spec, str):
+            spec = {"dep_var" : spec, "indep_var" : indep_var}
+        ys = [spec["dep_var"]] if isinstance(spec["dep_var"], str) else list(spec["dep_var"])
+        groups.setdefault(tuple(spec["indep_var"]), []).extend(ys)
+    return [(list(dict.fromkeys(ys)), list(xs)) for xs, ys in groups.items()]
+
+def spatial_lags(df, columns, W, w_lags = 2):
+    """
+    DataFrame of the spatial lags W^l x of the columns, l = 1..w_lags (columns W_x, W2_x...)
+    """
+    values = df[list(columns)].to_numpy(dtype = float)
+    lags = {}
+    for l in range(1, w_lags + 1):
+        values = W @ values
+        for j, c in enumerate(columns):
+            lags[("W_" if l == 1 else f"W{l}_") + c] = values[:, j]
+    return pd.DataFrame(lags, index = df.index)
+
+def _tidy(dep_vars, model, terms, coefs, se, dof = None):
+    """
+    Rows (dep_var, model, kind = "coef", term, estimate, se, statistic, p_value), coefs and se : (terms, dep_vars)
+    """
+    statistic = coefs/se
+    p = 2*(stats.t.sf(np.abs(statistic), dof) if dof else stats.norm.sf(np.abs(statistic)))
+    return pd.DataFrame({"dep_var" : np.repeat(dep_vars, len(terms)), "model" : model, "kind" : "coef",
+        "term" : np.tile(terms, len(dep_vars)), "estimate" : coefs.T.ravel(), "se" : se.T.ravel(),
+        "statistic" : statistic.T.ravel(), "p_value" : p.T.ravel()})
+
+def _ols(Y, X, WY, W, trace, dep_vars, names):
+    """
+    OLS (as spreg.OLS) and LM tests (as spreg.LMtests) of the columns of Y with the same X (with a constant)
+    """
+    n, k = X.shape
+    XtX_inv = np.linalg.inv(X.T @ X)
+    B = XtX_inv @ (X.T @ Y)
+    E = Y - X @ B
+    ee = (E*E).sum(axis = 0)
+    se = np.sqrt(np.outer(np.diag(XtX_inv), ee/(n - k)))
+    table = _tidy(dep_vars, "ols", names, B, se, dof = n - k)
+
+    # LM tests (Anselin 1996), s2 = e'e/n as in spreg
+    s2 = ee/n
+    lm_error_score = (E*(W @ E)).sum(axis = 0)/s2
+    lm_lag_score = (E*WY).sum(axis = 0)/s2
+    # W(XB) and not (WX)B : the lag of the constant is not 1 if W is not row standardized or has islands
+    WXB = W @ (X @ B)
+    MWXB = WXB - X @ (XtX_inv @ (X.T @ WXB))
+    nJ = ((WXB*MWXB).sum(axis = 0) + trace*s2)/s2
+    tests = {
+        "LM error" : (lm_error_score**2/trace, 1),
+        "LM lag" : (lm_lag_score**2/nJ, 1),
+        "Robust LM error" : ((lm_error_score - trace/nJ*lm_lag_score)**2/(trace*(1 - trace/nJ)), 1),
+        "Robust LM lag" : ((lm_lag_score - lm_error_score)**2/(nJ - trace), 1),
+        "LM SARMA" : ((lm_lag_score - lm_error_score)**2/(nJ - trace) + lm_error_score**2/trace, 2),
+    }
+    tests = pd.DataFrame([{"dep_var" : y, "model" : "ols", "kind" : "test", "term" : test, "estimate" : value[i],
+        "se" : np.nan, "statistic" : value[i], "p_value" : stats.chi2.sf(value[i], df)}
+        for test, (value, df) in tests.items() for i, y in enumerate(dep_vars)])
+    r2 = 1 - ee/((Y - Y.mean(axis = 0))**2).sum(axis = 0)
+    fit = pd.DataFrame({"dep_var" : dep_vars, "model" : "ols", "kind" : "fit", "term" : "R2", "estimate" : r2})
+    return pd.concat([table, tests, fit])
+
+def _lag(Y, X, H, WY, dep_vars, names, robust = None):
+    """
+    Spatial lag model by S2SLS (as spreg.GM_Lag) of the columns of Y, regressors [X, Wy], instruments H = [X, WX, W²X]
+    """
+    n, k = X.shape
+    # projection of the Wy on the instruments, once for every dependent variable
+    WY_hat = H @ np.linalg.lstsq(H, WY, rcond = None)[0]
+    coefs, ses = [], []
+    for j in range(Y.shape[1]):
+        Z = np.column_stack([X, WY[:, j]])
+        Z_hat = np.column_stack([X, WY_hat[:, j]])
+        ZZ_inv = np.linalg.inv(Z_hat.T @ Z)
+        b = ZZ_inv @ (Z_hat.T @ Y[:, j])
+        e = Y[:, j] - Z @ b
+        if robust == "white":
+            vm = ZZ_inv @ (Z_hat.T*(e*e)) @ Z_hat @ ZZ_inv.T
+        else:
+            vm = (e @ e)/n*np.linalg.inv(Z_hat.T @ Z_hat)
+        coefs.append(b)
+        ses.append(np.sqrt(np.diag(vm)))
+    return _tidy(dep_vars, "lag", names + ["W_y"], np.array(coefs).T, np.array(ses).T)
+
+##### SARMA (spreg, in processes) #####
+
+_worker = {}
+
+def _init_worker(w):
+    _worker["w"] = w
+
+def _combo(task):
+    y, X, dep_var, names, w_lags = task
+    model = spreg.GM_Combo_Het(y[:, None], X, w = _worker["w"], w_lags = w_lags, name_y = dep_var, name_x = names)
+    # same term as the lag model for the spatial lag of y
+    names = ["W_y" if name == "W_" + dep_var else name for name in model.name_z]
+    return dep_var, names, model.betas.ravel(), model.std_err
+
+@traced("batch_regressions")
+def batch_regressions(df, dep_vars, indep_var = None, w = None, models = ["ols", "lag"], w_lags = 2, robust = None, n_jobs = 4):
+    """
+    Regressions of many dependent variables with the same spatial weights.
+    df : DataFrame (no missing values in the variables)
+    dep_vars : list of dependent variables (with the explanatory variables indep_var), or list of
+    specifications {"dep_var" : str or list of str, "indep_var" : list of str}
+    w : libpysal W (the one of LM_test / reg_spatial) or scipy sparse matrix in the order of df
+    models : "ols" (OLS and the LM tests of LM_test), "lag" (S2SLS spatial lag), "combo" (SARMA of reg_spatial, needs a
+    libpysal W and spreg)
+    w_lags : instruments of the lag and combo models [X, WX, ..., W^w_lags X] (spreg uses 1 by default)
+    robust : None or "white" (standard errors of the lag model)
+    n_jobs : processes for the combo models
+    Returns a tidy DataFrame : dep_var, model, kind ("coef", "test" or "fit"), term, estimate, se, statistic, p_value
+    """
+    W = _sparse_w(w)
+    specs = _specifications(dep_vars, indep_var)
+    x_columns = list(dict.fromkeys(x for _, xs in specs for x in xs))
+    y_columns = list(dict.fromkeys(y for ys, _ in specs for y in ys))
+    data = df[list(dict.fromkeys(x_columns + y_columns))]
+    if data.isna().any().any():
+        raise ValueError("missing values in " + ", ".join(data.columns[data.isna().any()]))
+
+    # WX, W²X and Wy : once for every specification
+    with span("spatial_lags", rows = len(df)):
+        lags = spatial_lags(df, x_columns, W, w_lags = max(w_lags, 1))
+        WY_all = W @ df[y_columns].to_numpy(dtype = float)
+        trace = W.multiply(W).sum() + W.multiply(W.T).sum()
+    y_position = {y : j for j, y in enumerate(y_columns)}
+
+    tables, tasks = [], []
+    for ys, xs in specs:
+        Y = df[ys].to_numpy(dtype = float)
+        WY = WY_all[:, [y_position[y] for y in ys]]
+        X = np.column_stack([np.ones(len(df)), df[xs].to_numpy(dtype = float)])
+        names = ["CONSTANT"] + xs
+        if "ols" in models:
+            tables.append(_ols(Y, X, WY, W, trace, ys, names))
+        if "lag" in models:
+            instruments = [("W_" if l == 1 else f"W{l}_") + x for l in range(1, w_lags + 1) for x in xs]
+            H = np.column_stack([X, lags[instruments].to_numpy()])
+            tables.append(_lag(Y, X, H, WY, ys, names, robust = robust))
+        if "combo" in models:
+            tasks += [(Y[:, j], X[:, 1:], y, xs, w_lags) for j, y in enumerate(ys)]
+
+    if tasks:
+        with span("combo_fits", rows = len(tasks)):
+            with ProcessPoolExecutor(max_workers = n_jobs, initializer = _init_worker, initargs = (w,)) as executor:
+                for dep_var, names, betas, se in executor.map(_combo, tasks):
+                    tables.append(_tidy([dep_var], "combo", list(names), betas[:, None], np.asarray(se)[:, None]))
+    return pd.concat(tables, ignore_index = True)
@@ -1,22 +1,24 @@
-import geopandas as gpd
-import contextily as ctx
-import matplotlib.pyplot as plt
-import folium
+from __future__ import annotations
+
 import pandas as pd
-import urllib3
-import requests
-import osmnx as ox
-import networkx as nx
 import numpy as np
-from tqdm.auto import tqdm 
-
-from pysal.lib import weights
-from pysal.lib import cg as geometry
-from pysal.model import spreg
-from spreg import OLS
 
-import plotly.express as px
-from palettable.colorbrewer.qualitative import Pastel1_7
+from .lazy import lazy_import
+from .grid import METRIC_CRS, WGS84, project_xy, compact_grid, grid_ids
+from .tracing import span, traced
+from .network import StreetGraph, load_street_graph
+from .poi_index import get_poi_index
+
+# heavy dependencies are only imported when a function needs them (see helpers.lazy)
+gpd = lazy_import("geopandas")
+plt = lazy_import("matplotlib.pyplot")
+folium = lazy_import("folium")
+ox = lazy_import("osmnx")
+nx = lazy_import("networkx")
+weights = lazy_import("libpysal.weights")
+spreg = lazy_import("spreg")
+px = lazy_import("plotly.express")
+tqdm_auto = lazy_import("tqdm.auto")
 
 ##########################################
 ##### General variables ##################
@@ -64,14 +66,77 @@ We are building several functions on top of OSMnx library which itself build
 to interact with Overpass API (a copy of OMS data without the same API limitations)
 """
 
+##########################################
+##### Projection functions ########
+##########################################
+
+@traced("reprojection")
+def add_POI_centers(gdf_pois : gpd.GeoDataFrame, metric_crs = METRIC_CRS):
+    """
+    Add the "center" column to the POI geodataframe.
+    The geometries are projected only once in the metric CRS, where the centroids are computed,
+    then the centroids coordinates are converted back to WGS-84 with a vectorized pyproj transform.
+    Geometries stay in WGS-84.
+    """
+    if gdf_pois.crs is None:
+        gdf_pois = gdf_pois.set_crs(WGS84)
+    centroids = gdf_pois.geometry.to_crs(metric_crs).centroid
+    lon, lat = project_xy(centroids.x.values, centroids.y.values, metric_crs, WGS84)
+    gdf_pois["center"] = gpd.GeoSeries(gpd.points_from_xy(lon, lat), index = gdf_pois.index, crs = WGS84)
+    return gdf_pois
+
+def get_place_network(place : str, consolidate = True, network_type = 'walk', metric_crs = METRIC_CRS, streets = None):
+    """
+    Download the street network in a 1km buffer around place.
+    If consolidate, the graph is projected once to the metric CRS to use 
+    the osmnx consolidate_intersections (tolerance = 15 meters) and converted back to WGS-84 at the end.
+    streets : a StreetGraph of the whole city (or the path of its .npz file, see helpers.network.build_street_graph).
+    If given, nothing is downloaded : the place's graph (1km buffer) is cut from it and returned as a StreetGraph.
+    Returns the streets network in WGS-84
+    """
+    if streets is not None:
+        if not isinstance(streets, StreetGraph):
+            streets = load_street_graph(streets)
+        with span("geocoding"):
+            polygon = ox.geocode_to_gdf(place, buffer_dist=1000)["geometry"].unary_union
+        return streets.subgraph(polygon)
+    with span("network_download") as s:
+        g_place = ox.graph_from_place(place, buffer_dist=1000, network_type=network_type, retain_all=True, truncate_by_edge=True)
+        s.rows = len(g_place)
+    if consolidate:
+        with span("consolidation") as s:
+            g_proj = ox.project_graph(g_place, to_crs=metric_crs)
+            g_proj = ox.consolidate_intersections(g_proj, rebuild_graph=True, tolerance=15, dead_ends=False)
+            g_place = ox.project_graph(g_proj, to_crs=WGS84)
+            s.rows = len(g_place)
+    return g_place
+
+def download_place_POI(place : str, tags : dict, buffer_dist = 1000, columns = None):
+    """
+    Same as ox.geometries_from_place, in two traced stages : 
+    geocoding of the place (Nominatim) and download of the POI in its polygon (Overpass)
+    columns : if given, only these OSM tags columns (and the geometry) are kept, as soon as they are downloaded
+    Returns the POI as a geodataframe in WGS-84
+    """
+    with span("geocoding"):
+        gdf_place = ox.geocode_to_gdf(place, buffer_dist=buffer_dist)
+        polygon = gdf_place["geometry"].unary_union
+    with span("overpass_download") as s:
+        gdf_pois = ox.geometries_from_polygon(polygon, tags)
+        s.rows = len(gdf_pois)
+    if columns is not None:
+        gdf_pois = gdf_pois[[c for c in columns if c in gdf_pois.columns and c != "geometry"] + ["geometry"]]
+    return gdf_pois
+
 ##########################################
 ##### OSMNX functions specific implementation ########
 ##########################################
 
+@traced()
 def get_place_POI_tags(place : str,
     tags = {"amenity":["restaurant", "cafe","bar","ice_cream","fast_food","pub","food_court","biergarten"]},
     city : str = "Paris, Ile-de-France, France", consolidate = True,get_network = False,
-    network_type = 'walk') : 
+    network_type = 'walk', streets = None, compact = False) : 
     """
     Function to get any city's (Paris' by default) neighborhood's OMS POI.
     place : str, must be name sufficiently known
@@ -80,6 +145,8 @@ def get_place_POI_tags(place : str,
     For instance : https://wiki.openstreetmap.org/wiki/FR:%C3%89l%C3%A9ments_cartographiques#
     and : https://wiki.openstreetmap.org/wiki/FR:%C3%89l%C3%A9ments_cartographiques#Consommation
     consolidate : use the osmnx consolidate_intersections (tolerance = 15) to merge place with too complicated intersections like a roundabout 
+    streets : StreetGraph of the city (or path of its .npz) to cut the network from instead of downloading it, see get_place_network
+    compact : keep only the useful OSM tags (dropped at download) and use memory-lean dtypes (see compact_POI)
     Returns the street network in a 1km walking distance as a networkx object 
     and the POI in the same area as a geodataframe
 
@@ -90,34 +157,35 @@ def get_place_POI_tags(place : str,
 
     #get the network
     if get_network:
-        g_place = ox.graph_from_place(place, buffer_dist=1000, network_type=network_type, retain_all=True, truncate_by_edge=True)
-        g_place = ox.project_graph(g_place, to_crs="WGS-84")
-        if consolidate:
-            g_proj = ox.project_graph(g_place)
-            g_place = ox.consolidate_intersections(g_proj, rebuild_graph=True, tolerance=15, dead_ends=False)
+        g_place = get_place_network(place, consolidate=consolidate, network_type=network_type, streets=streets)
     
-    gdf_pois = ox.geometries_from_place(place, tags, buffer_dist=1000)
+    gdf_pois = download_place_POI(place, tags, buffer_dist=1000, columns=["name"] + list(tags) if compact else None)
     #certains lieux (comme une ville) ont un polygone associée : 
     # on peut donc récupérer les POI sans indiquer de dist
-    gdf_pois = ox.project_gdf(gdf= gdf_pois, to_crs="WGS-84")
-    gdf_pois = gdf_pois.to_crs("WGS-84")
-    gdf_pois = gdf_pois.set_crs("WGS-84")
-    gdf_pois["center"]=gdf_pois.to_crs("WGS-84").centroid
+    gdf_pois = add_POI_centers(gdf_pois)
     #chaque ligne peut être soit un polygone (par exemple pour le champ de Mars), soit un point comme un restaurant : on calcul le centre pour avoir une référence unique
+    if compact:
+        gdf_pois = compact_POI(gdf_pois)
     if get_network:
         return g_place, gdf_pois    #On récupère directement un networkx et un geodataframe
     else:
         return gdf_pois
 
+@traced("find_cat")
 def find_cat(df, 
              categories = ["restaurant", "culture and art",
               "education", 'food_shops', 'health',
                'fashion_beauty', 'supply_shops'],
              dummy = False,
-             tags_for_cat = categories_tags) :
+             tags_for_cat = categories_tags,
+             compact = False) :
+    """
+    Add a dummy column by category (dummy = True) or the 'category' column of each POI (from its amenity and shop tags)
+    compact : the dummies are uint8 instead of int64, and the category column is categorical
+    """
     if dummy:
         for cat in categories : 
-            list_cat_dummy = np.zeros(len(df),dtype = int)
+            list_cat_dummy = np.zeros(len(df),dtype = np.uint8 if compact else int)
             for i in range(len(df)) :
                 if df['amenity'][i] in tags_for_cat[cat]:
                     list_cat_dummy[i] = 1
@@ -132,6 +200,8 @@ def find_cat(df,
                     df['category'][i] = x
                 if df['shop'][i] in tags_for_cat[x] : 
                     df['category'][i] = x
+        if compact:
+            df['category'] = df['category'].astype('category')
     return df
 
 def reduce_tags(tags):
@@ -149,6 +219,7 @@ def reduce_tags(tags):
     return reduced_tags
             
 
+@traced()
 def get_place_POI(place: str, 
     tags : dict = {"shop": shops, "amenity" : amenities},
     categories = categories_tags.keys(),
@@ -157,7 +228,9 @@ def get_place_POI(place: str,
     number_var_reduced = True,
     get_network = False,
     consolidate = True,
-    network_type = 'walk') :
+    network_type = 'walk',
+    streets = None,
+    compact = False) :
     """
     Function to get any city's (Paris' by default) neighborhood's OMS POI.
     place : str, must be name sufficiently known
@@ -170,6 +243,8 @@ def get_place_POI(place: str,
     list_education = ["college", "driving_school", "kindergarten", "language_school", "training", "school", "university"]
     See : https://wiki.openstreetmap.org/wiki/FR:%C3%89l%C3%A9ments_cartographiques#
     consolidate : use the osmnx consolidate_intersections (tolerance = 15) to merge place with too complicated intersections like a roundabout 
+    streets : StreetGraph of the city (or path of its .npz) to cut the network from instead of downloading it, see get_place_network
+    compact : keep only the useful OSM tags (dropped at download) and use memory-lean dtypes (see compact_POI)
     Returns the street network in a 1km walking distance as a networkx object 
     and the POI in the same area as a geodataframe
     Streets network and POI are projected to WGS-84"""
@@ -179,19 +254,16 @@ def get_place_POI(place: str,
 
     #get the network
     if  get_network:
-        g_place = ox.graph_from_place(place, buffer_dist=1000, network_type=network_type, retain_all=True, truncate_by_edge=True)
-        g_place = ox.project_graph(g_place, to_crs="WGS-84")
-        if consolidate:
-            g_proj = ox.project_graph(g_place)
-            g_place = ox.consolidate_intersections(g_proj, rebuild_graph=True, tolerance=15, dead_ends=False)
+        g_place = get_place_network(place, consolidate=consolidate, network_type=network_type, streets=streets)
         
-    gdf_pois = ox.geometries_from_place(place, tags, buffer_dist=1000)
+    gdf_pois = download_place_POI(place, tags, buffer_dist=1000, columns=["name", "amenity", "shop"] if compact else None)
     #certains lieux (comme une ville) ont un polygone associé : 
     # on peut donc récupérer les POI sans indiquer de dist
-    #gdf_pois = ox.project_gdf(gdf= gdf_pois, to_crs="WGS-84")
-    gdf_pois["center"]=gdf_pois.centroid
+    gdf_pois = add_POI_centers(gdf_pois)
     #chaque ligne peut être soit un polygone (par exemple pour le champ de Mars), soit un point comme un restaurant : on calcul le centre pour avoir une référence unique
-    gdf_pois = find_cat(gdf_pois, categories, dummy = get_dummy_cat, tags_for_cat = tags_for_cat)
+    gdf_pois = find_cat(gdf_pois, categories, dummy = get_dummy_cat, tags_for_cat = tags_for_cat, compact = compact)
+    if compact:
+        gdf_pois = compact_POI(gdf_pois, categories = categories if get_dummy_cat else ())
     if number_var_reduced:
         gdf_pois = reduce_oms_var(gdf_pois, categories=categories)
     if get_network:
@@ -205,11 +277,25 @@ def reduce_oms_var(gdf, categories = ["restaurant", "culture and art",
     list_var = ['name','center','geometry'] + list(categories)
     return gdf[list_var]
 
+def compact_POI(gdf, categories = (), tags = ('amenity', 'shop', 'category')):
+    """
+    Memory-lean dtypes for a POI geodataframe :
+    amenity, shop and category as categorical (a few hundred distinct values for thousands of POI)
+    and the dummies of categories as uint8.
+    """
+    for t in tags:
+        if t in gdf.columns and gdf[t].dtype == object:
+            gdf[t] = gdf[t].astype('category')
+    for cat in categories:
+        if cat in gdf.columns:
+            gdf[cat] = gdf[cat].astype(np.uint8)
+    return gdf
+
 
 def get_place_POI_category(place: str, 
     categories : list,
     city : str = "Paris, Ile-de-France, France", consolidate = True,get_network = False,
-    network_type = 'walk') :
+    network_type = 'walk', streets = None) :
     """
     Function to get any city's (Paris' by default) neighborhood's OMS POI.
     place : str, must be name sufficiently known
@@ -221,6 +307,7 @@ def get_place_POI_category(place: str,
     list_education = ["college", "driving_school", "kindergarten", "language_school", "training", "school", "university"]
     See : https://wiki.openstreetmap.org/wiki/FR:%C3%89l%C3%A9ments_cartographiques#
     consolidate : use the osmnx consolidate_intersections (tolerance = 15) to merge place with too complicated intersections like a roundabout 
+    streets : StreetGraph of the city (or path of its .npz) to cut the network from instead of downloading it, see get_place_network
     Returns the street network in a 1km walking distance as a networkx object 
     and the POI in the same area as a geodataframe
 
@@ -232,7 +319,7 @@ def get_place_POI_category(place: str,
     tags = {'amenity':tags}
     print(tags)
     return get_place_POI_tags(place = place, tags = tags, city=city, consolidate=consolidate,get_network=get_network,
-     network_type=network_type)
+     network_type=network_type, streets=streets)
 
 def get_polygon_POI_tags(
     polygon,
@@ -257,12 +344,14 @@ def get_polygon_POI_tags(
         g_proj = ox.project_graph(g_poly)
         g_poly = ox.consolidate_intersections(g_proj, rebuild_graph=True, tolerance=15, dead_ends=False)"""
     
-    gdf_pois = ox.geometries.geometries_from_polygon(polygon, tags)
+    with span("overpass_download") as s:
+        gdf_pois = ox.geometries.geometries_from_polygon(polygon, tags)
+        s.rows = len(gdf_pois)
     #certains lieux (comme une ville) ont un polygone associée : 
     # on peut donc récupérer les POI sans indiquer de dist
-    if len(gdf_pois) > 0:
-        gdf_pois = ox.project_gdf(gdf= gdf_pois, to_crs="WGS-84")
-        #gdf_pois["center"]=gdf_pois.centroid
+    if len(gdf_pois) > 0 and gdf_pois.crs is None:
+        # osmnx already returns WGS-84, no need to reproject
+        gdf_pois = gdf_pois.set_crs(WGS84)
     #chaque ligne peut être soit un polygone (par exemple pour le champ de Mars), soit un point comme un restaurant : on calcul le centre pour avoir une référence unique
     return gdf_pois #return g_poly, gdf_pois    #On récupère directement un networkx et un geodataframe
 
@@ -294,14 +383,21 @@ def get_polygon_POI_category(polygon,
 ########################################## 
 
 def plot_POI_folium(place_latlong : np.array,
-    gdf_poi: gpd.GeoDataFrame, tiles = "OpenStreetMap", zoom_start = 14) :
+    gdf_poi: gpd.GeoDataFrame, tiles = "OpenStreetMap", zoom_start = 14,
+    fast = False, color_var = 'category', cmap = 'Set1', max_markers = 20000) :
     """
     place_latlong : the central place for which to center the map on, tuple (lat, long)
     gdf_poi : GeoPandas.GeoDataFrame with POI
     It is the classical folium method : you create a list with geometry point values (here gdf_poi.center) and for each 
     coordinates, you add a marker. 
+    fast : for big POI tables (thousands of POI), the markers are built vectorized from the center coordinates
+    and clustered client-side (one FastMarkerCluster layer by value of color_var), see plot_POI_folium_fast
+    max_markers : only with fast, above this number of POI a heatmap is drawn instead of markers
     Returns a Folium map
     """
+    if fast:
+        return plot_POI_folium_fast(place_latlong, gdf_poi, tiles = tiles, zoom_start = zoom_start,
+            color_var = color_var, cmap = cmap, max_markers = max_markers)
     #on représente en lat, long (et donc y,x)!!!
     # y = lat
     # x = long
@@ -324,6 +420,62 @@ def plot_POI_folium(place_latlong : np.array,
             )
         )
     return map
+
+# client-side marker : row = [lat, long, popup, color]
+_FAST_MARKER_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+        {radius: 5, color: row[3], fillColor: row[3], fillOpacity: 0.7, weight: 1});
+    marker.bindPopup(row[2]);
+    return marker;
+};
+"""
+
+def plot_POI_folium_fast(place_latlong : np.array,
+    gdf_poi: gpd.GeoDataFrame, tiles = "OpenStreetMap", zoom_start = 14,
+    color_var = 'category', cmap = 'Set1', max_markers = 20000) :
+    """
+    Scalable version of plot_POI_folium.
+    The payload (lat, long, popup, color) is built vectorized from gdf_poi.center, and sent as plain arrays 
+    to a FastMarkerCluster (markers are created and clustered by the browser, not one folium.Marker by POI).
+    color_var : POI are coloured by this column (the 'category' given by find_cat with dummy = False),
+    one layer by value that can be switched on/off. If the column doesn't exist, every POI is blue.
+    max_markers : above this number of POI, a HeatMap of the POI is drawn instead.
+    Returns a Folium map
+    """
+    from folium.plugins import FastMarkerCluster, HeatMap
+    from matplotlib import colormaps
+    from matplotlib.colors import to_hex
+
+    map = folium.Map(location=place_latlong, tiles=tiles, zoom_start=zoom_start)
+    centers = gpd.GeoSeries(gdf_poi['center'])
+    lat = np.round(centers.y.values, 6)
+    long = np.round(centers.x.values, 6)
+
+    if len(gdf_poi) > max_markers:
+        HeatMap(np.column_stack([lat, long]).tolist(), name = "POI density").add_to(map)
+        return map
+
+    names = gdf_poi['name'].astype(str).values if 'name' in gdf_poi.columns else np.full(len(gdf_poi), "")
+    popups = "Name: " + pd.Series(names) + "<br>Coordinates: " + pd.Series(lat).astype(str) + ", " + pd.Series(long).astype(str)
+    if color_var in gdf_poi.columns:
+        groups = pd.Series(gdf_poi[color_var].astype(str).values)
+    else:
+        groups = pd.Series(np.full(len(gdf_poi), "POI"))
+    values = np.sort(groups.unique())
+    if len(values) == 1:
+        colors = {values[0] : "blue"}
+    else:
+        palette = colormaps[cmap](np.arange(len(values)) % colormaps[cmap].N)
+        colors = {v : to_hex(c) for v, c in zip(values, palette)}
+
+    data = pd.DataFrame({'lat' : lat, 'long' : long, 'popup' : popups.values, 'color' : groups.map(colors).values})
+    for v in values:
+        FastMarkerCluster(data[(groups == v).values].values.tolist(), callback = _FAST_MARKER_CALLBACK,
+            name = str(v)).add_to(map)
+    folium.LayerControl().add_to(map)
+    return map
+
 ##########################################
 ##### Route functions ########
 ##########################################
@@ -336,7 +488,13 @@ def route_between_coordinates(streets : nx.classes.MultiDiGraph,
     coord : format (long, lat)
     return a list of osmid for the nodes of the route on the streets network
     /!\\ if there is no path return a NoneType /!\\ 
+    streets can also be a StreetGraph (see helpers.network) : the route is then computed on its arrays
     """
+    if isinstance(streets, StreetGraph):
+        route = streets.route(coord1, coord2)
+        if route == None:
+            print(f"/!\\ Warning /!\\ No route between {coord1} and {coord2}")
+        return route
     orig = ox.distance.nearest_nodes(streets,X=coord1[0],Y = coord1[1])
     dest = ox.distance.nearest_nodes(streets,X=coord2[0],Y = coord2[1])
     route = ox.shortest_path(streets, orig, dest, weight=weight) # on peut aussi mettre travel_time
@@ -346,6 +504,8 @@ def route_between_coordinates(streets : nx.classes.MultiDiGraph,
     return route
 
 def distance_route(route, streets : nx.classes.MultiDiGraph, limit=1000):
+    if isinstance(streets, StreetGraph):
+        return streets.route_length(route)
     n = len(route)-1
     dist_metric = 0
     for i in range(n):
@@ -365,13 +525,15 @@ def distance_between_coordinates(streets : nx.classes.MultiDiGraph,
         return distance_route(route,streets)/limit
 
 def route_between_POI(streets : nx.classes.MultiDiGraph, poi : gpd.GeoDataFrame,
-    name1: str, name2 : str, weight = "lenght"):
+    name1: str, name2 : str, weight = "lenght", near = None, fuzzy = False):
     """
     Calculate the distance between the POI named name1 and name2
     using their centroid coordinates
+    near : (long, lat) to choose between POI with the same name1, the POI named name2 closest to name1 is taken
+    fuzzy : see get_POI_coordinates
     """
-    coord1 = get_POI_coordinates(poi = poi, name = name1)
-    coord2 = get_POI_coordinates(poi = poi, name = name2)
+    coord1 = get_POI_coordinates(poi = poi, name = name1, near = near, fuzzy = fuzzy)
+    coord2 = get_POI_coordinates(poi = poi, name = name2, near = coord1, fuzzy = fuzzy)
 
     route = route_between_coordinates(streets= streets, coord1= coord1,
     coord2= coord2, weight = weight)
@@ -380,10 +542,23 @@ def route_between_POI(streets : nx.classes.MultiDiGraph, poi : gpd.GeoDataFrame,
         print(f"/!\\ Warning /!\\ No route between {name1} and {name2}")
     return route
 
-def get_POI_coordinates(poi: gpd.GeoDataFrame, name : str):
-    coord = poi[poi['name']==name]['center'][0]
-    coord = np.array(coord)
-    return (coord[0], coord[1])
+def get_POI_coordinates(poi: gpd.GeoDataFrame, name : str, near = None, fuzzy = False):
+    """
+    (long, lat) of the center of the POI named name, with the index of poi (helpers.get_poi_index, built once) :
+    accents and case are ignored, the POI closest to near (long, lat) is taken if several POI have this name.
+    fuzzy : use the closest name if there is no exact one (else KeyError)
+    """
+    index = get_poi_index(poi)
+    position = index.resolve(name, near, fuzzy)[0]
+    if position < 0:
+        raise KeyError(f"no POI named {name}")
+    return (index.lon[position], index.lat[position])
+
+def get_POIs_coordinates(poi: gpd.GeoDataFrame, names, near = None, fuzzy = False):
+    """
+    Coordinates of many POI names at once (see POIIndex.coordinates), for many routes
+    """
+    return get_poi_index(poi).coordinates(names, near = near, fuzzy = fuzzy)
 
 ##########################################
 ##### Cuisine data exploration function ##
@@ -466,37 +641,52 @@ def count_POI_within_polygon(gdf : gpd.GeoDataFrame,  categories = categories_ta
     number_poi_by_cat = {}
     for cat in categories:
         number_poi_by_cat[cat] = []
-        for poly, row in tqdm(gdf.iterrows()):
+        for poly, row in tqdm_auto.tqdm(gdf.iterrows()):
             n = len(get_polygon_POI_category(polygon= poly, categories=[cat]))
             number_poi_by_cat[cat].append(n)
     for cat in categories:
         gdf[cat] = number_poi_by_cat[cat] 
     return gdf
 
+@traced("grid_aggregation")
 def aggregating_from_dummies_on_grid(grid, osmgdf,
                                      geometry = "geometry",
-                                     categories = categories_tags.keys()
+                                     categories = categories_tags.keys(),
+                                     metric_crs = METRIC_CRS
 ):
-    agg_nb_grid = {}
-    for cat in categories:
-        agg_nb_grid[cat] = []
-    for i in range(len(grid)):
-        isin = osmgdf.within(grid[geometry][i])
-        nb = osmgdf[categories][isin].sum()
-        for cat in categories:
-            agg_nb_grid[cat].append(nb[cat])
+    """
+    Number of POI of osmgdf (dummies columns of categories) within each square of grid.
+    The spatial join is done in the metric CRS (without crs, the geometries are taken as WGS-84),
+    grid keeps its geometries.
+    """
+    categories = list(categories)
+    squares = grid[geometry] if grid[geometry].crs is not None else grid[geometry].set_crs(WGS84)
+    squares = gpd.GeoDataFrame(geometry = squares.to_crs(metric_crs).values, crs = metric_crs)
+    pois = osmgdf.geometry if osmgdf.crs is not None else osmgdf.geometry.set_crs(WGS84)
+    pois = gpd.GeoDataFrame(osmgdf[categories].reset_index(drop = True), geometry = pois.to_crs(metric_crs).values, crs = metric_crs)
+    joined = gpd.sjoin(pois, squares, how = "inner", predicate = "within")
+    nb = joined.groupby("index_right")[categories].sum().reindex(range(len(grid)), fill_value = 0)
     for cat in categories:
-        grid[cat] = agg_nb_grid[cat]
+        grid[cat] = nb[cat].values
     return grid 
 
 
-def get_POI_cat_on_INSPIRE_grid(url :str, city : str = "Paris", reduced_cat = True):
-    pgdf = gpd.read_file(url)
-    pgdf = pgdf.to_crs("EPSG:4326")
+@traced()
+def get_POI_cat_on_INSPIRE_grid(url :str, city : str = "Paris", reduced_cat = True, compact = False):
+    """
+    Number of POI of each category in each square of the Filosofi grid in url
+    compact : memory-lean dtypes for the grid (float32 counts, integer INSPIRE keys, see helpers.grid.compact_grid) and the POI,
+    the IdINSPIRE strings are then replaced by IdINSPIRE_key (helpers.grid_ids decodes them)
+    """
+    with span("grid_load") as s:
+        # the squares stay in the metric CRS for the spatial join, in WGS-84 only for the output
+        pgdf = gpd.read_file(url).to_crs(METRIC_CRS)
+        if compact:
+            pgdf = compact_grid(pgdf)
+        s.rows = len(pgdf)
     if reduced_cat:
-        osmgdf = get_place_POI(city)
-        # je comprend pas le warning  : j'ai projeté en WGS-84.
-        return aggregating_from_dummies_on_grid(pgdf,osmgdf)
+        osmgdf = get_place_POI(city, compact = compact)
+        return aggregating_from_dummies_on_grid(pgdf,osmgdf).to_crs(WGS84)
     else:
         categories = dict()
         for s in shops:
@@ -504,8 +694,8 @@ def get_POI_cat_on_INSPIRE_grid(url :str, city : str = "Paris", reduced_cat = Tr
         for a in amenities:
             categories[a]=[a]
         
-        osmgdf = get_place_POI("Paris", categories=categories.keys(), tags_for_cat = categories)
-        return aggregating_from_dummies_on_grid(pgdf,osmgdf,categories = categories.keys())
+        osmgdf = get_place_POI("Paris", categories=categories.keys(), tags_for_cat = categories, compact = compact)
+        return aggregating_from_dummies_on_grid(pgdf,osmgdf,categories = categories.keys()).to_crs(WGS84)
 
 
 
@@ -513,6 +703,7 @@ def get_POI_cat_on_INSPIRE_grid(url :str, city : str = "Paris", reduced_cat = Tr
 ##### 2SFCA function ########
 ##########################################
 
+@traced("demand")
 def calculate_2SFCA_demand(gdf,weights_by_id,
     weight_age = {
         'Ind_0_3':1,
@@ -563,13 +754,22 @@ def calculate_2SFCA_accessibility_var(supply,demand,weights_by_id):
     weighted_ratio = weights_by_id.multiply(other = ratio,axis=0) 
     return weighted_ratio.sum()
 
-def calculate_distanceband_weights(gdf, idCol = "IdINSPIRE",geometryCol="geometry",threshold = 1):
+@traced("weights")
+def calculate_distanceband_weights(gdf, idCol = "IdINSPIRE",geometryCol="geometry",threshold = 1, metric_crs = METRIC_CRS):
     # donner directement par la fonction de pysal
     # for each i in ids, we attribute the list (dataframe with  id in index) of the weight of j from i
-    radius = geometry.sphere.RADIUS_EARTH_KM
     gdf.reset_index(inplace=True)
-    w_db = weights.distance.DistanceBand.from_dataframe(gdf,threshold=threshold,binary = False,radius = radius,geom_col = geometryCol, ids = idCol)
-    # poids calculé en faisant la fonction inverse de la distance euclidienne entre les polygons (entre leurs centroids ?)
+    if idCol not in gdf.columns:
+        # grid of compact_grid : ids decoded from the integer keys
+        gdf[idCol] = grid_ids(gdf, idCol)
+    # centroids are computed once in the metric CRS (not in lat/long), in km to keep threshold in km
+    geoms = gdf[geometryCol]
+    if geoms.crs is None:
+        geoms = geoms.set_crs(WGS84)
+    centroids = geoms.to_crs(metric_crs).centroid
+    coords = np.column_stack([centroids.x.values, centroids.y.values])/1000
+    w_db = weights.distance.DistanceBand(coords,threshold=threshold,binary = False, ids = gdf[idCol].tolist())
+    # poids calculé en faisant la fonction inverse de la distance euclidienne entre les centroids des carreaux
     # thresold de 1km <=> 15mn de marche à 4km/h
     for id in gdf["IdINSPIRE"]:
         w_db[id][id]=10.0
@@ -583,6 +783,7 @@ def calculate_distanceband_weights(gdf, idCol = "IdINSPIRE",geometryCol="geometr
     weights_by_id= weights_by_id/max_weight
     return weights_by_id
 
+@traced("accessibility")
 def calculate_2SFCA_accessibility(gdf, interestsVar, weights_by_id,weight_age={
         'Ind_0_3':1,
         "Ind_4_5" : 1,
@@ -595,7 +796,8 @@ def calculate_2SFCA_accessibility(gdf, interestsVar, weights_by_id,weight_age={
         "Ind_65_79" : 1,
         "Ind_80p" : 1,
         "Ind_inc" : 1
-    }
+    },
+    demand = None
 ):
     """
     gdf : gpd.GeoDataFrame
@@ -618,8 +820,10 @@ def calculate_2SFCA_accessibility(gdf, interestsVar, weights_by_id,weight_age={
     weight_age can be for instance how relatively old people consumate health services compare to younger ones. 
     for now weight_age is unique. In the future we will implement the possibility to add one series of weights 
     for each variable.
+    demand : the output of calculate_2SFCA_demand if already computed (weight_age is then not used)
     """
-    demand = calculate_2SFCA_demand(gdf=gdf,weights_by_id=weights_by_id, weight_age=weight_age)
+    if demand is None:
+        demand = calculate_2SFCA_demand(gdf=gdf,weights_by_id=weights_by_id, weight_age=weight_age)
     # we use a unique demand function for now
     # but we can create a dict var:weight_age to take consideration that different age doesnt consume
     # the same type of services. And from that dict we create var:demand and we use that dict in
@@ -627,6 +831,7 @@ def calculate_2SFCA_accessibility(gdf, interestsVar, weights_by_id,weight_age={
     f = lambda s: calculate_2SFCA_accessibility_var(supply=s,demand=demand,weights_by_id=weights_by_id)
     return gdf[interestsVar].apply(f,axis = 0)
 
+@traced()
 def aggregate_2SFCA(gdf, 
                     categories  = ['restaurant','culture and art', 'education', 'food_shops', 'fashion_beauty','supply_shops'],
                     weight = True):
@@ -670,7 +875,7 @@ def LM_test(df,dep_var, indep_var, w) :
     indep_var : list of str (the explanatory variables)
     w : type of weight 
     """
-    ols = OLS(df[[dep_var]].values, df[indep_var].values)
+    ols = spreg.OLS(df[[dep_var]].values, df[indep_var].values)
     lms = spreg.LMtests(ols, w)
     print("LM error test p_value for " + str(dep_var) + " : " + str(round(lms.lme[1],4)))
     print("LM lag test p_value for " + str(dep_var) + " : " + str(round(lms.lml[1],4)))
@@ -709,6 +914,8 @@ def composition_chart(place : str,
                       categories = categories_tags.keys(),
                       city = "Paris, Ile-de-France, France"): 
     
+    from palettable.colorbrewer.qualitative import Pastel1_7
+
     pois = get_place_POI(place, tags, categories, city)
     dic = {}
     for i in categories : 
@@ -740,7 +947,7 @@ def compare_places(places : list,
     list_places = []
     list_var = []
     list_number = []
-    for i in tqdm(range(len(places))):
+    for i in tqdm_auto.tqdm(range(len(places))):
         pois = get_place_POI(places[i], tags, categories, city)
         dic = {}
         for j in categories : 
@@ -0,0 +1,296 @@
+import json
+import math
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from .grid import INSPIRE_CRS, WGS84, KEY_FACTOR, _get_transformer, inspire_keys, inspire_ids_from_keys, parse_inspire_ids, project_xy
+
+"""
+Small local query service over precomputed grid results (output of get_POI_cat_on_INSPIRE_grid with the
+[category]_access columns of the 2SFCA, or of the pipeline), for the dashboards :
+- point : the square of a (lon, lat) is found by arithmetic on the INSPIRE id (projection in EPSG:3035,
+  rounding to the resolution, binary search on the integer keys of helpers.grid.inspire_keys),
+- bbox and commune (Depcom) : the squares are indexed by tiles of tile_size meters,
+- the answers of bbox and Depcom are streamed as json lines, tile by tile,
+- the json of the most used tiles is kept in memory for them (LRU of cache_tiles tiles), a point or a square
+  only encodes its own row.
+
+    store = GridStore(results)              # DataFrame with IdINSPIRE (or a .pkl / .parquet / .gpkg / .csv file)
+    store.point(2.3488, 48.85341)
+    serve(store, port = 8050)               # GET /point?lon=2.3488&lat=48.85341, /bbox?minlon=..&minlat=..&maxlon=..&maxlat=..,
+                                            # /depcom/75056, /square/CRS3035RES200mN2893400E3763200, /stats
+
+From the command line (from the root of the repository) :
+python -m helpers.service results.pkl --port 8050
+"""
+
+def _read(path):
+    if path.endswith(".pkl"):
+        return pd.read_pickle(path)
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    if path.endswith(".csv"):
+        return pd.read_csv(path)
+    import geopandas as gpd
+    return gpd.read_file(path, ignore_geometry = True)
+
+def _json_value(v):
+    if isinstance(v, (float, np.floating)):
+        return None if math.isnan(v) else float(v)
+    if isinstance(v, np.integer):
+        return int(v)
+    if isinstance(v, np.bool_):
+        return bool(v)
+    return v if v is None or isinstance(v, (str, int, bool)) else str(v)
+
+class GridStore:
+    """
+    grid : DataFrame (or path) of the squares with an IdINSPIRE column (or index), or IdINSPIRE_key (compact_grid)
+    tile_size : side of the tiles of the index (meters, multiple of the resolution)
+    cache_tiles : number of tiles whose json is kept in memory
+    """
+    def __init__(self, grid, id_col = "IdINSPIRE", tile_size = 5000, cache_tiles = 256):
+        grid = _read(grid) if isinstance(grid, str) else grid
+        if "geometry" in grid.columns:
+            grid = pd.DataFrame(grid.drop(columns = "geometry"))
+        if id_col not in grid.columns and grid.index.name == id_col:
+            grid = grid.reset_index()
+        if id_col + "_key" in grid.columns:
+            keys = grid[id_col + "_key"].to_numpy(dtype = np.int64)
+        else:
+            keys = inspire_keys(grid[id_col])
+        self.res = int(parse_inspire_ids(grid[id_col].iloc[:1])["res"].iloc[0]) if id_col in grid.columns else 200
+        order = np.argsort(keys, kind = "stable")
+        self.keys = keys[order]
+        self.data = grid.iloc[order].reset_index(drop = True)
+        if id_col not in self.data.columns:
+            self.data[id_col] = inspire_ids_from_keys(self.keys, res = self.res)
+        self.id_col = id_col
+        self.columns = [c for c in self.data.columns if c != id_col + "_key"]
+        # one array by column : the json of one row without building a DataFrame
+        self._arrays = [self.data[c].to_numpy() for c in self.columns]
+
+        # centers in WGS-84 (bbox filter) and tiles of tile_size meters
+        n, e = self.keys // KEY_FACTOR, self.keys % KEY_FACTOR
+        self.lon, self.lat = project_xy(e + self.res/2, n + self.res/2, INSPIRE_CRS, WGS84)
+        self.tile_size = tile_size
+        tiles = (n // tile_size)*KEY_FACTOR + e // tile_size
+        self.tile_order = np.argsort(tiles, kind = "stable")
+        self.tile_ids, self.tile_start, self.tile_count = np.unique(tiles[self.tile_order], return_index = True, return_counts = True)
+        self.depcom_index = self.data.groupby("Depcom").indices if "Depcom" in self.data.columns else {}
+        self._tile_json = lru_cache(maxsize = cache_tiles)(self._build_tile_json)
+        self._to_inspire = _get_transformer(WGS84, INSPIRE_CRS)
+
+    def __len__(self):
+        return len(self.keys)
+
+    ##### positions #####
+
+    def _position(self, key):
+        i = np.searchsorted(self.keys, key)
+        return int(i) if i < len(self.keys) and self.keys[i] == key else -1
+
+    def position_of_point(self, lon, lat):
+        """
+        Row of the square containing (lon, lat), -1 if there is no such square
+        """
+        x, y = self._to_inspire.transform(lon, lat)
+        key = int(y // self.res*self.res)*KEY_FACTOR + int(x // self.res*self.res)
+        return self._position(key)
+
+    def _tile_positions(self, tile):
+        t = np.searchsorted(self.tile_ids, tile)
+        if t >= len(self.tile_ids) or self.tile_ids[t] != tile:
+            return np.array([], dtype = np.int64)
+        return self.tile_order[self.tile_start[t]:self.tile_start[t] + self.tile_count[t]]
+
+    def bbox_tiles(self, minlon, minlat, maxlon, maxlat):
+        """
+        Tiles of the index touching the WGS-84 bbox (its border is densified before the projection)
+        """
+        t = np.linspace(0, 1, 21)
+        lon = np.r_[minlon + (maxlon - minlon)*t, np.full(21, maxlon), maxlon - (maxlon - minlon)*t, np.full(21, minlon)]
+        lat = np.r_[np.full(21, minlat), minlat + (maxlat - minlat)*t, np.full(21, maxlat), maxlat - (maxlat - minlat)*t]
+        x, y = project_xy(lon, lat, WGS84, INSPIRE_CRS)
+        rows = np.arange(int(y.min() - self.res) // self.tile_size, int(y.max() + self.res) // self.tile_size + 1)
+        cols = np.arange(int(x.min() - self.res) // self.tile_size, int(x.max() + self.res) // self.tile_size + 1)
+        tiles = (rows[:, None]*KEY_FACTOR + cols[None, :]).ravel()
+        return tiles[np.isin(tiles, self.tile_ids)]
+
+    def bbox_positions(self, minlon, minlat, maxlon, maxlat):
+        """
+        Rows of the squares whose center is in the bbox
+        """
+        tiles = self.bbox_tiles(minlon, minlat, maxlon, maxlat)
+        if len(tiles) == 0:
+            return np.array([], dtype = np.int64)
+        positions = np.concatenate([self._tile_positions(t) for t in tiles])
+        inside = (self.lon[positions] >= minlon) & (self.lon[positions] <= maxlon) & (self.lat[positions] >= minlat) & (self.lat[positions] <= maxlat)
+        return positions[inside]
+
+    def depcom_positions(self, depcom):
+        for code in [depcom, str(depcom)] + ([int(depcom)] if str(depcom).isdigit() else []):
+            if code in self.depcom_index:
+                return self.depcom_index[code]
+        return np.array([], dtype = np.int64)
+
+    ##### DataFrames #####
+
+    def point(self, lon, lat):
+        """
+        Row (Series) of the square containing (lon, lat), None outside of the grid
+        """
+        i = self.position_of_point(lon, lat)
+        return None if i < 0 else self.data.iloc[i][self.columns]
+
+    def square(self, id_inspire):
+        i = self._position(int(inspire_keys([id_inspire])[0]))
+        return None if i < 0 else self.data.iloc[i][self.columns]
+
+    def bbox(self, minlon, minlat, maxlon, maxlat):
+        return self.data.iloc[np.sort(self.bbox_positions(minlon, minlat, maxlon, maxlat))][self.columns]
+
+    def depcom(self, depcom):
+        return self.data.iloc[self.depcom_positions(depcom)][self.columns]
+
+    ##### json #####
+
+    def _record(self, i):
+        return json.dumps({c : _json_value(a[i]) for c, a in zip(self.columns, self._arrays)})
+
+    def _records(self, positions):
+        columns = [a[positions] for a in self._arrays]
+        return {int(i) : json.dumps({c : _json_value(v) for c, v in zip(self.columns, row)})
+                for i, row in zip(positions, zip(*columns))}
+
+    def _build_tile_json(self, tile):
+        # json of every square of the tile, by row
+        return self._records(self._tile_positions(tile))
+
+    def tile_of_position(self, i):
+        key = self.keys[i]
+        return (key // KEY_FACTOR // self.tile_size)*KEY_FACTOR + key % KEY_FACTOR // self.tile_size
+
+    def record_json(self, i):
+        """
+        json of the row i (point and square) : only this row is encoded, the tiles cache is for bbox and Depcom
+        """
+        return self._record(int(i))
+
+    def iter_json_lines(self, positions, chunk = 1000):
+        """
+        json lines of the rows, by chunks of bytes (streaming), tile by tile
+        """
+        positions = np.asarray(positions, dtype = np.int64)
+        tiles = self.tile_of_position(positions) if len(positions) else positions
+        lines = []
+        for tile in np.unique(tiles):
+            records = self._tile_json(int(tile))
+            for i in positions[tiles == tile]:
+                lines.append(records[int(i)])
+                if len(lines) == chunk:
+                    yield ("\n".join(lines) + "\n").encode()
+                    lines = []
+        if lines:
+            yield ("\n".join(lines) + "\n").encode()
+
+    def stats(self):
+        info = self._tile_json.cache_info()
+        return {"squares" : len(self), "res" : self.res, "tiles" : len(self.tile_ids), "tile_size" : self.tile_size,
+                "communes" : len(self.depcom_index), "cache_hits" : info.hits, "cache_misses" : info.misses,
+                "cached_tiles" : info.currsize}
+
+##### HTTP #####
+
+def _handler(store):
+    class GridHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body are written separately : without this, the delayed ACK adds ~40 ms to each keep-alive answer
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body : bytes, content_type = "application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _error(self, status, message):
+            self._send(status, json.dumps({"error" : message}).encode())
+
+        def _stream(self, positions):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in store.iter_json_lines(positions):
+                self.wfile.write(f"{len(chunk):X}\r\n".encode() + chunk + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k : v[0] for k, v in parse_qs(url.query).items()}
+            parts = url.path.strip("/").split("/")
+            try:
+                if parts[0] == "point":
+                    i = store.position_of_point(float(query["lon"]), float(query["lat"]))
+                    if i < 0:
+                        return self._error(404, "no square at this point")
+                    return self._send(200, store.record_json(i).encode())
+                if parts[0] == "square" and len(parts) == 2:
+                    i = store._position(int(inspire_keys([parts[1]])[0]))
+                    if i < 0:
+                        return self._error(404, "unknown square")
+                    return self._send(200, store.record_json(i).encode())
+                if parts[0] == "bbox":
+                    return self._stream(store.bbox_positions(*(float(query[k]) for k in ["minlon", "minlat", "maxlon", "maxlat"])))
+                if parts[0] == "depcom":
+                    return self._stream(store.depcom_positions(parts[1] if len(parts) == 2 else query["code"]))
+                if parts[0] == "stats":
+                    return self._send(200, json.dumps(store.stats()).encode())
+            except (KeyError, ValueError) as e:
+                return self._error(400, f"bad query : {e}")
+            return self._error(404, "unknown path, use /point, /square, /bbox, /depcom or /stats")
+
+    return GridHandler
+
+def serve(store, host = "127.0.0.1", port = 8050, background = False):
+    """
+    HTTP server (one thread by connection) over a GridStore (or the arguments of GridStore : a DataFrame or a path).
+    background : run in a daemon thread and return the server (server.shutdown() to stop it)
+    """
+    store = store if isinstance(store, GridStore) else GridStore(store)
+    server = ThreadingHTTPServer((host, port), _handler(store))
+    server.daemon_threads = True
+    if background:
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        return server
+    print(f"serving {len(store)} squares on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return server
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Local HTTP service over precomputed grid results")
+    parser.add_argument("grid", help = "grid results (.pkl, .parquet, .csv or .gpkg) with IdINSPIRE")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("-p", "--port", type = int, default = 8050)
+    parser.add_argument("--tile-size", type = int, default = 5000, help = "side of the tiles of the index in meters, default=5000")
+    parser.add_argument("--cache-tiles", type = int, default = 256, help = "tiles kept in memory, default=256")
+    args = parser.parse_args()
+
+    serve(GridStore(args.grid, tile_size = args.tile_size, cache_tiles = args.cache_tiles), host = args.host, port = args.port)
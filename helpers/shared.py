@@ -0,0 +1,153 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from .lazy import lazy_import
+from .tracing import traced
+
+sparse = lazy_import("scipy.sparse")
+
+"""
+Weights and Filosofi arrays shared between the processes of a pool, instead of one pickled copy
+of weights_by_id by worker : the arrays are written once in shared memory (or in .npy files read as memmap)
+and every worker attaches them without copy when it starts.
+The weights are stored sparse (CSR : data, indices, indptr), the matrix of calculate_distanceband_weights
+being mostly zeros.
+
+    results = helpers.parallel_2SFCA(gdf, weights_by_id, scenarios, n_jobs = 16)
+"""
+
+AGE_COLUMNS = ['Ind_0_3', "Ind_4_5", "Ind_6_10", "Ind_11_17", "Ind_18_24", "Ind_25_39",
+               "Ind_40_54", "Ind_55_64", "Ind_65_79", "Ind_80p", "Ind_inc"]
+
+class SharedArrays:
+    """
+    Numpy arrays in shared memory (backend = "shm") or in .npy files of folder (backend = "memmap").
+    spec is a small picklable dict to give to the workers, which call attach(spec).
+    Use it as a context manager, the shared memory is freed at the end.
+    """
+    def __init__(self, arrays : dict, backend = "shm", folder = None):
+        self.backend = backend
+        self.spec = {"backend" : backend, "arrays" : {}}
+        self._blocks = []
+        if backend == "memmap":
+            folder = folder or ".shared_arrays"
+            os.makedirs(folder, exist_ok = True)
+        for name, a in arrays.items():
+            a = np.ascontiguousarray(a)
+            if backend == "shm":
+                block = shared_memory.SharedMemory(create = True, size = max(a.nbytes, 1))
+                np.ndarray(a.shape, dtype = a.dtype, buffer = block.buf)[...] = a
+                self._blocks.append(block)
+                self.spec["arrays"][name] = (block.name, a.shape, a.dtype.str)
+            elif backend == "memmap":
+                path = os.path.join(folder, name + ".npy")
+                np.save(path, a)
+                self.spec["arrays"][name] = (os.path.abspath(path), a.shape, a.dtype.str)
+            else:
+                raise ValueError("backend must be shm or memmap")
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+        if self.backend == "memmap":
+            for path, _, _ in self.spec["arrays"].values():
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+# blocks attached by a worker (kept open while the worker lives)
+_attached = []
+
+def _attach_block(name):
+    try:
+        # python >= 3.13 : the worker must not unlink the block when it stops
+        return shared_memory.SharedMemory(name = name, track = False)
+    except TypeError:
+        # the workers of a pool share the resource tracker of the process that created the block
+        return shared_memory.SharedMemory(name = name)
+
+def attach(spec):
+    """
+    Zero-copy views of the arrays of a SharedArrays spec (read-only)
+    """
+    arrays = {}
+    for name, (location, shape, dtype) in spec["arrays"].items():
+        if spec["backend"] == "shm":
+            block = _attach_block(location)
+            _attached.append(block)
+            a = np.ndarray(shape, dtype = np.dtype(dtype), buffer = block.buf)
+        else:
+            a = np.load(location, mmap_mode = "r")
+        a.flags.writeable = False
+        arrays[name] = a
+    return arrays
+
+def weights_arrays(weights_by_id, dtype = np.float64):
+    """
+    CSR arrays of a weights_by_id DataFrame (calculate_distanceband_weights) or of a scipy sparse matrix
+    """
+    W = sparse.csr_matrix(weights_by_id.values if isinstance(weights_by_id, pd.DataFrame) else weights_by_id, dtype = dtype)
+    return {"w_data" : W.data, "w_indices" : W.indices, "w_indptr" : W.indptr, "w_shape" : np.array(W.shape)}
+
+##### workers #####
+
+_worker = {}
+
+def _init_worker(spec):
+    arrays = attach(spec)
+    # csr_matrix keeps the given arrays, no copy
+    _worker["W"] = sparse.csr_matrix((arrays["w_data"], arrays["w_indices"], arrays["w_indptr"]),
+        shape = tuple(arrays["w_shape"]), copy = False)
+    _worker["ages"] = arrays["ages"]
+    _worker["supply"] = arrays["supply"]
+
+def _run_scenario(scenario):
+    from .accessibility import _2SFCA
+
+    weights = np.array([scenario["weight_age"].get(c, 0) for c in AGE_COLUMNS], dtype = float)
+    columns = scenario["columns"]
+    population = _worker["ages"] @ weights
+    return _2SFCA(_worker["W"], _worker["supply"][:, columns], population)
+
+@traced("parallel_2SFCA")
+def parallel_2SFCA(gdf, weights_by_id, scenarios, interestsVar = None, n_jobs = 4, backend = "shm", folder = None):
+    """
+    calculate_2SFCA_accessibility for many scenarios in a process pool, the weights and the population
+    being shared (not copied) between the workers.
+    gdf : squares with the Ind_ columns and the supply, same ids as weights_by_id
+    weights_by_id : output of calculate_distanceband_weights (or a scipy sparse matrix in the order of gdf)
+    scenarios : list of dicts with weight_age (dict as in calculate_2SFCA_accessibility, missing ages count 0)
+    and optionally interestsVar (list of the supply columns, default interestsVar)
+    backend : "shm" (shared memory) or "memmap" (.npy files in folder)
+    Returns the list of the accessibility DataFrames (index : ids, columns : interestsVar), in the order of scenarios
+    """
+    if isinstance(weights_by_id, pd.DataFrame):
+        gdf = gdf.loc[weights_by_id.index]
+    if not interestsVar and not (scenarios and scenarios[0].get("interestsVar")):
+        raise ValueError("interestsVar is missing : give interestsVar, or an interestsVar in the first scenario")
+    interestsVar = list(interestsVar or scenarios[0]["interestsVar"])
+    supply_columns = list(dict.fromkeys(interestsVar + [v for s in scenarios for v in s.get("interestsVar", [])]))
+    position = {v : k for k, v in enumerate(supply_columns)}
+    tasks = [{"weight_age" : s["weight_age"], "columns" : [position[v] for v in s.get("interestsVar", interestsVar)]}
+             for s in scenarios]
+    arrays = weights_arrays(weights_by_id)
+    arrays["ages"] = gdf[AGE_COLUMNS].to_numpy(dtype = float)
+    arrays["supply"] = gdf[supply_columns].to_numpy(dtype = float)
+
+    with SharedArrays(arrays, backend = backend, folder = folder) as shared:
+        with ProcessPoolExecutor(max_workers = n_jobs, initializer = _init_worker, initargs = (shared.spec,)) as executor:
+            results = list(executor.map(_run_scenario, tasks))
+    return [pd.DataFrame(r, index = gdf.index, columns = s.get("interestsVar", interestsVar))
+            for r, s in zip(results, scenarios)]
@@ -0,0 +1,192 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+"""
+Lightweight per-stage instrumentation of the pipeline (geocoding, Overpass download, find_cat,
+reprojection, grid aggregation, weights, accessibility...).
+Off by default : a traced function then costs one attribute lookup more.
+Usage :
+    from helpers import tracing
+    tracing.enable_tracing()
+    gdf = helpers.get_POI_cat_on_INSPIRE_grid(url)
+    tracing.export_trace("trace.json") # or .csv
+Every span records its wall time, number of rows, bytes downloaded (HTTP responses received
+through requests while the span is open) and the peak RSS of the process at its end.
+It can also be enabled with the environment variable HELPERS_TRACE=1.
+"""
+
+class _State(threading.local):
+    def __init__(self):
+        self.stack = []
+
+_state = _State()
+_enabled = False
+_records = []
+_t0 = time.perf_counter()
+_original_send = None
+
+_COLUMNS = ["name", "parent", "depth", "start", "seconds", "rows", "bytes", "peak_rss_mb", "error"]
+
+def _peak_rss_mb():
+    """
+    Peak resident memory of the process in MB (resource on Unix, psutil on Windows)
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak/2**20 if sys.platform == "darwin" else peak/2**10
+    except ImportError:
+        try:
+            import psutil
+            info = psutil.Process().memory_info()
+            return getattr(info, "peak_wset", info.rss)/2**20
+        except ImportError:
+            return float("nan")
+
+class Span:
+    """
+    One stage of the pipeline, use it through span() or traced().
+    rows and bytes can be set or incremented inside the with block, other attributes go in extra.
+    """
+    def __init__(self, name, **extra):
+        self.name = name
+        self.rows = extra.pop("rows", None)
+        self.bytes = 0
+        self.extra = extra
+
+    def __enter__(self):
+        self.parent = _state.stack[-1].name if _state.stack else None
+        self.depth = len(_state.stack)
+        _state.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _state.stack.pop()
+        if _state.stack:
+            _state.stack[-1].bytes += self.bytes
+        record = {"name" : self.name, "parent" : self.parent, "depth" : self.depth,
+                  "start" : self.start - _t0, "seconds" : seconds, "rows" : self.rows,
+                  "bytes" : self.bytes, "peak_rss_mb" : _peak_rss_mb(),
+                  "error" : None if exc_type is None else exc_type.__name__}
+        record.update(self.extra)
+        _records.append(record)
+        return False
+
+class _NullSpan:
+    """
+    Span used when tracing is off : does nothing
+    """
+    rows = None
+    bytes = 0
+    extra = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_null_span = _NullSpan()
+
+def span(name : str, **extra):
+    """
+    Context manager timing a stage : with span("find_cat") as s: ... s.rows = len(df)
+    """
+    if not _enabled:
+        return _null_span
+    return Span(name, **extra)
+
+def traced(name = None):
+    """
+    Decorator timing every call of the function as a span (named as the function by default).
+    rows is the length of the result if it has one.
+    """
+    def decorator(f):
+        span_name = name or f.__name__
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return f(*args, **kwargs)
+            with Span(span_name) as s:
+                result = f(*args, **kwargs)
+                if s.rows is None and hasattr(result, "__len__") and not isinstance(result, (str, tuple)):
+                    s.rows = len(result)
+                return result
+        return wrapper
+    return decorator
+
+def _count_download(adapter, request, **kwargs):
+    response = _original_send(adapter, request, **kwargs)
+    if _enabled and _state.stack:
+        length = response.headers.get("Content-Length")
+        if length is not None:
+            _state.stack[-1].bytes += int(length)
+        elif not kwargs.get("stream", False):
+            _state.stack[-1].bytes += len(response.content)
+    return response
+
+def _install_download_counter():
+    """
+    Count the bytes of every HTTP response received with requests (used by osmnx for Nominatim and Overpass)
+    """
+    global _original_send
+    if _original_send is not None:
+        return
+    try:
+        from requests.adapters import HTTPAdapter
+    except ImportError:
+        return
+    _original_send = HTTPAdapter.send
+    HTTPAdapter.send = _count_download
+
+def enable_tracing(reset = True):
+    global _enabled, _t0
+    if reset:
+        reset_trace()
+    _install_download_counter()
+    _t0 = time.perf_counter()
+    _enabled = True
+
+def disable_tracing():
+    global _enabled, _original_send
+    _enabled = False
+    if _original_send is not None:
+        from requests.adapters import HTTPAdapter
+        HTTPAdapter.send = _original_send
+        _original_send = None
+
+def is_tracing():
+    return _enabled
+
+def reset_trace():
+    del _records[:]
+
+def get_trace():
+    """
+    Returns the spans recorded since enable_tracing as a pandas.DataFrame (in order of end)
+    """
+    import pandas as pd
+    extra = sorted({k for r in _records for k in r} - set(_COLUMNS))
+    return pd.DataFrame(_records, columns = _COLUMNS + extra)
+
+def export_trace(path : str):
+    """
+    Write the trace of the run in path, as csv if path ends with .csv, else as json
+    """
+    if path.endswith(".csv"):
+        get_trace().to_csv(path, index = False)
+    else:
+        with open(path, "w") as f:
+            json.dump(_records, f, indent = 1, default = str)
+    return path
+
+if os.environ.get("HELPERS_TRACE", "0") not in ("", "0"):
+    enable_tracing()
@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+
+from .lazy import lazy_import
+from .grid import INSPIRE_CRS, METRIC_CRS, WGS84, project_xy, inspire_id_from_coords, inspire_centers
+from .scrapping import categories_tags, find_cat
+from .tracing import span, traced
+
+osmium = lazy_import("osmium")
+spatial = lazy_import("scipy.spatial")
+
+"""
+Incremental update of the POI and of their counts by INSPIRE square with OSM change files (.osc.gz),
+instead of downloading and categorizing everything again with get_POI_cat_on_INSPIRE_grid.
+
+The POI are kept in a store : a DataFrame indexed by (element_type, osmid) as the output of get_place_POI,
+with name, amenity, shop, lon, lat (center), IdINSPIRE and the dummies of the categories.
+Only the created, modified and deleted POI of the change file go through find_cat, the counts of their squares
+are updated, and the squares whose 2SFCA must be computed again are the squares near the changed ones.
+
+    store = make_poi_store(gdf_pois, categories)
+    counts = counts_from_store(store, categories)
+    store, counts, report = apply_changes(store, counts, "daily.osc.gz", categories)
+
+From the command line (from the root of the repository) :
+python -m helpers.updates --store store.pkl --counts counts.pkl 001.osc.gz 002.osc.gz
+"""
+
+STORE_COLUMNS = ["name", "amenity", "shop", "lon", "lat", "IdINSPIRE"]
+
+def make_poi_store(gdf_pois, categories = ['restaurant','culture and art', 'education', 'food_shops', 'fashion_beauty','supply_shops'],
+    tags_for_cat = categories_tags, res = 200):
+    """
+    POI store from the output of get_place_POI (center column, index (element_type, osmid))
+    """
+    centers = gdf_pois["center"] if "center" in gdf_pois.columns else gdf_pois.geometry.centroid
+    store = pd.DataFrame({c : gdf_pois[c].values if c in gdf_pois.columns else None for c in ["name", "amenity", "shop"]},
+        index = gdf_pois.index)
+    store["lon"], store["lat"] = centers.x.values, centers.y.values
+    store["IdINSPIRE"] = inspire_id_from_coords(*project_xy(store["lon"].values, store["lat"].values, WGS84, INSPIRE_CRS), res = res)
+    store = _categorize(store, categories, tags_for_cat)
+    # as in apply_changes, only the POI of at least one category are stored
+    return store[store[list(categories)].sum(axis = 1) > 0]
+
+def _categorize(store, categories, tags_for_cat):
+    index = store.index
+    store = find_cat(store.reset_index(drop = True), categories, dummy = True, tags_for_cat = tags_for_cat)
+    store.index = index
+    return store
+
+def counts_from_store(store, categories = ['restaurant','culture and art', 'education', 'food_shops', 'fashion_beauty','supply_shops']):
+    """
+    Number of POI of each category by square, indexed by IdINSPIRE
+    """
+    return store.groupby("IdINSPIRE")[list(categories)].sum()
+
+def read_changes(path, known = (), tags_for_cat = categories_tags):
+    """
+    Last state in the change file of the objects whose amenity or shop is in tags_for_cat,
+    of the deleted objects and of the objects in known (keys (element_type, osmid) of the store,
+    to see the POI whose tags are not of interest anymore).
+    Nodes have their location, ways and relations only their tags (their location is the one in the store).
+    Returns a DataFrame indexed by (element_type, osmid) : version, deleted, name, amenity, shop, lon, lat
+    """
+    interest = set(t for tags in tags_for_cat.values() for t in tags)
+    known = set(known)
+
+    class ChangeHandler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.changes = []
+
+        def _add(self, element_type, o, lon = np.nan, lat = np.nan):
+            amenity, shop = o.tags.get('amenity'), o.tags.get('shop')
+            if o.deleted or amenity in interest or shop in interest or (element_type, o.id) in known:
+                self.changes.append((element_type, o.id, o.version, o.deleted, o.tags.get('name'), amenity, shop, lon, lat))
+
+        def node(self, n):
+            valid = not n.deleted and n.location.valid()
+            self._add("node", n, n.location.lon if valid else np.nan, n.location.lat if valid else np.nan)
+
+        def way(self, w):
+            self._add("way", w)
+
+        def relation(self, r):
+            self._add("relation", r)
+
+    handler = ChangeHandler()
+    handler.apply_file(path)
+    changes = pd.DataFrame(handler.changes, columns = ["element_type", "osmid", "version", "deleted", "name", "amenity", "shop", "lon", "lat"])
+    # an object can change several times in a file : its last version is kept
+    changes = changes.sort_values("version").drop_duplicates(["element_type", "osmid"], keep = "last")
+    return changes.set_index(["element_type", "osmid"])
+
+def squares_to_refresh(changed_squares, squares, threshold = 1, metric_crs = METRIC_CRS):
+    """
+    Squares of squares whose 2SFCA depends on the changed squares : the ones closer than threshold (km)
+    to a changed square (the distance band of calculate_distanceband_weights)
+    """
+    squares = pd.Index(squares)
+    if len(changed_squares) == 0 or len(squares) == 0:
+        return squares[:0]
+    xy = np.column_stack(inspire_centers(squares, crs_to = metric_crs))/1000
+    changed = np.column_stack(inspire_centers(pd.Index(changed_squares), crs_to = metric_crs))/1000
+    near = spatial.cKDTree(changed).query(xy, distance_upper_bound = threshold + 1e-9)[0]
+    return squares[np.isfinite(near)]
+
+@traced("osm_update")
+def apply_changes(store, counts, changes, categories = ['restaurant','culture and art', 'education', 'food_shops', 'fashion_beauty','supply_shops'],
+    tags_for_cat = categories_tags, res = 200, threshold = 1):
+    """
+    Apply an OSM change file to the POI store and to the counts by square.
+    store : from make_poi_store, counts : DataFrame indexed by IdINSPIRE with the categories columns
+    (counts_from_store, or the output of aggregating_from_dummies_on_grid indexed by IdINSPIRE)
+    changes : path of the .osc(.gz) file, or the DataFrame of read_changes
+    The squares of new POI that are not in counts are added to counts (their other columns are NaN).
+    Returns (store, counts, report) : report is a dict with the number of created, modified and deleted POI,
+    changed_squares (squares whose counts changed, new squares included), new_squares (squares added to counts)
+    and refresh_squares (squares of counts whose 2SFCA must be computed again)
+    """
+    categories = list(categories)
+    if isinstance(changes, str):
+        with span("osc_read") as s:
+            changes = read_changes(changes, known = store.index, tags_for_cat = tags_for_cat)
+            s.rows = len(changes)
+    in_store = changes.index.isin(store.index)
+    old = store.loc[changes.index[in_store]]
+
+    # new state of the changed objects that are still POI : location from the change file (nodes) or from the store
+    new = changes[~changes["deleted"].astype(bool)].copy()
+    located = new["lon"].notna()
+    previous = store.reindex(new.index)
+    new.loc[~located, "lon"] = previous.loc[~located, "lon"]
+    new.loc[~located, "lat"] = previous.loc[~located, "lat"]
+    unlocated = new["lon"].isna()
+    new = new[~unlocated].copy()
+    new["IdINSPIRE"] = inspire_id_from_coords(*project_xy(new["lon"].values, new["lat"].values, WGS84, INSPIRE_CRS), res = res)
+    with span("find_cat_changes", rows = len(new)):
+        new = _categorize(new[STORE_COLUMNS], categories, tags_for_cat)
+    # only the objects of at least one category are kept in the store
+    new = new[new[categories].sum(axis = 1) > 0]
+
+    delta = new.groupby("IdINSPIRE")[categories].sum().sub(old.groupby("IdINSPIRE")[categories].sum(), fill_value = 0)
+    delta = delta[(delta != 0).any(axis = 1)]
+    store = pd.concat([store.drop(changes.index[in_store]), new])
+
+    inside = delta.index.intersection(counts.index)
+    new_squares = delta.index.difference(counts.index)
+    dtype = counts[categories].dtypes.iloc[0]
+    counts = counts.reindex(counts.index.append(new_squares))
+    # squares not yet in counts (new POI outside of the grid of counts) : counted from the store, the other columns are NaN
+    counts.loc[new_squares, categories] = store[store["IdINSPIRE"].isin(new_squares)].groupby("IdINSPIRE")[categories].sum() \
+        .reindex(new_squares, fill_value = 0)
+    counts[categories] = counts[categories].astype(dtype)
+    counts.loc[inside, categories] = counts.loc[inside, categories] + delta.loc[inside, categories].astype(dtype)
+    changed = inside.append(new_squares)
+    report = {
+        "created" : int((~in_store & changes.index.isin(new.index)).sum()),
+        "modified" : int((in_store & changes.index.isin(new.index)).sum()),
+        "deleted" : int((in_store & ~changes.index.isin(new.index)).sum()),
+        "unlocated" : int(unlocated.sum()),
+        "changed_squares" : changed,
+        "new_squares" : new_squares,
+        "refresh_squares" : squares_to_refresh(changed, counts.index, threshold = threshold),
+    }
+    return store, counts, report
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description = "Apply OSM change files (.osc.gz) to a POI store and its counts by INSPIRE square")
+    parser.add_argument("changes", nargs = "+", help = "change files, applied in this order")
+    parser.add_argument("-s", "--store", required = True, help = "pickle of the POI store (make_poi_store)")
+    parser.add_argument("-c", "--counts", required = True, help = "pickle of the counts by square (counts_from_store)")
+    parser.add_argument("-t", "--threshold", type = float, default = 1, help = "distance band of the 2SFCA in km, default=1")
+    parser.add_argument("-r", "--refresh", help = "csv file where the squares to refresh are written")
+    args = parser.parse_args()
+
+    store, counts = pd.read_pickle(args.store), pd.read_pickle(args.counts)
+    categories = [c for c in counts.columns if c in categories_tags]
+    refresh = pd.Index([])
+    for path in args.changes:
+        t = time.perf_counter()
+        store, counts, report = apply_changes(store, counts, path, categories, threshold = args.threshold)
+        refresh = refresh.union(report["refresh_squares"])
+        print(f"{path} : {report['created']} created, {report['modified']} modified, {report['deleted']} deleted, "
+              f"{len(report['changed_squares'])} squares changed ({len(report['new_squares'])} new) ({time.perf_counter() - t:.2f} s)")
+    store.to_pickle(args.store)
+    counts.to_pickle(args.counts)
+    print(f"{len(refresh)} squares to refresh")
+    if args.refresh:
+        pd.Series(refresh, name = "IdINSPIRE").to_csv(args.refresh, index = False)
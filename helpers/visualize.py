@@ -1,24 +1,66 @@
-import folium
+from __future__ import annotations
+
 import pandas as pd
-import geopandas as gpd
-from matplotlib import colormaps
-from matplotlib.colors import ListedColormap
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from .lazy import lazy_import
+from .grid import WGS84, INSPIRE_CRS, inspire_centers, project_xy
+
+# heavy dependencies are only imported when a function needs them (see helpers.lazy)
+folium = lazy_import("folium")
+gpd = lazy_import("geopandas")
+mpl = lazy_import("matplotlib")
+mcolors = lazy_import("matplotlib.colors")
+plt = lazy_import("matplotlib.pyplot")
+sns = lazy_import("seaborn")
+statannot = lazy_import("statannot")
+stats = lazy_import("scipy.stats")
 
 
 def folium_grid_cat_plot(gdf, var : str, cmap = 'Set1', 
-coordinates =(48.8534100,2.3488000),zoom_start=12.1, discrete = False, op = 0.6):
+coordinates =(48.8534100,2.3488000),zoom_start=12.1, discrete = False, op = 0.6,
+export = 'full', id_col = 'IdINSPIRE', decimals = 5, max_squares = 50000):
+    """
+    Choropleth of var on the INSPIRE grid.
+    cmap : name of a matplotlib colormap, or with discrete a dict label : color (the same color for a label
+    whatever the labels present in gdf, see helpers.LISA_COLORS)
+    export : how the squares are sent to the html map
+        'full' : every column and the full geometry with gdf.explore (popup with all the variables)
+        'light' : only id_col and var, with the coordinates rounded to decimals (5 <=> 1 meter)
+        'inspire' : only the id and the color of each square, the squares are rebuilt by the browser from the INSPIRE ids
+        'raster' : one image overlay, for national grids
+    max_squares : with 'light' and 'inspire', above this number of squares the 'raster' export is used
+    """
+    if export in ('light', 'inspire') and max_squares is not None and len(gdf) > max_squares:
+        export = 'raster'
+    if export == 'inspire':
+        return folium_grid_inspire_plot(gdf, var, cmap = cmap, coordinates = coordinates,
+            zoom_start = zoom_start, discrete = discrete, op = op, id_col = id_col)
+    if export == 'raster':
+        return folium_grid_raster_plot(gdf, var, cmap = cmap, coordinates = coordinates,
+            zoom_start = zoom_start, discrete = discrete, op = op, id_col = id_col)
+    popup = True
+    if export == 'light':
+        gdf = _light_grid(gdf, var, id_col = id_col, decimals = decimals)
+        popup = False
+    elif export != 'full':
+        raise ValueError(f"export {export} is not available. Please choose from ['full', 'light', 'inspire', 'raster']")
     if discrete:
-        colors = colormaps[cmap](range(len(gdf[var].unique())))
-        colors = ListedColormap(colors)
+        labels = _discrete_labels(gdf[var])
+        colors = mcolors.ListedColormap(_discrete_palette(labels, cmap))
         m = folium.Map(coordinates, zoom_start = zoom_start)
         m = gdf.explore(
             m = m,
             column = var,
             tooltip = var,
             tiles = 'OpenStreetMap',
-            popup = True,
+            popup = popup,
             cmap = colors,
             categorical = True,
+            # a Categorical column is drawn with its own categories
+            categories = None if isinstance(gdf[var].dtype, pd.CategoricalDtype) else list(labels),
             style_kwds = dict(color = "black", opacity = op,
             fillOpacity = 0.4)
         )
@@ -29,7 +71,7 @@ coordinates =(48.8534100,2.3488000),zoom_start=12.1, discrete = False, op = 0.6)
             column = var,
             tooltip = var,
             tiles = 'OpenStreetMap',
-            popup = True,
+            popup = popup,
             cmap = cmap,
             style_kwds = dict(color = "black", opacity = op,
             fillOpacity = 0.4)
@@ -38,79 +80,368 @@ coordinates =(48.8534100,2.3488000),zoom_start=12.1, discrete = False, op = 0.6)
 
     return m
 
-from matplotlib.colors import ListedColormap
-from matplotlib import colormaps, rc
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from statannot import add_stat_annotation
-from itertools import combinations
+def _light_grid(gdf, var, id_col = 'IdINSPIRE', decimals = 5):
+    """
+    Keep only the id and var columns and quantize the WGS-84 coordinates to decimals
+    """
+    import shapely
 
-def violin_plots(df, var_distinguante,nb_cluster,dico_var,
-                  cluster_column = 'label',log_scale_required =[],cmap ='Set1',ttest= True):
-    font = {'size'   : 33}
+    columns = [c for c in [id_col, var] if c in gdf.columns]
+    if id_col not in gdf.columns and gdf.index.name == id_col:
+        gdf = gdf.reset_index()
+        columns = [id_col, var]
+    geoms = gdf.geometry
+    if geoms.crs is not None:
+        geoms = geoms.to_crs(WGS84)
+    geoms = shapely.transform(np.asarray(geoms.values), lambda c: np.round(c, decimals))
+    return gpd.GeoDataFrame(gdf[columns].copy(), geometry = geoms, crs = WGS84)
 
-    rc('font', **font)
-    #plt.rcParams.update({'font.size': 44})    
-    colors = colormaps[cmap](range(nb_cluster))
-    colors = sns.color_palette(colors)
-    df = df.astype({cluster_column:"str"})
-    order = np.sort(df[cluster_column].unique())
-    fig,axs = plt.subplots(ncols = 2, nrows = len(var_distinguante)//2+(len(var_distinguante)%2),
-        figsize=(30,45))
-    i = 0
-    for i,var in enumerate(var_distinguante):
-        to_do_stat_on = []
-        for j in order:
-            if len(df[df[cluster_column]==j][var].dropna())>1:
-                to_do_stat_on.append(j)
-        pairs = list(combinations(to_do_stat_on, r=2))
-        ax = axs[(i-(i%2))//2][i%2]
-        x = cluster_column
-        y = var
-        ax = sns.violinplot(data=df, x=x, y=y, ax = ax, order = order, palette = colors, box_visible = True)
-        if var in log_scale_required:
-            ax.set_yscale('symlog')
-        if ttest:
-            ax, test_results = add_stat_annotation(ax, data=df, x=x, y=y, order=order,box_pairs=pairs,
-            test='t-test_ind',
-            text_format='star', loc='inside', verbose=0)
-        ax.set_ylabel(dico_var[var])
+def _discrete_labels(values):
+    """
+    Labels of a discrete variable in the order of the colors : the categories of a Categorical, else the sorted values
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return np.asarray(values.cat.categories)
+    return np.sort(values.dropna().unique())
 
-    fig.tight_layout()
-    plt.show()
+def _discrete_palette(labels, cmap = 'Set1'):
+    """
+    Hex colors of the labels : from a dict label : color, or the colors of the colormap cmap in the order of labels
+    """
+    if isinstance(cmap, dict):
+        return [mcolors.to_hex(cmap.get(l, cmap.get(str(l), "#000000"))) for l in labels]
+    return [mcolors.to_hex(c) for c in mpl.colormaps[cmap](range(len(labels)))]
 
-def boxplots(df, var_distinguante,nb_cluster,dico_var,
-                  cluster_column = 'label',log_scale_required =[],cmap ='Set1',ttest= True):
-    colors = colormaps[cmap](range(nb_cluster))
+def _grid_colors(values, cmap = 'Set1', discrete = False):
+    """
+    Vectorized colors of the squares.
+    Returns the color index of each value (-1 for missing values), the list of hex colors
+    and the legend as a dict label : hex color
+    """
+    values = pd.Series(values).reset_index(drop = True)
+    missing = values.isna().values
+    if discrete:
+        labels = [str(l) for l in _discrete_labels(values)]
+        palette = _discrete_palette(labels, cmap)
+        codes = pd.Categorical(values.astype(str), categories = labels).codes.astype(np.int64)
+        present = set(values.dropna().astype(str))
+        legend = {l : c for l, c in zip(labels, palette) if l in present}
+    else:
+        # 10 classes of the continuous colormap
+        norm = mcolors.Normalize(vmin = np.nanmin(values.values.astype(float)), vmax = np.nanmax(values.values.astype(float)))
+        palette = [mcolors.to_hex(c) for c in mpl.colormaps[cmap](np.linspace(0, 1, 10))]
+        codes = np.clip((norm(values.values.astype(float))*10).astype(np.int64), 0, 9)
+        bounds = np.linspace(norm.vmin, norm.vmax, 11)
+        legend = {f"{bounds[i]:.3g} - {bounds[i+1]:.3g}" : palette[i] for i in range(10)}
+    codes = np.where(missing, -1, codes)
+    return codes, palette, legend
+
+def _add_legend(m, legend, title):
+    items = "".join(f'<div><span style="background:{c};width:12px;height:12px;display:inline-block;margin-right:4px"></span>{l}</div>'
+        for l, c in legend.items())
+    html = f'<div style="position:fixed;bottom:30px;right:10px;z-index:9999;background:white;padding:6px;font-size:12px"><b>{title}</b>{items}</div>'
+    m.get_root().html.add_child(folium.Element(html))
+    return m
+
+# client side layer : the squares are rebuilt in the browser from (e, n) of their INSPIRE ids with proj4js
+_INSPIRE_SQUARES_TEMPLATE = """
+        {% macro script(this, kwargs) %}
+        proj4.defs("EPSG:3035", "+proj=laea +lat_0=52 +lon_0=10 +x_0=4321000 +y_0=3210000 +ellps=GRS80 +units=m +no_defs");
+        (function() {
+            var res = {{ this.res }};
+            var palette = {{ this.palette|tojson }};
+            var rows = {{ this.rows|tojson }};
+            var layer = L.featureGroup();
+            var toLatLng = function(x, y) {
+                var p = proj4("EPSG:3035", "EPSG:4326", [x, y]);
+                return [p[1], p[0]];
+            };
+            for (var i = 0; i < rows.length; i++) {
+                var e = rows[i][0], n = rows[i][1];
+                var color = rows[i][3] < 0 ? "#00000000" : palette[rows[i][3]];
+                L.polygon([toLatLng(e, n), toLatLng(e + res, n), toLatLng(e + res, n + res), toLatLng(e, n + res)],
+                    {color: "black", weight: 1, opacity: {{ this.op }}, fillColor: color, fillOpacity: 0.4})
+                    .bindTooltip({{ this.var|tojson }} + ": " + rows[i][2])
+                    .addTo(layer);
+            }
+            layer.addTo({{ this._parent.get_name() }});
+        })();
+        {% endmacro %}
+        """
+
+@lru_cache(maxsize=None)
+def _inspire_squares_class():
+    """
+    folium element of the client side INSPIRE layer (built at first use to not import branca before)
+    """
+    from branca.element import MacroElement
+    from jinja2 import Template
+
+    class InspireSquares(MacroElement):
+        _template = Template(_INSPIRE_SQUARES_TEMPLATE)
+
+        def __init__(self, rows, palette, res, var, op = 0.6):
+            super().__init__()
+            self._name = "InspireSquares"
+            self.rows = rows
+            self.palette = palette
+            self.res = res
+            self.var = var
+            self.op = op
+
+    return InspireSquares
+
+def folium_grid_inspire_plot(gdf, var : str, cmap = 'Set1',
+coordinates =(48.8534100,2.3488000),zoom_start=12.1, discrete = False, op = 0.6, id_col = 'IdINSPIRE'):
+    """
+    Choropleth where only (e, n, value, color index) of each square is sent to the html map.
+    The geometry of the squares is rebuilt by the browser from the INSPIRE ids (see helpers.grid).
+    """
+    from .grid import parse_inspire_ids
+
+    ids = gdf[id_col] if id_col in gdf.columns else pd.Series(gdf.index)
+    p = parse_inspire_ids(ids)
+    if p['res'].nunique() > 1:
+        raise ValueError("All the squares must have the same resolution")
+    codes, palette, legend = _grid_colors(gdf[var], cmap = cmap, discrete = discrete)
+    values = pd.Series(gdf[var].values)
+    labels = values.astype(str).values if discrete else values.round(3).astype(str).values
+    rows = pd.DataFrame({'e' : p['e'].values, 'n' : p['n'].values, 'v' : labels, 'c' : codes})
+    m = folium.Map(coordinates, zoom_start = zoom_start)
+    m.get_root().header.add_child(folium.JavascriptLink("https://cdnjs.cloudflare.com/ajax/libs/proj4js/2.9.0/proj4.js"))
+    _inspire_squares_class()(rows.values.tolist(), palette, int(p['res'].iloc[0]), var, op = op).add_to(m)
+    return _add_legend(m, legend, var)
+
+def folium_grid_raster_plot(gdf, var : str, cmap = 'Set1',
+coordinates =(48.8534100,2.3488000),zoom_start=12.1, discrete = False, op = 0.6, id_col = 'IdINSPIRE', res = None):
+    """
+    Choropleth as a single image overlay, for grids too big for vector layers (national maps).
+    The squares centers (from the INSPIRE ids if available, else from the geometries) are binned
+    in a regular lat/long raster of the size of a square.
+    """
+    if id_col in gdf.columns or gdf.index.name == id_col:
+        from .grid import parse_inspire_ids
+        ids = gdf[id_col] if id_col in gdf.columns else pd.Series(gdf.index)
+        long, lat = inspire_centers(ids)
+        if res is None:
+            res = float(parse_inspire_ids(ids)['res'].min())
+    else:
+        centroids = gdf.geometry.to_crs(INSPIRE_CRS).centroid
+        long, lat = project_xy(centroids.x.values, centroids.y.values, INSPIRE_CRS, WGS84)
+        if res is None:
+            res = 200.0
+    codes, palette, legend = _grid_colors(gdf[var], cmap = cmap, discrete = discrete)
+
+    dlat = res/111320
+    dlong = res/(111320*np.cos(np.radians(np.mean(lat))))
+    lat_max, long_min = np.max(lat) + dlat/2, np.min(long) - dlong/2
+    lat_min, long_max = np.min(lat) - dlat/2, np.max(long) + dlong/2
+    rows = ((lat_max - lat)/dlat).astype(np.int64)
+    cols = ((long - long_min)/dlong).astype(np.int64)
+    image = np.zeros((rows.max() + 1, cols.max() + 1, 4), dtype = np.uint8)
+    rgba = np.array([[int(c[i:i+2], 16) for i in (1, 3, 5)] + [255] for c in palette], dtype = np.uint8)
+    ok = codes >= 0
+    image[rows[ok], cols[ok]] = rgba[codes[ok]]
+
+    m = folium.Map(coordinates, zoom_start = zoom_start)
+    folium.raster_layers.ImageOverlay(image = image, bounds = [[lat_min, long_min], [lat_max, long_max]],
+        opacity = op, mercator_project = True, name = var).add_to(m)
+    return _add_legend(m, legend, var)
+
+# same thresholds as statannot's 'star' format
+pvalue_thresholds = [[1e-4, "****"], [1e-3, "***"], [1e-2, "**"], [0.05, "*"], [1, "ns"]]
+
+def _correct_pvalues(pvalues, method = 'bonferroni'):
+    """
+    Multiple testing correction of a 1d array of p-values (nan are ignored).
+    method : 'bonferroni', 'holm', 'fdr_bh' or None
+    """
+    pvalues = np.asarray(pvalues, dtype = float)
+    corrected = np.full(len(pvalues), np.nan)
+    ok = ~np.isnan(pvalues)
+    p = pvalues[ok]
+    m = len(p)
+    if m == 0 or method is None:
+        corrected[ok] = p
+        return corrected
+    if method == 'bonferroni':
+        c = p*m
+    elif method == 'holm':
+        idx = np.argsort(p)
+        c = np.empty(m)
+        c[idx] = np.maximum.accumulate(p[idx]*(m - np.arange(m)))
+    elif method == 'fdr_bh':
+        idx = np.argsort(p)[::-1]
+        c = np.empty(m)
+        c[idx] = np.minimum.accumulate(p[idx]*m/(m - np.arange(m)))
+    else:
+        raise ValueError(f"correction {method} is not available. Please choose from ['bonferroni', 'holm', 'fdr_bh', None]")
+    corrected[ok] = np.minimum(c, 1)
+    return corrected
+
+def pairwise_ttests(df, var_distinguante, cluster_column = 'label', order = None, correction = 'bonferroni'):
+    """
+    Independent two-sample t-tests (same as statannot 't-test_ind') for every pair of clusters
+    and every variable, computed at once from the groups means, variances and counts.
+    Clusters with less than 2 values of a variable are not tested for this variable.
+    correction : multiple testing correction applied for each variable (as statannot does for each plot),
+    see _correct_pvalues
+    Returns a DataFrame with one row by (variable, pair of clusters)
+    """
+    var_distinguante = list(var_distinguante)
+    groups = df.groupby(cluster_column)[var_distinguante]
+    count, mean, var = groups.count(), groups.mean(), groups.var(ddof = 1)
+    if order is None:
+        order = np.sort(count.index)
+    count, mean, var = count.reindex(order).fillna(0), mean.reindex(order), var.reindex(order)
+    i, j = np.triu_indices(len(order), k = 1)
+    n1, n2 = count.values[i], count.values[j]
+    dof = n1 + n2 - 2
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        pooled_var = ((n1 - 1)*var.values[i] + (n2 - 1)*var.values[j])/dof
+        t = (mean.values[i] - mean.values[j])/np.sqrt(pooled_var*(1/n1 + 1/n2))
+        p = 2*stats.t.sf(np.abs(t), dof)
+    tested = (n1 > 1) & (n2 > 1)
+    t, p = np.where(tested, t, np.nan), np.where(tested, p, np.nan)
+
+    n_pairs, n_var = t.shape
+    results = pd.DataFrame({
+        'variable' : np.tile(var_distinguante, n_pairs),
+        'group1' : np.repeat(np.asarray(order)[i], n_var),
+        'group2' : np.repeat(np.asarray(order)[j], n_var),
+        'n1' : n1.ravel().astype(int),
+        'n2' : n2.ravel().astype(int),
+        'statistic' : t.ravel(),
+        'pvalue' : p.ravel()})
+    results = results[tested.ravel()].sort_values(['variable', 'group1', 'group2'], kind = 'stable')
+    results['pvalue_corrected'] = results.groupby('variable')['pvalue'].transform(
+        lambda x: _correct_pvalues(x.values, correction))
+    bins = [-np.inf] + [t for t, _ in pvalue_thresholds]
+    results['annotation'] = pd.cut(results['pvalue_corrected'], bins = bins,
+        labels = [a for _, a in pvalue_thresholds]).astype(str)
+    return results.reset_index(drop = True)
+
+def stratified_sample(df, cluster_column = 'label', sample_size = 1000, random_state = 0):
+    """
+    Keep at most sample_size rows of each cluster (all the rows of smaller clusters)
+    """
+    shuffled = df.iloc[np.random.default_rng(random_state).permutation(len(df))]
+    keep = shuffled.groupby(cluster_column).cumcount().values < sample_size
+    return shuffled[keep].sort_index()
+
+def _cluster_kdes(df, var, cluster_column, order, points = 200, log_scale = False):
+    """
+    Gaussian KDE of var for each cluster, evaluated on a common grid.
+    log_scale : the KDE is done on arcsinh(var) (close to the symlog axis of log_scale_required), the grid is
+    evenly spaced on this scale so that the small values are not squashed
+    Returns (grid, {cluster : density scaled to a max of 1}, {cluster : median})
+    """
+    values = df[var].astype(float)
+    scaled = np.arcsinh(values) if log_scale else values
+    low, high = np.nanmin(scaled), np.nanmax(scaled)
+    grid = np.linspace(low, high, points)
+    densities, medians = {}, {}
+    for c in order:
+        x = values[df[cluster_column] == c].dropna().values
+        if len(x) == 0:
+            continue
+        medians[c] = np.median(x)
+        x = np.arcsinh(x) if log_scale else x
+        if len(x) < 2 or np.all(x == x[0]):
+            continue
+        d = stats.gaussian_kde(x)(grid)
+        densities[c] = d/d.max()
+    # back to the values of var
+    return (np.sinh(grid) if log_scale else grid), densities, medians
+
+def _plot_kde_violins(ax, grid, densities, medians, order, colors, width = 0.8):
+    for k, c in enumerate(order):
+        if c in densities:
+            d = densities[c]*width/2
+            ax.fill_betweenx(grid, k - d, k + d, color = colors[k], alpha = 0.8, linewidth = 1, edgecolor = '0.2')
+        if c in medians:
+            ax.scatter([k], [medians[c]], color = 'white', edgecolor = '0.2', zorder = 3)
+    ax.set_xticks(range(len(order)))
+    ax.set_xticklabels(order)
+    ax.set_xlim(-0.5, len(order) - 0.5)
+
+def _cluster_plots(kind, df, var_distinguante, nb_cluster, dico_var,
+                  cluster_column = 'label', log_scale_required = [], cmap = 'Set1', ttest = True,
+                  sample_size = None, kde = False, n_jobs = 1, correction = 'bonferroni', random_state = 0):
+    """
+    Shared code of violin_plots and boxplots.
+    The t-tests are all computed first (pairwise_ttests), the rows to draw are subsampled by cluster
+    if sample_size is given, and with kde (violins only) the densities of every subplot are computed
+    beforehand, in n_jobs threads. The drawing itself stays sequential since matplotlib is not thread-safe.
+    Returns the DataFrame of the t-tests
+    """
+    colors = mpl.colormaps[cmap](range(nb_cluster))
     colors = sns.color_palette(colors)
     df = df.astype({cluster_column:"str"})
     order = np.sort(df[cluster_column].unique())
-    fig,axs = plt.subplots(ncols = 2, nrows = len(var_distinguante)//2+(len(var_distinguante)%2),
-        figsize=(30,45))
-    i = 0
-
-    font = {'size'   : 33}
+    test_results = pairwise_ttests(df, var_distinguante, cluster_column = cluster_column,
+        order = order, correction = correction)
+    plot_df = df if sample_size is None else stratified_sample(df, cluster_column, sample_size, random_state)
 
-    rc('font', **font) 
+    kdes = {}
+    if kind == 'violin' and kde:
+        f = lambda var: _cluster_kdes(plot_df, var, cluster_column, order, log_scale = var in log_scale_required)
+        with ThreadPoolExecutor(max_workers = n_jobs) as executor:
+            kdes = dict(zip(var_distinguante, executor.map(f, var_distinguante)))
 
+    font = {'size'   : 33}
+    mpl.rc('font', **font)
+    fig,axs = plt.subplots(ncols = 2, nrows = len(var_distinguante)//2+(len(var_distinguante)%2),
+        figsize=(30,45), squeeze = False)
     for i,var in enumerate(var_distinguante):
-        to_do_stat_on = []
-        for j in order:
-            if len(df[df[cluster_column]==j][var].dropna())>1:
-                to_do_stat_on.append(j)
-        pairs = list(combinations(to_do_stat_on, r=2))
         ax = axs[(i-(i%2))//2][i%2]
         x = cluster_column
         y = var
-        ax = sns.boxplot(data=df, x=x, y=y, ax = ax, order = order, palette = colors)
+        if kind == 'violin' and kde:
+            _plot_kde_violins(ax, *kdes[var], order, colors)
+            ax.set_xlabel(x)
+        elif kind == 'violin':
+            ax = sns.violinplot(data=plot_df, x=x, y=y, ax = ax, order = order, palette = colors, box_visible = True)
+        else:
+            ax = sns.boxplot(data=plot_df, x=x, y=y, ax = ax, order = order, palette = colors)
         if var in log_scale_required:
             ax.set_yscale('symlog')
-        if ttest:
-            ax, test_results = add_stat_annotation(ax, data=df, x=x, y=y, order=order,box_pairs=pairs,
-            test='t-test_ind',
+        res = test_results[test_results['variable'] == var]
+        if ttest and len(res) > 0:
+            statannot.add_stat_annotation(ax, plot = 'boxplot', data=plot_df, x=x, y=y, order=order,
+            box_pairs=list(zip(res['group1'], res['group2'])),
+            perform_stat_test = False, pvalues = res['pvalue_corrected'].tolist(),
+            test_short_name = 't-test', comparisons_correction = None,
             text_format='star', loc='inside', verbose=0)
         ax.set_ylabel(dico_var[var])
 
     fig.tight_layout()
-    plt.show()
\ No newline at end of file
+    plt.show()
+    return test_results
+
+def violin_plots(df, var_distinguante,nb_cluster,dico_var,
+                  cluster_column = 'label',log_scale_required =[],cmap ='Set1',ttest= True,
+                  sample_size = None, kde = False, n_jobs = 1, correction = 'bonferroni'):
+    """
+    Violin plot of each variable of var_distinguante by cluster, with the t-tests between clusters.
+    sample_size : draw at most sample_size rows by cluster (the t-tests always use every row)
+    kde : draw the violins from gaussian KDEs computed beforehand (in n_jobs threads) instead of seaborn
+    correction : multiple testing correction of the p-values for each variable
+    Returns the DataFrame of the t-tests (see pairwise_ttests)
+    """
+    return _cluster_plots('violin', df, var_distinguante, nb_cluster, dico_var,
+        cluster_column = cluster_column, log_scale_required = log_scale_required, cmap = cmap, ttest = ttest,
+        sample_size = sample_size, kde = kde, n_jobs = n_jobs, correction = correction)
+
+def boxplots(df, var_distinguante,nb_cluster,dico_var,
+                  cluster_column = 'label',log_scale_required =[],cmap ='Set1',ttest= True,
+                  sample_size = None, correction = 'bonferroni'):
+    """
+    Boxplot of each variable of var_distinguante by cluster, with the t-tests between clusters.
+    sample_size : draw at most sample_size rows by cluster (the t-tests always use every row)
+    correction : multiple testing correction of the p-values for each variable
+    Returns the DataFrame of the t-tests (see pairwise_ttests)
+    """
+    return _cluster_plots('box', df, var_distinguante, nb_cluster, dico_var,
+        cluster_column = cluster_column, log_scale_required = log_scale_required, cmap = cmap, ttest = ttest,
+        sample_size = sample_size, correction = correction)
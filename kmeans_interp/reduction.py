@@ -0,0 +1,144 @@
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.decomposition import PCA, IncrementalPCA
+from sklearn.preprocessing import StandardScaler
+import numpy as np
+import pandas as pd
+
+from .kmeans_feature_imp import KMeansInterp
+
+
+def _chunks(X, chunk_size):
+    """
+    Iterator over the row chunks of X : an array / DataFrame, a list of chunks,
+    or a function returning a new iterator of chunks (read from files for instance)
+    """
+    if callable(X):
+        yield from X()
+    elif isinstance(X, (list, tuple)):
+        yield from X
+    else:
+        for start in range(0, len(X), chunk_size):
+            yield X[start:start + chunk_size]
+
+
+def _values(chunk):
+    return chunk.to_numpy(dtype=float) if isinstance(chunk, pd.DataFrame) else np.asarray(chunk, dtype=float)
+
+
+def _first(X):
+    if callable(X):
+        return next(iter(X()))
+    if isinstance(X, (list, tuple)):
+        return X[0]
+    return X
+
+
+def wcss_min_importances(centroids, names):
+    """
+    Same ordering as KMeansInterp.get_feature_imp_wcss_min : for each cluster, the features sorted by
+    the absolute value of the centroid coordinate
+    """
+    centroids = np.abs(centroids)
+    order = centroids.argsort(axis=1)[:, ::-1]
+    return {label: list(zip([names[f] for f in order[label]], centroids[label][order[label]]))
+            for label in range(len(centroids))}
+
+
+class ChunkedPCA(BaseEstimator, TransformerMixin):
+    """
+    PCA before the clustering of many features (hundreds of tag counts of
+    get_POI_cat_on_INSPIRE_grid(reduced_cat=False) and the Filosofi variables on a national grid).
+
+    method : "randomized" (randomized SVD, the data must fit in memory) or
+    "incremental" (IncrementalPCA, fitted chunk by chunk : X can be a list of chunks or a function
+    returning an iterator of chunks, it is read twice if standardize)
+    standardize : center and reduce the features before the PCA (as the clusters stage of the pipeline)
+    chunk_size : rows by chunk when X is an array
+    """
+
+    def __init__(self, n_components=10, method="randomized", standardize=True, chunk_size=50000, random_state=0):
+        self.n_components = n_components
+        self.method = method
+        self.standardize = standardize
+        self.chunk_size = chunk_size
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        first = _first(X)
+        self.feature_names_ = np.array(first.columns if isinstance(first, pd.DataFrame) else range(first.shape[1]))
+        self.scaler_ = StandardScaler(with_mean=self.standardize, with_std=self.standardize)
+        for chunk in _chunks(X, self.chunk_size):
+            self.scaler_.partial_fit(_values(chunk))
+
+        if self.method == "randomized":
+            Z = np.vstack([self.scaler_.transform(_values(chunk)) for chunk in _chunks(X, self.chunk_size)])
+            self.pca_ = PCA(n_components=self.n_components, svd_solver="randomized",
+                            random_state=self.random_state).fit(Z)
+        elif self.method == "incremental":
+            self.pca_ = IncrementalPCA(n_components=self.n_components)
+            for chunk in _chunks(X, self.chunk_size):
+                # IncrementalPCA needs at least n_components rows by chunk
+                self.pca_.partial_fit(self.scaler_.transform(_values(chunk)))
+        else:
+            raise Exception(f"{self.method} is not available. Please choose from ['randomized', 'incremental']")
+
+        self.components_ = self.pca_.components_
+        self.explained_variance_ratio_ = self.pca_.explained_variance_ratio_
+        self.component_names_ = [f"PC{k + 1}" for k in range(len(self.components_))]
+        return self
+
+    def transform(self, X):
+        return np.vstack([self.pca_.transform(self.scaler_.transform(_values(chunk)))
+                          for chunk in _chunks(X, self.chunk_size)])
+
+    @property
+    def loadings_(self):
+        """
+        Loadings (features x components) : correlation of each standardized feature with each component
+        """
+        loadings = self.components_.T * np.sqrt(self.pca_.explained_variance_)
+        return pd.DataFrame(loadings, index=self.feature_names_, columns=self.component_names_)
+
+    def to_features(self, points):
+        """
+        Coordinates in the components space (centroids) back in the (standardized) features space,
+        relative to the mean of the features
+        """
+        return np.asarray(points) @ self.components_
+
+
+class ReducedKMeansInterp(KMeansInterp):
+    """
+    KMeansInterp on the components of a ChunkedPCA (fitted in fit).
+    feature_importances_ are given for the original features (ordered_feature_names) :
+    with "wcss_min", the centroids are mapped back to the features through the components;
+    with "unsup2sup", the classifiers are trained on the original X (in memory).
+    component_importances_ are the "wcss_min" importances of the components.
+    """
+
+    def __init__(self, ordered_feature_names, reducer=None, feature_importance_method='wcss_min', **kwargs):
+        super(ReducedKMeansInterp, self).__init__(ordered_feature_names, feature_importance_method, **kwargs)
+        self.reducer = reducer
+
+    def fit(self, X, y=None, sample_weight=None):
+        self.reducer_ = self.reducer if self.reducer is not None else ChunkedPCA()
+        self.reducer_.fit(X)
+        if not len(self.ordered_feature_names) == len(self.reducer_.feature_names_):
+            raise Exception(f"Model is fitted on {len(self.reducer_.feature_names_)} features "
+                            f"but ordered_feature_names = {len(self.ordered_feature_names)}")
+        Z = self.reducer_.transform(X)
+        super(KMeansInterp, self).fit(X=Z, y=y, sample_weight=sample_weight)
+
+        self.component_importances_ = wcss_min_importances(self.cluster_centers_, self.reducer_.component_names_)
+        if self.feature_importance_method == "wcss_min":
+            self.feature_importances_ = wcss_min_importances(self.reducer_.to_features(self.cluster_centers_),
+                                                             self.ordered_feature_names)
+        elif self.feature_importance_method == "unsup2sup":
+            self.feature_importances_ = self.get_feature_imp_unsup2sup(_values(X))
+        else:
+            raise Exception(f" {self.feature_importance_method}" +
+                            "is not available. Please choose from  ['wcss_min' , 'unsup2sup']")
+        return self
+
+    def predict(self, X):
+        return super().predict(self.reducer_.transform(X))